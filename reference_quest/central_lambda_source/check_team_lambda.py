@@ -4,13 +4,21 @@ import os
 from datetime import datetime
 import boto3
 import json
+import content_catalog
 import dynamodb_utils
+import quests_api_cache
+import circuit_breaker
+import work_budget
 import quest_const
 import output_const
 import input_const
 import hint_const
 import scoring_const
-import http.client
+import outbox
+import probe_utils
+import sharding
+import profiling
+import url_utils
 import requests
 import time
 import ui_utils
@@ -26,7 +34,12 @@ ASSETS_BUCKET_PREFIX = os.environ['ASSETS_BUCKET_PREFIX']
 
 # Quest Environment Variables
 QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
-CHAOS_TIMER_MINUTES = os.environ['CHAOS_TIMER_MINUTES']
+
+# Time allowances for the evaluation stages: probing stages wait up to the 5 s probe timeout, the others only
+# make a few Quests API calls
+PROBE_STAGE_ALLOWANCE_MS = 6000
+API_STAGE_ALLOWANCE_MS = 2000
+OPTIONAL_WORK_ALLOWANCE_MS = 1000
 
 # Dynamo DB setup
 dynamodb = boto3.resource('dynamodb')
@@ -35,11 +48,15 @@ quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
 # This function is triggered by cron_lambda.py. It performs validation of team actions, such as assuming a role in their
 # AWS account to check resources or trigger chaos events, as well as updating progress, or posting a message to the team’s event UI.
 # Expected event payload is the QuestsAPI entry for this team
+@profiling.profiled
 def lambda_handler(event, context):
     print(f"check_team_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # Pick up quest content changes published since the previous invocation
+    content_catalog.refresh()
+
+    # Instantiate the Quest API Client, caching its lookups for this invocation
+    quests_api_client = quests_api_cache.CachingQuestsApiClient(GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN))
 
     # Check if event is running
     event_status = quests_api_client.get_event_status()
@@ -47,36 +64,109 @@ def lambda_handler(event, context):
         print(f"Event Status: {event_status}, aborting CHECK_TEAM_LAMBDA")
         return
 
-    dynamodb_response = quest_team_status_table.get_item(Key={'team-id': event['team-id']})
-    print(f"Retrieved quest team state for team {event['team-id']}: {json.dumps(dynamodb_response, default=str)}")
+    # Changes made by this run are tracked by the team state (see team_state), to validate whether a DynamoDB update is
+    # needed
+    team_data = dynamodb_utils.get_team_data(quest_team_status_table, event['team-id']) # Check init_lambda for the format
+    print(f"Retrieved quest team state for team {event['team-id']}: {json.dumps(team_data.to_dict(), default=str)}")
+
+    # Dashboard writes for the team are recorded in its outbox, and committed with its state by save_team_data
+    quests_api_client = outbox.OutboxQuestsApiClient(quests_api_client, team_data)
 
-    # Make a copy of the original array to be able later on to do a comparison and validate whether a DynamoDB update is needed    
-    team_data = dynamodb_response['Item'].copy() # Check init_lambda for the format
+    # Each stage only starts if its allowance fits in the remaining time, always keeping enough time to persist state
+    budget = work_budget.WorkBudget(context)
+
+    # Optional work deferred by a previous run goes first
+    work_budget.run_deferred(budget, team_data, OPTIONAL_WORK_ALLOWANCE_MS, OPTIONAL_WORK, quests_api_client, team_data)
 
     # Task 1 evaluation
-    team_data = evaluate_apprunner(quests_api_client, team_data)
+    budget.run_stage('evaluate_apprunner', PROBE_STAGE_ALLOWANCE_MS, evaluate_apprunner, quests_api_client, team_data, budget)
     
     # Task 2 evaluation
-    team_data = evaluate_release(quests_api_client, team_data)
+    budget.run_stage('evaluate_release', PROBE_STAGE_ALLOWANCE_MS, evaluate_release, quests_api_client, team_data)
 
     # Task 3 evaluation
-    team_data = evaluate_debug_mode(quests_api_client, team_data)
+    budget.run_stage('evaluate_debug_mode', API_STAGE_ALLOWANCE_MS, evaluate_debug_mode, quests_api_client, team_data, budget)
 
     # Task 4 evaluation
-    team_data = evaluate_db_migration(quests_api_client, team_data)
+    budget.run_stage('evaluate_db_migration', API_STAGE_ALLOWANCE_MS, evaluate_db_migration, quests_api_client, team_data)
 
     # Complete quest if everything is done
-    check_and_complete_quest(quests_api_client, QUEST_ID, team_data)
+    budget.run_stage('check_and_complete_quest', API_STAGE_ALLOWANCE_MS, check_and_complete_quest, quests_api_client, QUEST_ID, team_data)
 
-    # Compare initial DynamoDB item with its copy to check whether changes were made. 
-    if dynamodb_response['Item']==team_data:
+    # Check whether changes were made
+    if not team_data.changed():
         print("No changes throughout this run - no need to update the DynamoDB item")
     else:
         dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
+    # Deliver the dashboard writes of this run, and retry the outbox entries and score events that previous runs could
+    # not deliver to the Quests API
+    try:
+        budget.run_stage('outbox.deliver', API_STAGE_ALLOWANCE_MS, outbox.deliver,
+                         quests_api_client.quests_api_client, QUEST_ID, team_data, quest_team_status_table)
+    except Exception as err:
+        print(f"Error while delivering the outbox, pending entries will be retried: {err}")
+
+    # Cache hit rates of this container, to check that the cron keeps routing the teams of a shard to the same workers
+    sharding.report(event.get('shard'), team_data['team-id'], probe_utils.cache_stats)
+
+
+# Optional work, such as re-posting instructions or cleaning up hints. When the invocation is short on time it is
+# deferred through the team item, and the next run picks it up first.
+def repost_task1_input(quests_api_client, team_data):
+    quests_api_client.post_input(
+        team_id=team_data['team-id'],
+        quest_id=QUEST_ID,
+        key=input_const.TASK1_ENDPOINT_KEY,
+        label=input_const.TASK1_ENDPOINT_LABEL,
+        description=input_const.TASK1_ENDPOINT_DESCRIPTION,
+        dashboard_index=input_const.TASK1_ENDPOINT_INDEX
+    )
+
+
+def cleanup_task1_hint(quests_api_client, team_data):
+    response = quests_api_client.delete_hint(
+        team_id=team_data['team-id'],
+        quest_id=QUEST_ID,
+        hint_key=hint_const.TASK1_HINT1_KEY,
+        detail=True
+    )
+
+    # Handling a response status code other than 200 (or 202 when recorded in the outbox). In this case, we are just logging
+    if response['statusCode'] not in (200, 202):
+        print(response)
+
+
+def repost_task3_instructions(quests_api_client, team_data):
+    quests_api_client.post_output(
+            team_id=team_data['team-id'],
+            quest_id=QUEST_ID,
+            key=output_const.TASK3_KEY,
+            label=output_const.TASK3_LABEL,
+            value=output_const.TASK3_VALUE,
+            dashboard_index=output_const.TASK3_INDEX,
+            markdown=output_const.TASK3_MARKDOWN,
+        )
+
+    quests_api_client.post_input(
+            team_id=team_data['team-id'],
+            quest_id=QUEST_ID,
+            key=input_const.TASK3_DEBUG_KEY,
+            label=input_const.TASK3_DEBUG_LABEL,
+            description=input_const.TASK3_DEBUG_DESCRIPTION,
+            dashboard_index=input_const.TASK3_DEBUG_INDEX
+        )
+
+
+OPTIONAL_WORK = {
+    'repost-task1-input': repost_task1_input,
+    'cleanup-task1-hint': cleanup_task1_hint,
+    'repost-task3-instructions': repost_task3_instructions,
+}
+
 
 # Task 1 evaluation - Monitoring
-def evaluate_apprunner(quests_api_client, team_data):
+def evaluate_apprunner(quests_api_client, team_data, budget):
     print(f"Evaluating app runn deployment task for team {team_data['team-id']}")
 
     # Check whether task was completed already
@@ -85,16 +175,11 @@ def evaluate_apprunner(quests_api_client, team_data):
         if team_data['task1-attempted'] == False:
             if team_data['app-runner-url'] == 'unknown':
                 print("No app url - doing nothing")
-                quests_api_client.post_input(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=input_const.TASK1_ENDPOINT_KEY,
-                    label=input_const.TASK1_ENDPOINT_LABEL,
-                    description=input_const.TASK1_ENDPOINT_DESCRIPTION,
-                    dashboard_index=input_const.TASK1_ENDPOINT_INDEX
-                )
+                work_budget.run_or_defer(budget, team_data, 'repost-task1-input', OPTIONAL_WORK_ALLOWANCE_MS,
+                                         OPTIONAL_WORK, quests_api_client, team_data)
             else:
-                ready_check_webapp = check_webapp(team_data['app-runner-url'])
+                ready_check_webapp = circuit_breaker.guarded_probe(team_data, team_data['app-runner-url'],
+                                                                   lambda: check_webapp(team_data['app-runner-url']))
                 # If the app is up and returns 200 ok 
                 if ready_check_webapp == True:
                     print(f"The web application for team {team_data['team-id']} is UP")
@@ -102,7 +187,8 @@ def evaluate_apprunner(quests_api_client, team_data):
                 else:
                     print(f"The web application is DOWN")     
         else:
-            ready_check_webapp = check_webapp(team_data['app-runner-url'])
+            ready_check_webapp = circuit_breaker.guarded_probe(team_data, team_data['app-runner-url'],
+                                                               lambda: check_webapp(team_data['app-runner-url']))
             if not ready_check_webapp:
                 print("Resetting app-runner-url to unknown")
                 team_data['app-runner-url'] = 'unknown'
@@ -117,18 +203,12 @@ def evaluate_apprunner(quests_api_client, team_data):
                     team_data['is-apprunner-done'] = True
                     print("Setting start-task-2 to True")
                     team_data['start-task-2'] = True
-                    dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
-                    response = quests_api_client.delete_hint(
-                        team_id=team_data['team-id'],
-                        quest_id=QUEST_ID,
-                        hint_key=hint_const.TASK1_HINT1_KEY,
-                        detail=True
-                    )   
-                    
-                    # Handling a response status code other than 200. In this case, we are just logging
-                    if response['statusCode'] != 200:
-                        print(response)
+                    work_budget.run_or_defer(budget, team_data, 'cleanup-task1-hint', OPTIONAL_WORK_ALLOWANCE_MS,
+                                             OPTIONAL_WORK, quests_api_client, team_data)
+
+                    # The dashboard writes are recorded first, so that the transition and its writes are one save
+                    dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
                     # Prepare for Task 2 Post task 2 instructions
                     print("Starting Task 2")
@@ -138,21 +218,13 @@ def evaluate_apprunner(quests_api_client, team_data):
             team_data['is-apprunner-done'] = True
             print("Setting start-task-2 to True")
             team_data['start-task-2'] = True
-            dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
             quests_api_client.delete_output(
                     team_id=team_data["team-id"],
                     quest_id=QUEST_ID, 
-                    key=output_const.TASK1_APPRUNNER_DOWN_KEY
+                    key=output_const.TASK1_APPRUNNER_WRONG_KEY
                 )
 
-            quests_api_client.delete_hint(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID, 
-                hint_key=hint_const.TASK1_HINT1_KEY,
-                detail=True
-            )
-
             quests_api_client.post_output(
                 team_id=team_data['team-id'],
                 quest_id=QUEST_ID,
@@ -202,22 +274,17 @@ def evaluate_apprunner(quests_api_client, team_data):
                 hint_key=hint_const.TASK2_HINT1_KEY,
                 label=hint_const.TASK2_HINT1_LABEL,
                 description=hint_const.TASK2_HINT1_DESCRIPTION,
-                value=hint_const.TASK1_HINT2_VALUE,
+                value=hint_const.TASK2_HINT1_VALUE,
                 dashboard_index=hint_const.TASK2_HINT1_INDEX,
-                cost=hint_const.TASK1_HINT2_COST,
+                cost=hint_const.TASK2_HINT1_COST,
                 status=hint_const.STATUS_OFFERED
             )
 
-            response = quests_api_client.delete_hint(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                hint_key=hint_const.TASK1_HINT1_KEY,
-                detail=True
-            )   
-            
-            # Handling a response status code other than 200. In this case, we are just logging
-            if response['statusCode'] != 200:
-                print(response)
+            work_budget.run_or_defer(budget, team_data, 'cleanup-task1-hint', OPTIONAL_WORK_ALLOWANCE_MS,
+                                     OPTIONAL_WORK, quests_api_client, team_data)
+
+            # The dashboard writes are recorded first, so that the transition and its writes are one save
+            dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
             print(team_data)
 
@@ -231,9 +298,7 @@ def evaluate_apprunner(quests_api_client, team_data):
 def check_webapp(apprunnerurl):
     try:
         print(f"Testing web app status using URL {apprunnerurl}")
-        conn = http.client.HTTPSConnection(apprunnerurl.strip('https://'), timeout=5)
-        conn.request("GET", "/")
-        res = conn.getresponse()
+        res = probe_utils.get(url_utils.app_host(apprunnerurl), "/")
         status = res.status
         print(f"The status code returned it {status}")
         if status != 200:
@@ -282,11 +347,8 @@ def evaluate_release(quests_api_client, team_data):
 def getAppRelease(team_data):
     try:
         print(f"Getting current version via API")
-        conn = http.client.HTTPSConnection(team_data['app-runner-url'].strip('https://'), timeout=5)
-        conn.request("GET", "/status")
-        res = conn.getresponse()
-        dataResp = json.loads(res)
-        if dataResp['app-version'] == team_data['app-version']:
+        app_version = probe_utils.get_json_field(url_utils.app_host(team_data['app-runner-url']), "/status", 'app-version')
+        if app_version == team_data['app-version']:
             return True
         else:
             raise Exception(f"The version does not match")
@@ -296,30 +358,13 @@ def getAppRelease(team_data):
 
 
 # Task 3 - Debug 
-def evaluate_debug_mode(quests_api_client, team_data):
+def evaluate_debug_mode(quests_api_client, team_data, budget):
     if team_data['start-task-3'] == True and not team_data['is-debug-mode'] and not team_data['task3-score-locked']:
         print("Task 3 - Executing the start of debug mode module")
 
         if team_data['debugcode'] == 'unknown':
-
-            quests_api_client.post_output(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=output_const.TASK3_KEY,
-                    label=output_const.TASK3_LABEL,
-                    value=output_const.TASK3_VALUE,
-                    dashboard_index=output_const.TASK3_INDEX,
-                    markdown=output_const.TASK3_MARKDOWN,
-                )
-
-            quests_api_client.post_input(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=input_const.TASK3_DEBUG_KEY,
-                    label=input_const.TASK3_DEBUG_LABEL,
-                    description=input_const.TASK3_DEBUG_DESCRIPTION,
-                    dashboard_index=input_const.TASK3_DEBUG_INDEX
-                )
+            work_budget.run_or_defer(budget, team_data, 'repost-task3-instructions', OPTIONAL_WORK_ALLOWANCE_MS,
+                                     OPTIONAL_WORK, quests_api_client, team_data)
         else:
             print("Task 3 - Conditions for execution not met")
 
@@ -413,31 +458,6 @@ def check_and_complete_quest(quests_api_client, quest_id, team_data):
     return False
 
 
-# Checks whether the chaos event timer is up by calculating the difference between the current time and 
-# the timer's start time plus the minutes to trigger the chaos event
-def is_chaos_timer_up(timer_start_time, timer_minutes):
-
-    # Timer start time
-    start_time = datetime.fromtimestamp(timer_start_time)
-
-    # Current time
-    current_time = datetime.now()
-
-    # Time difference
-    time_diff = current_time - start_time
-    
-    # Time difference in minutes
-    minutes = int(time_diff.total_seconds() / 60)
-
-    if minutes >= timer_minutes:
-        print(f"Chaos event timer is up: {minutes} minutes have elapsed")
-        return True
-    else:
-        print(f"No time for chaos event yet: {timer_minutes - minutes} minutes left")
-
-    return False
-
-
 # Calculate quest completion bonus points
 # This is to reward teams that complete the quest faster
 def calculate_bonus_points(quests_api_client, quest_id, team_data):
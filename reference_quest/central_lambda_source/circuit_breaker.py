@@ -0,0 +1,80 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import time
+from urllib.parse import urlsplit
+
+# Per-host circuit breaker for team app probes. A team app that is down costs a full probe timeout on every check, so
+# after repeated failures the circuit opens and probes fail fast until the open period is over. A single half-open
+# probe then decides whether to close the circuit again or keep it open.
+# The state is kept in the team item, so it survives across invocations and is persisted by save_team_data. Format:
+# 'probe-circuits': {host: {'state': CLOSED|OPEN|HALF_OPEN, 'failures': int, 'opened-at': epoch seconds}}
+CIRCUITS_ATTRIBUTE = 'probe-circuits'
+
+STATE_CLOSED = "CLOSED"
+STATE_OPEN = "OPEN"
+STATE_HALF_OPEN = "HALF_OPEN"
+
+# Consecutive failures that open the circuit
+FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '3'))
+# How long an open circuit fails fast before allowing a half-open probe
+OPEN_SECONDS = int(os.environ.get('CIRCUIT_OPEN_SECONDS', '300'))
+
+
+# Circuits are tracked per target host, so all the probes of a team app (/, /status, /teamdebug, /health) share one
+def circuit_key(url):
+    url = str(url)
+    return urlsplit(url if '://' in url else f"https://{url}").netloc.lower() or url
+
+
+def get_circuit(team_data, url):
+    circuits = team_data.setdefault(CIRCUITS_ATTRIBUTE, {})
+    return circuits.setdefault(circuit_key(url), {'state': STATE_CLOSED, 'failures': 0, 'opened-at': 0})
+
+
+# Whether a probe may be sent now. An open circuit whose open period is over moves to half-open and allows one probe.
+def allow_probe(team_data, url):
+    circuit = get_circuit(team_data, url)
+    if circuit['state'] != STATE_OPEN:
+        return True
+    if int(time.time()) - int(circuit['opened-at']) >= OPEN_SECONDS:
+        circuit['state'] = STATE_HALF_OPEN
+        return True
+    return False
+
+
+def record_success(team_data, url):
+    circuit = get_circuit(team_data, url)
+    circuit['state'] = STATE_CLOSED
+    circuit['failures'] = 0
+
+
+def record_failure(team_data, url):
+    circuit = get_circuit(team_data, url)
+    circuit['failures'] = int(circuit['failures']) + 1
+    if circuit['state'] == STATE_HALF_OPEN or circuit['failures'] >= FAILURE_THRESHOLD:
+        circuit['state'] = STATE_OPEN
+        circuit['opened-at'] = int(time.time())
+        print(f"Circuit for {circuit_key(url)} is open, probes fail fast for {OPEN_SECONDS} seconds")
+
+
+# A new team submission is a strong hint that the app changed: let the next probe through immediately
+def force_half_open(team_data, url):
+    circuit = get_circuit(team_data, url)
+    if circuit['state'] == STATE_OPEN:
+        circuit['state'] = STATE_HALF_OPEN
+
+
+# Runs probe() through the circuit of the given URL.
+# :param probe: callable returning True when the team app answered as expected
+# :returns: the probe result, or False without probing while the circuit is open
+def guarded_probe(team_data, url, probe):
+    if not allow_probe(team_data, url):
+        print(f"Circuit for {circuit_key(url)} is open, skipping probe")
+        return False
+    result = probe()
+    if result:
+        record_success(team_data, url)
+    else:
+        record_failure(team_data, url)
+    return result
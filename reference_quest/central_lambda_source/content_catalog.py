@@ -0,0 +1,111 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+import hint_const
+import input_const
+import output_const
+import scoring_const
+
+# Hot-reloadable quest content. Labels, values, hint costs, dashboard indexes and points can be overridden during an
+# event from a JSON document in S3 (s3://bucket/key) or on the local file system, without repackaging the Lambdas.
+# The document maps each content module to the constants it overrides:
+# {"output_const": {"TASK1_LABEL": "..."}, "scoring_const": {"CORRECT_APPRUNNER_POINTS": 400}, ...}
+# Only existing constants can be overridden, with a value of the same type. Constants removed from the document get
+# their packaged value back.
+#
+# Handlers call refresh() on each invocation. The document is revalidated at most every CONTENT_CATALOG_TTL_SECONDS,
+# with a conditional request on its ETag, so an unchanged document is neither downloaded nor parsed again.
+CONTENT_CATALOG_URI = os.environ.get('CONTENT_CATALOG_URI', '')
+CONTENT_CATALOG_TTL_SECONDS = int(os.environ.get('CONTENT_CATALOG_TTL_SECONDS', '60'))
+
+CONTENT_MODULES = {module.__name__: module for module in [output_const, hint_const, input_const, scoring_const]}
+
+# Packaged value of each constant, indexed by module name then constant name
+packaged = {
+    name: {attr: value for attr, value in vars(module).items() if attr.isupper()}
+    for name, module in CONTENT_MODULES.items()
+}
+
+# Current overrides, indexed like packaged
+catalog = {}
+catalog_etag = None
+next_check = 0
+
+s3_client = None
+
+
+# Fetches the document unless it still has the given ETag
+# :returns: tuple of (etag, document text), or (etag, None) when it was not modified
+def fetch_document(uri, etag):
+    global s3_client
+    if uri.startswith('s3://'):
+        bucket, _, key = uri[len('s3://'):].partition('/')
+        if s3_client is None:
+            s3_client = boto3.client('s3')
+        params = {'Bucket': bucket, 'Key': key}
+        if etag:
+            params['IfNoneMatch'] = etag
+        try:
+            response = s3_client.get_object(**params)
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('304', 'NotModified'):
+                return etag, None
+            raise err
+        return response['ETag'], response['Body'].read().decode('utf-8')
+
+    # Local files use their modification time and size as ETag
+    stat = os.stat(uri)
+    local_etag = f"{stat.st_mtime_ns}-{stat.st_size}"
+    if local_etag == etag:
+        return etag, None
+    with open(uri, encoding='utf-8') as document:
+        return local_etag, document.read()
+
+
+# Parses the document into an indexed catalog of valid overrides. Invalid entries are logged and ignored.
+def parse_catalog(text):
+    parsed = {}
+    for module_name, overrides in json.loads(text).items():
+        if module_name not in packaged or not isinstance(overrides, dict):
+            print(f"Unknown content module {module_name} in content catalog, ignoring it")
+            continue
+        for name, value in overrides.items():
+            if name not in packaged[module_name]:
+                print(f"Unknown constant {module_name}.{name} in content catalog, ignoring it")
+            elif type(value) is not type(packaged[module_name][name]):
+                print(f"Constant {module_name}.{name} in content catalog must be a "
+                      f"{type(packaged[module_name][name]).__name__}, ignoring it")
+            else:
+                parsed.setdefault(module_name, {})[name] = value
+    return parsed
+
+
+# Patches the content modules so that they hold the catalog values, restoring the packaged ones for the rest
+def apply_catalog(new_catalog):
+    for module_name, module in CONTENT_MODULES.items():
+        overrides = new_catalog.get(module_name, {})
+        for name in set(catalog.get(module_name, {})) | set(overrides):
+            setattr(module, name, overrides.get(name, packaged[module_name][name]))
+
+
+# Reloads the catalog if its TTL expired and the document changed. On any error the current content is kept.
+def refresh():
+    global catalog, catalog_etag, next_check
+    if not CONTENT_CATALOG_URI or time.monotonic() < next_check:
+        return
+    next_check = time.monotonic() + CONTENT_CATALOG_TTL_SECONDS
+    try:
+        etag, text = fetch_document(CONTENT_CATALOG_URI, catalog_etag)
+        if text is None:
+            return
+        new_catalog = parse_catalog(text)
+        apply_catalog(new_catalog)
+        catalog, catalog_etag = new_catalog, etag
+        print(f"Loaded content catalog {CONTENT_CATALOG_URI} ({etag}): "
+              f"{sum(len(overrides) for overrides in catalog.values())} overrides")
+    except Exception as err:
+        print(f"Error while loading content catalog {CONTENT_CATALOG_URI}, keeping current content: {err}")
@@ -1,10 +1,17 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import collections
 import os
 import boto3
 import json
 import quest_const
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import quest_registry
+import sharding
+import profiling
+import progress_utils
+import traffic_capture
+import dynamodb_utils
+from boto3.dynamodb.conditions import Key
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -14,34 +21,86 @@ GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 
 # Quest Environment Variables
 CHECK_TEAM_LAMBDA = os.environ['CHECK_TEAM_LAMBDA']
+QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
+NEEDS_EVALUATION_INDEX = os.environ['NEEDS_EVALUATION_INDEX']
 
-# Lambda Client Setup
-lambda_client = boto3.client('lambda')
+# Clients shared with every registered quest
+lambda_client = quest_registry.lambda_client
 
 
+@profiling.profiled
 def lambda_handler(event, context):
     print(f"cron_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # Operator request to rebuild the event progress aggregate of the quest of this stack: {'recompute_progress': True}.
+    # The other registered quests are recomputed by their own stacks, as the role cannot scan their tables.
+    if event.get('recompute_progress'):
+        quest = quest_registry.get_quest(QUEST_ID)
+        return {QUEST_ID: progress_utils.recompute_progress(quest_registry.get_team_status_table(quest))}
+
+    traffic_capture.capture(traffic_capture.SOURCE_CRON, event)
+
+    # Quest API Client, shared by the quests of the event
+    quests_api_client = quest_registry.get_quests_api_client()
     # Check if event is running
     event_status = quests_api_client.get_event_status()
     if event_status['status'] != quest_const.EVENT_IN_PROGRESS:
         print(f"Event Status: {event_status}, aborting CRON_LAMBDA")
         return
 
-    # Get all teams that are in any way engaging with this Quest
-    active_teams = quests_api_client.get_teams_for_quest(QUEST_ID)
-    print(f"Active teams to fan out checks: {active_teams}")
+    # One sweep for every registered quest. A failing quest is logged and does not prevent the others from being checked.
+    for quest in quest_registry.load_registry().values():
+        try:
+            sweep_quest(quest, quests_api_client)
+        except Exception as err:
+            print(f"Error while sweeping quest {quest.quest_id}: {err}")
 
-    # Find IN_PROGRESS teams and evaluate them
-    for team in active_teams:
+
+def sweep_quest(quest, quests_api_client):
+    # Only the teams whose quest is in progress are checked: the quest of the other teams is not started yet or was
+    # stopped, and checking them would post their inputs and hints again
+    in_progress = set()
+    for team in quests_api_client.get_teams_for_quest(quest.quest_id):
         if team['quest-state'] == quest_const.TEAM_QUEST_IN_PROGRESS:
-            lambda_response = lambda_client.invoke(
-                FunctionName=CHECK_TEAM_LAMBDA,
-                InvocationType='Event',
-                Payload=json.dumps(team, default=str))
-            print(f"Fanned out check for team {team['team-id']}, " +
-                  f"async Lambda invocation response: {json.dumps(lambda_response, default=str)}")
+            in_progress.add(team['team-id'])
         else:
             print(f"Skipping team {team['team-id']} with Quest status: {team['quest-state']}")
+
+    # Query the NeedsEvaluationIndex for the teams with work left, rather than reading every team item to find them.
+    # Completed teams drop out of the index once their deliveries are done, so the read cost falls as teams finish.
+    # The role can only query the index of the other quests' tables, whose backfill is done by their own stacks
+    if quest_registry.is_local_quest(quest):
+        dynamodb_utils.backfill_needs_evaluation(quest_registry.get_team_status_table(quest))
+    team_ids = [team_id for team_id in get_teams_needing_evaluation(quest) if team_id in in_progress]
+    print(f"Active teams of quest {quest.quest_id} to fan out checks: {team_ids}")
+
+    # Each team is always checked by the worker of its shard, so that it hits the caches of the same containers
+    teams_per_shard = collections.Counter()
+    for team_id in team_ids:
+        shard, worker = sharding.worker_for(quest, team_id)
+        teams_per_shard[shard] += 1
+        check_params = {'team-id': team_id, 'shard': shard}
+        lambda_response = lambda_client.invoke(
+            FunctionName=worker,
+            InvocationType='Event',
+            Payload=json.dumps(check_params, default=str))
+        print(f"Fanned out check for team {team_id} to {worker}, " +
+              f"async Lambda invocation response: {json.dumps(lambda_response, default=str)}")
+    if quest.check_team_shards:
+        print(f"Teams of quest {quest.quest_id} per shard: {dict(sorted(teams_per_shard.items()))}")
+
+
+# Returns the IDs of the teams of a quest flagged as needing evaluation, following the query pagination
+def get_teams_needing_evaluation(quest):
+    quest_team_status_table = quest_registry.get_team_status_table(quest)
+    team_ids = []
+    query_params = {
+        'IndexName': quest.needs_evaluation_index,
+        'KeyConditionExpression': Key(dynamodb_utils.NEEDS_EVALUATION_ATTRIBUTE).eq(dynamodb_utils.NEEDS_EVALUATION_VALUE),
+    }
+    while True:
+        dynamodb_response = quest_team_status_table.query(**query_params)
+        team_ids.extend(item['team-id'] for item in dynamodb_response['Items'])
+        if 'LastEvaluatedKey' not in dynamodb_response:
+            return team_ids
+        query_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
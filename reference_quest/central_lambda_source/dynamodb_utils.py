@@ -1,10 +1,95 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import hashlib
 import json
+import time
 from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
+import outbox
+import progress_utils
+import state_codec
+import team_state
 
+# Attribute indexed by the sparse NeedsEvaluationIndex GSI. It is present on the teams that still have work for
+# CHECK_TEAM_LAMBDA, i.e. every team that has not completed the quest yet, and the completed teams with deliveries
+# left. The index therefore excludes the completed teams and the reserved items, but not the teams in progress: the
+# cron still intersects it with the teams whose quest is in progress.
+NEEDS_EVALUATION_ATTRIBUTE = 'needs-evaluation'
+NEEDS_EVALUATION_VALUE = 'PENDING'
 
+# Reserved item recording that the needs-evaluation attribute was backfilled on the team items of the table
+NEEDS_EVALUATION_BACKFILL_ID = '#needs-evaluation-backfill'
+
+# Tables whose backfill was done or attempted by this container
+backfilled_tables = set()
+
+
+# Whether a team still has work for CHECK_TEAM_LAMBDA: an unfinished quest, or outbox entries or score events left
+# to deliver
+def needs_evaluation(team_data):
+    return (progress_utils.team_stage(team_data) != progress_utils.STAGE_COMPLETE
+            or outbox.has_pending(team_data))
+
+
+# Sets or removes the sparse needs-evaluation attribute before the item is written
+def mark_evaluation(team_data):
+    if needs_evaluation(team_data):
+        team_data[NEEDS_EVALUATION_ATTRIBUTE] = NEEDS_EVALUATION_VALUE
+    else:
+        team_data.pop(NEEDS_EVALUATION_ATTRIBUTE, None)
+
+
+# One-off backfill of the needs-evaluation attribute on the team items written before it existed, which the index
+# would otherwise never return. The backfill is recorded by a reserved item, so it scans the table only once. A failure
+# is logged and retried by the next container, as the sweep itself does not depend on it.
+def backfill_needs_evaluation(quest_status_table):
+    if quest_status_table.name in backfilled_tables:
+        return
+    backfilled_tables.add(quest_status_table.name)
+    try:
+        if 'Item' in quest_status_table.get_item(Key={'team-id': NEEDS_EVALUATION_BACKFILL_ID}):
+            return
+        backfilled = 0
+        scan_params = {'FilterExpression': Attr(NEEDS_EVALUATION_ATTRIBUTE).not_exists()}
+        while True:
+            dynamodb_response = quest_status_table.scan(**scan_params)
+            for item in dynamodb_response['Items']:
+                if item['team-id'].startswith('#') or not needs_evaluation(state_codec.decode(item)):
+                    continue
+                try:
+                    quest_status_table.update_item(
+                        Key={'team-id': item['team-id']},
+                        UpdateExpression='SET #attribute = :value',
+                        ExpressionAttributeNames={'#attribute': NEEDS_EVALUATION_ATTRIBUTE},
+                        ExpressionAttributeValues={':value': NEEDS_EVALUATION_VALUE},
+                        ConditionExpression=Attr('version').eq(item['version'])
+                    )
+                    backfilled += 1
+                except ClientError as err:
+                    if err.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+                        raise err
+            if 'LastEvaluatedKey' not in dynamodb_response:
+                break
+            scan_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
+        quest_status_table.put_item(Item={
+            'team-id': NEEDS_EVALUATION_BACKFILL_ID,
+            'backfilled-at': int(time.time()),
+            'backfilled-teams': backfilled,
+        })
+        print(f"Backfilled {NEEDS_EVALUATION_ATTRIBUTE} on {backfilled} teams of {quest_status_table.name}")
+    except Exception as err:
+        print(f"Error while backfilling {NEEDS_EVALUATION_ATTRIBUTE} in {quest_status_table.name}, continuing: {err}")
+
+
+# Reads the item of a team, in the layout used by the handlers (see state_codec and team_state)
+# :returns: the team data as a TeamState, None if the team has no item
+def get_team_data(quest_status_table, team_id):
+    dynamodb_response = quest_status_table.get_item(Key={'team-id': team_id})
+    return team_state.TeamState.from_item(dynamodb_response.get('Item'))
+
+
+# Writes the team data in the compact layout (see state_codec). A TeamState read from a compact item only has its
+# changed attributes written, while items still in the expanded layout are migrated by writing them whole.
 def save_team_data(team_data, quest_status_table):
 
     # Get the item's current version
@@ -13,19 +98,151 @@ def save_team_data(team_data, quest_status_table):
     # Increase the version number
     team_data["version"] += 1
 
+    # Track the team's stage so that the event progress aggregate can be updated on transitions
+    previous_stage = team_data.get(progress_utils.STAGE_ATTRIBUTE)
+    team_data[progress_utils.STAGE_ATTRIBUTE] = progress_utils.team_stage(team_data)
+    mark_evaluation(team_data)
+
     # Try updating the item, but only if it hasn't been updated by another function. Some possible scenarios:
     # 1. Race condition between CHECK_TEAM_LAMBDA and UPDATE_LAMBDA with the former going first
     # 2. Race condition between CHECK_TEAM_LAMBDA and UPDATE_LAMBDA with the latter going first
     # 3. Race condition between two executions of UPDATE_LAMBDA due to rapid button clicks
     try:
-        print(f"Storing team data back to DynamoDb: {json.dumps(team_data, default=str)}")
-        dynamodb_response = quest_status_table.put_item(
-            Item=team_data,
-            ConditionExpression=Attr("version").eq(current_version)
-        )
+        if isinstance(team_data, team_state.TeamState) and team_data.schema == state_codec.SCHEMA_VERSION:
+            changed = team_data.changed()
+            print(f"Storing team data changes back to DynamoDb: {json.dumps({attribute: team_data.get(attribute) for attribute in changed}, default=str)}")
+            update_expression, names, values = state_codec.encode_changes(team_data, changed)
+            dynamodb_response = quest_status_table.update_item(
+                Key={'team-id': team_data['team-id']},
+                UpdateExpression=update_expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ConditionExpression=Attr("version").eq(current_version)
+            )
+        else:
+            item = team_data.to_dict() if isinstance(team_data, team_state.TeamState) else team_data
+            print(f"Storing team data back to DynamoDb: {json.dumps(item, default=str)}")
+            dynamodb_response = quest_status_table.put_item(
+                Item=state_codec.encode(item),
+                ConditionExpression=Attr("version").eq(current_version)
+            )
     except ClientError as err:
         if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
             raise ValueError("The item was updated by another function since this function started. Check with the developer whether it is safe to ignore this error (the quest is not left in an inconsistent state for the team)") from err
         else:
             raise err
-    print(f"Persisted team data back to the quest team status table: {json.dumps(dynamodb_response)}")
\ No newline at end of file
+    print(f"Persisted team data back to the quest team status table: {json.dumps(dynamodb_response)}")
+    if isinstance(team_data, team_state.TeamState):
+        team_data.mark_saved(state_codec.SCHEMA_VERSION)
+
+    record_progress(quest_status_table, team_data['team-id'], previous_stage, team_data[progress_utils.STAGE_ATTRIBUTE])
+
+
+# Creates the team item only if the team does not exist yet, so that a redelivered or duplicate QUEST_IN_PROGRESS
+# message never resets the progress of a team. Pass overwrite=True to deliberately reset an existing team.
+# :returns: True if the item was written, False if the team already existed
+def create_team_data(team_data, quest_status_table, overwrite=False):
+    team_data[progress_utils.STAGE_ATTRIBUTE] = progress_utils.team_stage(team_data)
+    mark_evaluation(team_data)
+    previous_stage = None
+    try:
+        if overwrite:
+            dynamodb_response = quest_status_table.put_item(Item=state_codec.encode(team_data), ReturnValues='ALL_OLD')
+            previous_stage = dynamodb_response.get('Attributes', {}).get(progress_utils.STAGE_ATTRIBUTE)
+        else:
+            dynamodb_response = quest_status_table.put_item(
+                Item=state_codec.encode(team_data),
+                ConditionExpression=Attr("team-id").not_exists()
+            )
+    except ClientError as err:
+        if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
+            print(f"Team {team_data['team-id']} already exists in the quest team status table, not overwriting it")
+            return False
+        else:
+            raise err
+    print(f"Created team data in the quest team status table: {json.dumps(dynamodb_response, default=str)}")
+
+    record_progress(quest_status_table, team_data['team-id'], previous_stage, team_data[progress_utils.STAGE_ATTRIBUTE])
+    return True
+
+
+# Updates the event progress aggregate after a team item was persisted. The aggregate is informational only,
+# so a failure is logged rather than failing the state transition that was already committed, and the counts are
+# corrected by progress_utils.recompute_progress.
+def record_progress(quest_status_table, team_id, previous_stage, stage):
+    try:
+        progress_utils.record_transition(quest_status_table, team_id, previous_stage, stage)
+    except Exception as err:
+        print(f"Error while recording progress transition for team {team_id}: {err}")
+
+
+# Retries of the keys left unprocessed by a BatchGetItem request, e.g. when the table is throttled, with an
+# exponential backoff starting at BATCH_GET_BACKOFF_SECONDS
+BATCH_GET_MAX_RETRIES = 5
+BATCH_GET_BACKOFF_SECONDS = 0.05
+
+
+# Returns the subset of team_ids that already have an item in the quest team status table,
+# reading only the keys through BatchGetItem (up to 100 keys per request)
+def get_existing_team_ids(dynamodb, quest_status_table_name, team_ids):
+    # BatchGetItem rejects a request holding the same key twice
+    team_ids = list(dict.fromkeys(str(team_id) for team_id in team_ids))
+    existing = set()
+    for start in range(0, len(team_ids), 100):
+        request_items = {
+            quest_status_table_name: {
+                'Keys': [{'team-id': team_id} for team_id in team_ids[start:start + 100]],
+                'ProjectionExpression': '#team_id',
+                'ExpressionAttributeNames': {'#team_id': 'team-id'},
+            }
+        }
+        retries = 0
+        while True:
+            dynamodb_response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in dynamodb_response['Responses'].get(quest_status_table_name, []):
+                existing.add(item['team-id'])
+            request_items = dynamodb_response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            if retries == BATCH_GET_MAX_RETRIES:
+                raise RuntimeError(f"BatchGetItem on {quest_status_table_name} left keys unprocessed after {retries} retries")
+            time.sleep(BATCH_GET_BACKOFF_SECONDS * 2 ** retries)
+            retries += 1
+    return existing
+
+
+# Admission step for team submissions: rapid button clicks produce several identical INPUT_UPDATED events, and only the
+# first one within the window should be evaluated. The submission is recorded with a conditional write on an item that
+# expires through the table's TTL (expires-at), so duplicates are rejected by DynamoDB without reading anything.
+# :returns: True if the submission was admitted, False if it is a duplicate within the window
+def admit_submission(submission_table, team_id, key, value, window_seconds):
+    now = int(time.time())
+    submission_id = get_submission_id(team_id, key, value)
+    try:
+        submission_table.put_item(
+            Item={
+                'submission-id': submission_id,
+                'submitted-at': now,
+                'expires-at': now + window_seconds,
+            },
+            # TTL deletion is lazy, so an expired item that still exists must not block the submission
+            ConditionExpression=Attr("submission-id").not_exists() | Attr("expires-at").lt(now)
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
+            print(f"Duplicate submission {submission_id} within {window_seconds}s, dropping it")
+            return False
+        else:
+            raise err
+    return True
+
+
+# Removes the record of an admitted submission whose evaluation failed, so that the retry of the invocation is not
+# dropped as a duplicate
+def release_submission(submission_table, team_id, key, value):
+    submission_table.delete_item(Key={'submission-id': get_submission_id(team_id, key, value)})
+
+
+def get_submission_id(team_id, key, value):
+    value_hash = hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:16]
+    return f"{team_id}#{key}#{value_hash}"
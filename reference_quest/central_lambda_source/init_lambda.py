@@ -4,10 +4,16 @@ import os
 import boto3
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import input_const
 import output_const
 import hint_const
 import cfn_utils
+import content_catalog
+import dynamodb_utils
+import profiling
+import quests_api_cache
+import ssm_utils
 import ui_utils
 from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
 
@@ -26,108 +32,217 @@ QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
 dynamodb = boto3.resource('dynamodb')
 quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
 
+# Initialization outcomes reported per team
+INIT_STATUS_INITIALIZED = "INITIALIZED"
+INIT_STATUS_ALREADY_INITIALIZED = "ALREADY_INITIALIZED"
+INIT_STATUS_MISSING_CREDENTIALS = "ABORTED_MISSING_CREDENTIALS"
+INIT_STATUS_OPERATOR_FILL = "ABORTED_OPERATOR_FILL"
+INIT_STATUS_FAILED = "FAILED"
+
+# Upper bound on the number of teams prepared and published concurrently in bulk mode
+INIT_MAX_WORKERS = int(os.environ.get('INIT_MAX_WORKERS', '16'))
+
 # This function is triggered by sns_lambda.py. It performs Quest initialization actions for a given team, such as 
 # adding the team to a DynamoDB table tracking internal progress, or posting a welcome message to the team’s event UI.
 # Expected event parameters: {'team_id': team_id}
+# Bulk mode, e.g. when an operator enables the quest for the whole event: {'team_ids': [team_id, ...]}
+# Teams that are already initialized are skipped. Operators can deliberately reset teams by adding 'reinit': True.
+# Returns the initialization outcome per team: {team_id: {'status': ..., 'error': ...}}
+# The invocation fails once every team was handled if any of them failed, so that it is retried when it was
+# dispatched by sns_lambda. Teams initialized meanwhile are skipped by the retry.
+@profiling.profiled
 def lambda_handler(event, context):
     print(f"Quest {QUEST_ID} INIT_LAMBDA invocation, event={json.dumps(event, default=str)}, context={str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # Pick up quest content changes published since the previous invocation
+    content_catalog.refresh()
+
+    # Instantiate the Quest API Client, caching its lookups for this invocation
+    quests_api_client = quests_api_cache.CachingQuestsApiClient(GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN))
+
+    # Get the team_id(s) from the previous event sent by the Lambda that called this function (sns_lambda) or by the operator
+    team_ids = event['team_ids'] if 'team_ids' in event else [event['team_id']]
+
+    outcomes = initialize_teams(quests_api_client, team_ids, reinit=event.get('reinit', False))
+    print(f"Quest {QUEST_ID} INIT_LAMBDA outcomes: {json.dumps(outcomes, default=str)}")
+    failed = [team_id for team_id, outcome in outcomes.items() if outcome['status'] == INIT_STATUS_FAILED]
+    if failed:
+        raise RuntimeError(f"Initialization failed for teams {failed}: {outcomes[failed[0]]['error']}")
+    return outcomes
+
+
+# Initializes several teams in three phases: a single BatchGetItem skips the teams that are already initialized,
+# per-team preparation (team lookup, STS, SSM) runs concurrently, and each prepared team is then created with a
+# conditional write and gets its dashboard published, concurrently across teams.
+# :param reinit: when True, existing teams are reset to their initial state and their dashboards re-posted
+def initialize_teams(quests_api_client, team_ids, reinit=False):
+    outcomes = {}
+    prepared = []
+
+    # Fast path for redelivered or duplicate messages: no STS, SSM or Quests API work for initialized teams
+    if not reinit:
+        existing = dynamodb_utils.get_existing_team_ids(dynamodb, QUEST_TEAM_STATUS_TABLE, team_ids)
+        for team_id in team_ids:
+            if str(team_id) in existing:
+                print(f"Team {team_id} is already initialized, skipping")
+                outcomes[team_id] = {'status': INIT_STATUS_ALREADY_INITIALIZED}
+        team_ids = [team_id for team_id in team_ids if team_id not in outcomes]
+        if not team_ids:
+            return outcomes
+
+    with ThreadPoolExecutor(max_workers=max(1, min(INIT_MAX_WORKERS, len(team_ids)))) as executor:
+        futures = {executor.submit(prepare_team, quests_api_client, team_id): team_id for team_id in team_ids}
+        for future in as_completed(futures):
+            team_id = futures[future]
+            try:
+                status, team = future.result()
+            except Exception as err:
+                print(f"Error while preparing team {team_id}: {err}")
+                outcomes[team_id] = {'status': INIT_STATUS_FAILED, 'error': str(err)}
+                continue
+            if status == INIT_STATUS_INITIALIZED:
+                prepared.append(team)
+            else:
+                outcomes[team_id] = {'status': status}
+
+    if not prepared:
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=max(1, min(INIT_MAX_WORKERS, len(prepared)))) as executor:
+        futures = {executor.submit(create_team, quests_api_client, team, reinit): team['team-id'] for team in prepared}
+        for future in as_completed(futures):
+            team_id = futures[future]
+            try:
+                outcomes[team_id] = {'status': future.result()}
+            except Exception as err:
+                print(f"Error while initializing team {team_id}: {err}")
+                outcomes[team_id] = {'status': INIT_STATUS_FAILED, 'error': str(err)}
+
+    return outcomes
+
+
+# Creates the QUEST_TEAM_STATUS_TABLE item for a prepared team and publishes its initial dashboard.
+# The dashboard is only published by the invocation that actually created the item.
+def create_team(quests_api_client, team, reinit=False):
+    if not dynamodb_utils.create_team_data(initial_team_item(team['team-id']), quest_team_status_table, overwrite=reinit):
+        return INIT_STATUS_ALREADY_INITIALIZED
+    print(f"Created team {team['team-id']} in {QUEST_TEAM_STATUS_TABLE}")
+
+    publish_initial_dashboard(quests_api_client, team)
+    return INIT_STATUS_INITIALIZED
 
-    # Get the team_id from the previous event sent by the Lambda that called this function (sns_lambda)
-    team_id = event['team_id']
 
+# Collects everything needed to initialize a team: its Quests API entry and the LD credentials from its SSM Parameter Store
+# :returns: tuple of (status, {'team-id', 'table-number', 'ld-credentials'})
+def prepare_team(quests_api_client, team_id):
     # Get team data for this quest
     team_data = quests_api_client.get_team(team_id=team_id)
-    team_table = team_data['table-number']
 
     ## get LD credentials, which should've been filled out prior to starting the Event
     xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
     xa_ssm_client = xa_session.client('ssm') # get team's SSM client
-    ld_server_key = xa_ssm_client.get_parameter(Name='LD-ServerKey', WithDecryption=True)['Parameter']['Value']
-    ld_client_key = xa_ssm_client.get_parameter(Name='LD-ClientKey', WithDecryption=True)['Parameter']['Value']
-    ld_signonurl = xa_ssm_client.get_parameter(Name='LD-SignOnUrl', WithDecryption=True)['Parameter']['Value']
+    ld_credentials = ssm_utils.get_team_credentials(xa_ssm_client, ssm_utils.LD_CREDENTIAL_PARAMS) # single GetParameters round trip
 
+    if ld_credentials.missing:
+        print("********************************************************************************************")
+        print(f"Team credentials {list(ld_credentials.missing)} missing from SSM Parameter Store for team {team_id}, aborting INIT_LAMBDA!!")
+        print("********************************************************************************************")
+        return INIT_STATUS_MISSING_CREDENTIALS, None
 
-    if ld_server_key == "OPERATOR_FILL" or ld_client_key == "OPERATOR_FILL":
+    if ld_credentials.is_operator_fill():
         print("********************************************************************************************")
         print(f"Operator has not properly configured Gremlin assets vending machine, aborting INIT_LAMBDA!!")
         print("********************************************************************************************")
-        return
-
+        return INIT_STATUS_OPERATOR_FILL, None
 
     # Retrieve CloudFormation stack outputs
     # accesskey_value = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "UserAccessKeyName")
 
-    # Populate the QUEST_TEAM_STATUS_TABLE for this team
-    dynamo_put_response = quest_team_status_table.put_item(
-        Item={
-            'team-id': str(team_id),
-            'quest-start-time': int(datetime.datetime.now().timestamp()),
-            'task1-attempted': False,
-            'task2-attempted': False,
-            'task3-attempted': False,
-            'task4-attempted': False,
-            'task1-score-locked': False,
-            'task2-score-locked': False,
-            'task3-score-locked': False,
-            'task4-score-locked': False,
-            'start-task-2': False,
-            'start-task-3': False,
-            'start-task-4': False,
-            'app-runner-url': 'unknown',
-            'debugcode': 'unknown',
-            'is-webapp-up': False,
-            'app-version': 'unknown',            
-            'is-website-released': False,
-            'is-debug-mode': False,
-            'is-apprunner-done': False,
-            'is-db-migrated': False,
-            'migration-location': 'unknown',
-            'is-answer-to-life-correct': False,
-            'version': 0 # This is for optimistic locking
-        }
-    )
-    print(f"Created team {team_id} in {QUEST_TEAM_STATUS_TABLE}. Response: {json.dumps(dynamo_put_response, default=str)}")
+    return INIT_STATUS_INITIALIZED, {
+        'team-id': str(team_id),
+        'table-number': team_data['table-number'],
+        'ld-credentials': ld_credentials,
+    }
 
-    # Post welcome message to the team
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.WELCOME_KEY,
-        label=output_const.WELCOME_LABEL,
-        value=output_const.WELCOME_VALUE,
-        dashboard_index=output_const.WELCOME_INDEX,
-        markdown=output_const.WELCOME_MARKDOWN,
-    )
 
-    # Post task 1 instructions
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK1_KEY,
-        label=output_const.TASK1_LABEL,
-        value=output_const.TASK1_VALUE.format(GAMEDAY_REGION),
-        dashboard_index=output_const.TASK1_INDEX,
-        markdown=output_const.TASK1_MARKDOWN,
-    )
+# Initial QUEST_TEAM_STATUS_TABLE item for a team
+def initial_team_item(team_id):
+    return {
+        'team-id': str(team_id),
+        'quest-start-time': int(datetime.datetime.now().timestamp()),
+        'task1-attempted': False,
+        'task2-attempted': False,
+        'task3-attempted': False,
+        'task4-attempted': False,
+        'task1-score-locked': False,
+        'task2-score-locked': False,
+        'task3-score-locked': False,
+        'task4-score-locked': False,
+        'start-task-2': False,
+        'start-task-3': False,
+        'start-task-4': False,
+        'app-runner-url': 'unknown',
+        'debugcode': 'unknown',
+        'is-webapp-up': False,
+        'app-version': 'unknown',            
+        'is-website-released': False,
+        'is-debug-mode': False,
+        'is-apprunner-done': False,
+        'is-db-migrated': False,
+        'migration-location': 'unknown',
+        'is-answer-to-life-correct': False,
+        'task1-invalid-url-posted': False,
+        'version': 0 # This is for optimistic locking
+    }
 
-    
-    quests_api_client.post_output(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        key=output_const.TASK1_CREDS_KEY,
-        value=f"""
+
+# Posts the welcome message, task 1 instructions, credentials and task 1 input for a prepared team.
+# The outputs are independent of each other and are posted concurrently. The task 1 input is only posted
+# once they are all in place, so that a team never sees the input before the instructions it refers to.
+def publish_initial_dashboard(quests_api_client, team):
+    team_id = team['team-id']
+    team_table = team['table-number']
+    ld_credentials = team['ld-credentials']
+
+    outputs = [
+        # Post welcome message to the team
+        dict(
+            team_id=team_id,
+            quest_id=QUEST_ID,
+            key=output_const.WELCOME_KEY,
+            label=output_const.WELCOME_LABEL,
+            value=output_const.WELCOME_VALUE,
+            dashboard_index=output_const.WELCOME_INDEX,
+            markdown=output_const.WELCOME_MARKDOWN,
+        ),
+        # Post task 1 instructions
+        dict(
+            team_id=team_id,
+            quest_id=QUEST_ID,
+            key=output_const.TASK1_KEY,
+            label=output_const.TASK1_LABEL,
+            value=output_const.TASK1_VALUE.format(GAMEDAY_REGION),
+            dashboard_index=output_const.TASK1_INDEX,
+            markdown=output_const.TASK1_MARKDOWN,
+        ),
+        dict(
+            team_id=team_id,
+            quest_id=QUEST_ID,
+            key=output_const.TASK1_CREDS_KEY,
+            value=f"""
 ### Credentials Below:
 * **TEAM ID:** {team_table} 
-* **LD_SERVER_KEY:** {ld_server_key}
-* **LD_CLIENT_KEY:** {ld_client_key} 
-* **LD-SignOnUrl:** [Click Here]({ld_signonurl})
+* **LD_SERVER_KEY:** {ld_credentials.ld_server_key}
+* **LD_CLIENT_KEY:** {ld_credentials.ld_client_key} 
+* **LD-SignOnUrl:** [Click Here]({ld_credentials.ld_signon_url})
         """,
-        dashboard_index=output_const.TASK1_CREDS_INDEX,
-        markdown=True,
-    )
+            dashboard_index=output_const.TASK1_CREDS_INDEX,
+            markdown=True,
+        ),
+    ]
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        # list() re-raises the first failed post, if any
+        list(executor.map(lambda output: quests_api_client.post_output(**output), outputs))
 
     # quests_api_client.post_output(
     #     team_id=team_id,
@@ -139,7 +254,7 @@ def lambda_handler(event, context):
     # )
 
     quests_api_client.post_input(
-        team_id=team_data['team-id'],
+        team_id=team_id,
         quest_id=QUEST_ID,
         key=input_const.TASK1_ENDPOINT_KEY,
         label=input_const.TASK1_ENDPOINT_LABEL,
@@ -7,6 +7,8 @@ from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
 import urllib3
 import json
 import traceback
+import ssm_utils
+import profiling
 
 SUCCESS = "SUCCESS"
 FAILED = "FAILED"
@@ -18,9 +20,10 @@ QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
 GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 ASSETS_BUCKET = os.environ['ASSETS_BUCKET']
 ASSETS_BUCKET_PREFIX = os.environ['ASSETS_BUCKET_PREFIX']
-TEAM_SSM_PARAMS_NEEDED=['LD-ServerKey','LD-ClientKey','LD-SignOnUrl','TableNumber']
+TEAM_SSM_PARAMS_NEEDED=ssm_utils.TEAM_CREDENTIAL_PARAMS
 
 http = urllib3.PoolManager()
+@profiling.profiled
 def lambda_handler(event, context):
     try:
         print(f"event: {json.dumps(event)}")
@@ -100,34 +103,7 @@ def lambda_handler(event, context):
 
                             # upload team's LD credentials to their team account's SSM Parameter Store
                             print(f"Loading Team Credentials onto team acct SSM params for  {team['team-id']}")
-                            xa_ssm_client.put_parameter(Name='LD-ServerKey',
-                                                        Description="LaunchDarkly Server key",
-                                                        Value=launchdarkly_credentials['serverkey'],
-                                                        Overwrite=True,
-                                                        Tier="Standard",
-                                                        Type="String",
-                                                        DataType="text")
-                            xa_ssm_client.put_parameter(Name='LD-ClientKey',
-                                                        Description="LaunchDarkly Client key",
-                                                        Value=launchdarkly_credentials['clientkey'],
-                                                        Overwrite=True,
-                                                        Tier="Standard",
-                                                        Type="String",
-                                                        DataType="text")
-                            xa_ssm_client.put_parameter(Name='LD-SignOnUrl',
-                                                        Description="LaunchDarkly SignOn URL",
-                                                        Value=launchdarkly_credentials['signonurl'],
-                                                        Overwrite=True,
-                                                        Tier="Standard",
-                                                        Type="String",
-                                                        DataType="text")
-                            xa_ssm_client.put_parameter(Name='TableNumber',
-                                                        Description="Table Number of the Team",
-                                                        Value=launchdarkly_credentials['table'],
-                                                        Overwrite=True,
-                                                        Tier="Standard",
-                                                        Type="String",
-                                                        DataType="text")
+                            ssm_utils.put_team_credentials(xa_ssm_client, launchdarkly_credentials)
 
 
                 print("Account Vending successful")
@@ -146,13 +122,13 @@ def lambda_handler(event, context):
         traceback.print_exc()
         return
 
-# check whether all team credentials are already loaded in SSM Parameter Store
+# check whether all team credentials are already loaded in SSM Parameter Store (single GetParameters round trip)
 def all_team_cred_params_exist(xa_ssm_client):
     try:
-        for param in TEAM_SSM_PARAMS_NEEDED:
-            xa_ssm_client.get_parameter(Name=param, WithDecryption=True)['Parameter']['Value']
-
-        return True
+        team_credentials = ssm_utils.get_team_credentials(xa_ssm_client)
+        if not team_credentials.is_complete():
+            print(f"Missing team credentials: {list(team_credentials.missing)}")
+        return team_credentials.is_complete()
     except Exception as e:
         print(e)
         return False
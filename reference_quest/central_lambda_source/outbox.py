@@ -0,0 +1,225 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import os
+import time
+from decimal import Decimal
+import boto3
+import dynamodb_utils
+import quests_api_pipeline
+import score_ledger
+
+# Transactional outbox for the dashboard side effects of the team state transitions. Instead of calling the Quests API
+# after saving the state (and losing the call if the function fails in between), handlers record the dashboard writes
+# in the team item, so they are committed by the same save_team_data call as the state. The drainer (OutboxLambda, or
+# the handler itself when OUTBOX_LAMBDA is not set) then delivers them with the pending score events, and
+# CHECK_TEAM_LAMBDA retries whatever is left. Format:
+# 'outbox': {entry_id: {'method': str, 'params': dict, 'queued-at': int, 'attempts': int}}
+# 'outbox-sequence': number of entries ever recorded for the team, entry IDs being zero-padded sequence numbers
+#
+# Entries are delivered in order for each dashboard element (output, input or hint key), and concurrently across
+# elements. Completing the quest comes last: after every entry recorded before it and the pending score events, so that
+# the quest is only completed once the team has its final messages and points. Delivery is at least once: dashboard writes are idempotent, so an entry delivered again after a failed
+# save only rewrites the same value.
+OUTBOX_LAMBDA = os.environ.get('OUTBOX_LAMBDA', '')
+
+OUTBOX_ATTRIBUTE = 'outbox'
+SEQUENCE_ATTRIBUTE = 'outbox-sequence'
+
+# Quests API client methods recorded in the outbox
+RECORDED_WRITES = {'post_output', 'delete_output', 'post_input', 'delete_input', 'post_hint', 'delete_hint',
+                   'post_quest_complete'}
+
+# Recorded methods delivered after all the other entries and score events of the team
+FINAL_WRITES = {'post_quest_complete'}
+
+# Entries failing this many deliveries are dropped, so that they cannot hold up their dashboard element forever
+MAX_ATTEMPTS = 5
+
+# Number of entries delivered concurrently
+DRAIN_MAX_WORKERS = 8
+
+lambda_client = boto3.client('lambda')
+
+
+# Records a Quests API call in the outbox of a team
+# :returns: the entry ID
+def record(team_data, method, params):
+    sequence = int(team_data.get(SEQUENCE_ATTRIBUTE, 0)) + 1
+    team_data[SEQUENCE_ATTRIBUTE] = sequence
+    entry_id = f"{sequence:010d}"
+    team_data.setdefault(OUTBOX_ATTRIBUTE, {})[entry_id] = {
+        'method': method,
+        'params': params,
+        'queued-at': int(time.time() * 1000),
+        'attempts': 0,
+    }
+    return entry_id
+
+
+# Outbox entries of a team, in the order they were recorded
+def pending_entries(team_data):
+    return sorted(team_data.get(OUTBOX_ATTRIBUTE, {}).items())
+
+
+# Dashboard element written by an entry. Entries on the same element are delivered in order.
+def dashboard_element(entry):
+    params = entry['params']
+    return entry['method'].split('_', 1)[-1], params.get('key', params.get('hint_key'))
+
+
+# DynamoDB returns numbers as Decimal, which the Quests API client cannot serialize
+def plain(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
+
+
+# Recording proxy over the Quests API client: the dashboard writes for the team are recorded in its outbox rather than
+# called, so that they are committed with the next save of the team state. Reads, score events and writes for other
+# teams go to the client.
+class OutboxQuestsApiClient:
+
+    def __init__(self, quests_api_client, team_data):
+        self.quests_api_client = quests_api_client
+        self.team_data = team_data
+        # Version of the team item when the last entry was recorded
+        self.recorded_version = None
+
+    def __getattr__(self, name):
+        method = getattr(self.quests_api_client, name)
+        if name not in RECORDED_WRITES:
+            return method
+
+        def record_write(**kwargs):
+            if kwargs.get('team_id') != self.team_data['team-id']:
+                return method(**kwargs)
+            entry_id = record(self.team_data, name, kwargs)
+            self.recorded_version = self.team_data['version']
+            print(f"Recorded {name} as outbox entry {entry_id} of team {self.team_data['team-id']}")
+            return {'statusCode': 202, 'outbox-entry': entry_id}
+        return record_write
+
+    # Whether entries were recorded since the team state was last saved
+    def has_uncommitted(self):
+        return self.recorded_version is not None and self.recorded_version == self.team_data['version']
+
+    # Saves the team state if entries were recorded since its last save
+    def commit(self, quest_status_table):
+        if self.has_uncommitted():
+            dynamodb_utils.save_team_data(self.team_data, quest_status_table)
+
+
+class DeliveryRejected(Exception):
+    pass
+
+
+# The Quests API client reports failures through the status code of its responses rather than by raising, so a
+# response other than 200 is raised: the entry stays in the outbox and the later entries on its element wait for it
+def deliver_entry(quests_api_client, method, params):
+    response = getattr(quests_api_client, method)(**params)
+    if response['statusCode'] != 200:
+        raise DeliveryRejected(f"{method} returned status code {response['statusCode']}: {response}")
+    return response
+
+
+# Delivers the outbox entries of a team, removes the delivered ones and persists the outbox. Failed entries stay, as
+# well as the later entries on their dashboard element, and are retried by the next drain.
+# :returns: number of entries delivered
+def drain(quests_api_client, team_data, quest_status_table):
+    entries = pending_entries(team_data)
+    if not entries:
+        return 0
+
+    pipeline = quests_api_pipeline.QuestsApiPipeline(quests_api_client, DRAIN_MAX_WORKERS)
+    last_on_element = {}
+    # Last final entry enqueued, which every later entry waits for
+    barrier = None
+    unknown = []
+    for entry_id, entry in entries:
+        if entry['method'] not in RECORDED_WRITES:
+            print(f"Unknown outbox method {entry['method']}, dropping entry {entry_id}")
+            unknown.append(entry_id)
+            continue
+        if entry['method'] in FINAL_WRITES:
+            if score_ledger.pending_entries(team_data):
+                print(f"Holding outbox entry {entry_id} of team {team_data['team-id']} and the later ones until the score events are delivered")
+                break
+            barrier = pipeline.run(entry_id, deliver_entry, quests_api_client, entry['method'], plain(entry['params']),
+                                   after=list(pipeline.calls))
+            last_on_element = {}
+            continue
+        element = dashboard_element(entry)
+        after = [last_on_element[element]] if element in last_on_element else [barrier] if barrier else []
+        last_on_element[element] = pipeline.run(entry_id, deliver_entry, quests_api_client, entry['method'],
+                                                plain(entry['params']), after=after)
+    results = pipeline.flush()
+
+    delivered = [entry_id for entry_id, result in results.items() if result.error is None]
+    failed = [entry_id for entry_id, result in results.items()
+              if result.error is not None and not isinstance(result.error, quests_api_pipeline.DependencyFailed)]
+    if not delivered and not failed and not unknown:
+        return 0
+
+    def apply(team_data):
+        outbox = team_data.get(OUTBOX_ATTRIBUTE, {})
+        for entry_id in delivered + unknown:
+            outbox.pop(entry_id, None)
+        for entry_id in failed:
+            if entry_id not in outbox:
+                continue
+            outbox[entry_id]['attempts'] = int(outbox[entry_id]['attempts']) + 1
+            if outbox[entry_id]['attempts'] >= MAX_ATTEMPTS:
+                print(f"Outbox entry {entry_id} of team {team_data['team-id']} failed {MAX_ATTEMPTS} times, dropping it: {json.dumps(outbox[entry_id], default=str)}")
+                del outbox[entry_id]
+        if not outbox:
+            team_data.pop(OUTBOX_ATTRIBUTE, None)
+
+    apply(team_data)
+    try:
+        dynamodb_utils.save_team_data(team_data, quest_status_table)
+    except ValueError:
+        # The item changed since it was loaded: re-apply the delivery on the latest version once
+        team_data.reload(dynamodb_utils.get_team_data(quest_status_table, team_data['team-id']))
+        apply(team_data)
+        dynamodb_utils.save_team_data(team_data, quest_status_table)
+    print(f"Delivered {len(delivered)} outbox entries for team {team_data['team-id']}, {len(failed)} failed")
+    return len(delivered)
+
+
+# Delivers everything a team has left to deliver: the outbox entries, then the pending score events, then the final
+# entries held back until the score events were delivered
+def deliver(quests_api_client, quest_id, team_data, quest_status_table):
+    drain(quests_api_client, team_data, quest_status_table)
+    score_ledger.flush(quests_api_client, quest_id, team_data, quest_status_table)
+    if has_final(team_data) and not score_ledger.pending_entries(team_data):
+        drain(quests_api_client, team_data, quest_status_table)
+
+
+# Whether the outbox of a team holds final entries, see FINAL_WRITES
+def has_final(team_data):
+    return any(entry['method'] in FINAL_WRITES for entry in team_data.get(OUTBOX_ATTRIBUTE, {}).values())
+
+
+# Whether a team has outbox entries or score events left to deliver
+def has_pending(team_data):
+    return bool(team_data.get(OUTBOX_ATTRIBUTE)) or bool(score_ledger.pending_entries(team_data))
+
+
+# Hands the committed side effects of a team to the drainer: OutboxLambda, invoked asynchronously so that the handler
+# returns as soon as the state is committed, or this function when OUTBOX_LAMBDA is not set
+def dispatch(quests_api_client, quest_id, team_data, quest_status_table):
+    if not has_pending(team_data):
+        return
+    if OUTBOX_LAMBDA:
+        lambda_client.invoke(
+            FunctionName=OUTBOX_LAMBDA,
+            InvocationType='Event',
+            Payload=json.dumps({'team_id': team_data['team-id']})
+        )
+    else:
+        deliver(quests_api_client, quest_id, team_data, quest_status_table)
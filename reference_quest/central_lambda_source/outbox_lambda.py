@@ -0,0 +1,38 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import os
+import boto3
+import dynamodb_utils
+import outbox
+import profiling
+import quests_api_cache
+from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+
+# Standard AWS GameDay Quests Environment Variables
+QUEST_ID = os.environ['QUEST_ID']
+QUEST_API_BASE = os.environ['QUEST_API_BASE']
+QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
+
+# Quest Environment Variables
+QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
+
+# Dynamo DB setup
+dynamodb = boto3.resource('dynamodb')
+quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
+
+
+# This function is invoked asynchronously by update_lambda.py once a team state transition is committed. It delivers
+# the outbox entries and pending score events of the team to the Quests API, see outbox.py.
+# Expected event parameters: {'team_id': team_id}
+@profiling.profiled
+def lambda_handler(event, context):
+    print(f"outbox_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
+
+    team_data = dynamodb_utils.get_team_data(quest_team_status_table, event['team_id'])
+    if team_data is None:
+        print(f"Team {event['team_id']} not found, nothing to deliver")
+        return
+
+    quests_api_client = quests_api_cache.CachingQuestsApiClient(GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN))
+    outbox.deliver(quests_api_client, QUEST_ID, team_data, quest_team_status_table)
@@ -49,6 +49,14 @@ Uh oh! The URL you entered isn't returning any data! Its possible the URL is wro
 TASK1_APPRUNNER_WRONG_INDEX=11
 TASK1_APPRUNNER_WRONG_MARKDOWN=True
 
+TASK1_APPRUNNER_INVALID_KEY="task1_invalid_url"
+TASK1_APPRUNNER_INVALID_LABEL="That doesn't look like an App Runner URL"
+TASK1_APPRUNNER_INVALID_VALUE="""
+The URL you entered isn't a valid App Runner service URL, so our Unicorns didn't even try it - and no points were lost! Copy the **Default domain** of your service from **App Runner** in your AWS account (it looks like `https://xxxxxxxxxx.us-east-1.awsapprunner.com`) and submit it again.
+"""
+TASK1_APPRUNNER_INVALID_INDEX=15
+TASK1_APPRUNNER_INVALID_MARKDOWN=True
+
 TASK1_APPRUNNER_INPUT_REMOVED_KEY='task1_input_remove'
 TASK1_APPRUNNER_INPUT_REMOVED_LABEL="Input evaluating..."
 TASK1_APPRUNNER_INPUT_REMOVED_VALUE="Our Unicorns are currently checking the status of this answer... standby"
@@ -0,0 +1,286 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import codecs
+import collections
+import json
+import os
+import re
+import socket
+import ssl
+import time
+import http.client
+from typing import NamedTuple
+
+# HTTPS probes of the team apps. A warm container checks the same hosts every minute, so the DNS resolution and the
+# TLS session of each host are cached per container instead of being redone on every probe.
+
+# getaddrinfo does not expose record TTLs, so resolved addresses are kept for a configured time. It should not
+# exceed the TTL of the App Runner records.
+DNS_TTL_SECONDS = int(os.environ.get('PROBE_DNS_TTL_SECONDS', '60'))
+
+PROBE_TIMEOUT_SECONDS = 5
+
+# Limits applied while reading a response body, so that a misbehaving team app cannot stall or bloat the worker.
+# Each read must complete within the read timeout, and the whole body within the probe timeout.
+MAX_BODY_BYTES = int(os.environ.get('PROBE_MAX_BODY_BYTES', '65536'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('PROBE_READ_TIMEOUT_SECONDS', '2'))
+READ_CHUNK_BYTES = 4096
+
+# Shared TLS context, so that sessions it issued can be resumed by later connections
+tls_context = ssl.create_default_context()
+
+# host -> (expires_at, addresses) with addresses as returned by getaddrinfo
+dns_cache = {}
+# host -> ssl.SSLSession of the last successful connection
+tls_sessions = {}
+
+# Hits and misses of the caches above in this container: dns-hits, dns-misses, tls-resumed, tls-full
+cache_stats = collections.Counter()
+
+
+class ProbeResponse(NamedTuple):
+    status: int
+    body: bytes
+    # Milliseconds spent in each phase: dns, connect, tls, ttfb
+    timings: dict
+    tls_session_reused: bool
+
+
+def resolve(host, port):
+    now = time.monotonic()
+    cached = dns_cache.get(host)
+    if cached is not None and cached[0] > now:
+        cache_stats['dns-hits'] += 1
+        return cached[1]
+    cache_stats['dns-misses'] += 1
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    dns_cache[host] = (now + DNS_TTL_SECONDS, addresses)
+    return addresses
+
+
+# Drops the cached address and TLS session of a host, e.g. after it could not be reached
+def forget(host):
+    dns_cache.pop(host, None)
+    tls_sessions.pop(host, None)
+
+
+# HTTPS connection resolving through the DNS cache and resuming the cached TLS session of its host
+class ProbeConnection(http.client.HTTPSConnection):
+
+    def __init__(self, host, timeout=PROBE_TIMEOUT_SECONDS):
+        super().__init__(host, timeout=timeout, context=tls_context)
+        self.timings = {}
+        self.tls_sock = None
+        self.tls_session_reused = False
+
+    def connect(self):
+        started = time.perf_counter()
+        addresses = resolve(self.host, self.port)
+        resolved = time.perf_counter()
+
+        sock = None
+        last_error = OSError(f"No address found for {self.host}")
+        for family, socktype, proto, _, sockaddr in addresses:
+            try:
+                sock = socket.socket(family, socktype, proto)
+                sock.settimeout(self.timeout)
+                sock.connect(sockaddr)
+                break
+            except OSError as err:
+                last_error = err
+                # socket.socket itself may have failed, e.g. for an address family unsupported here
+                if sock is not None:
+                    sock.close()
+                sock = None
+        if sock is None:
+            forget(self.host)
+            raise last_error
+        connected = time.perf_counter()
+
+        try:
+            self.sock = self._context.wrap_socket(sock, server_hostname=self.host,
+                                                  session=tls_sessions.get(self.host))
+        except (ssl.SSLError, OSError):
+            sock.close()
+            tls_sessions.pop(self.host, None)
+            raise
+        self.tls_sock = self.sock
+        handshaken = time.perf_counter()
+
+        self.timings['dns'] = round((resolved - started) * 1000, 1)
+        self.timings['connect'] = round((connected - resolved) * 1000, 1)
+        self.timings['tls'] = round((handshaken - connected) * 1000, 1)
+
+    # TLS 1.3 session tickets arrive after the handshake, so the session is only kept once the response headers were read
+    def remember_session(self):
+        try:
+            if self.tls_sock is None:
+                return
+            self.tls_session_reused = self.tls_sock.session_reused
+            cache_stats['tls-resumed' if self.tls_session_reused else 'tls-full'] += 1
+            if self.tls_sock.session is not None:
+                tls_sessions[self.host] = self.tls_sock.session
+        except (ssl.SSLError, OSError, ValueError) as err:
+            print(f"Could not keep TLS session for {self.host}: {err}")
+
+
+# Opens a connection and sends a GET request to a team app.
+# :returns: tuple of (connection, response with its headers read), the caller must close the connection
+def open_response(host, path, timeout=PROBE_TIMEOUT_SECONDS):
+    conn = ProbeConnection(host, timeout=timeout)
+    try:
+        conn.connect()
+        sent = time.perf_counter()
+        conn.request("GET", path)
+        res = conn.getresponse()
+        conn.timings['ttfb'] = round((time.perf_counter() - sent) * 1000, 1)
+        conn.remember_session()
+        return conn, res
+    except Exception:
+        conn.close()
+        raise
+
+
+# Sends a GET request to a team app and reads the response, up to max_bytes.
+# :returns: ProbeResponse, exceptions of the connection are raised to the caller
+def get(host, path, timeout=PROBE_TIMEOUT_SECONDS, max_bytes=MAX_BODY_BYTES):
+    conn, res = open_response(host, path, timeout)
+    try:
+        body = res.read(max_bytes)
+        print(f"Probe {host}{path}: status {res.status}, timings {conn.timings} ms, "
+              f"TLS session reused {conn.tls_session_reused}")
+        return ProbeResponse(res.status, body, conn.timings, conn.tls_session_reused)
+    finally:
+        conn.close()
+
+
+# Reads a single top-level field of the JSON object returned by a team app. The body is read in chunks under the
+# size and time limits above, and decoding stops as soon as the field is found.
+# :returns: the field value
+# :raises ValueError: on a status other than 200, a non JSON content type, an oversized or malformed body, or if the
+#                     field is missing. Connection errors and timeouts are raised as they are.
+def get_json_field(host, path, field, timeout=PROBE_TIMEOUT_SECONDS, max_bytes=MAX_BODY_BYTES):
+    conn, res = open_response(host, path, timeout)
+    try:
+        if res.status != 200:
+            raise ValueError(f"Unexpected status {res.status}")
+        content_type = res.getheader('Content-Type', '')
+        if 'json' not in content_type.lower():
+            raise ValueError(f"Unexpected content type '{content_type}'")
+
+        scanner = JsonFieldScanner(field)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        deadline = time.monotonic() + timeout
+        received = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Body of {host}{path} not received within {timeout} s")
+            conn.tls_sock.settimeout(min(READ_TIMEOUT_SECONDS, remaining))
+
+            chunk = res.read1(READ_CHUNK_BYTES)
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"Body of {host}{path} exceeds {max_bytes} bytes")
+            final = not chunk
+            if scanner.feed(decoder.decode(chunk, final=final), final=final):
+                break
+            if final or scanner.done:
+                raise ValueError(f"Field '{field}' not found in {host}{path}")
+
+        print(f"Probe {host}{path}: status {res.status}, timings {conn.timings} ms, read {received} bytes, "
+              f"TLS session reused {conn.tls_session_reused}")
+        return scanner.value
+    finally:
+        conn.close()
+
+
+# Incremental scanner for one top-level field of a JSON object. Text is fed as it arrives, and members are decoded one
+# at a time with json raw_decode, resuming where the previous feed stopped, until the field is found.
+class JsonFieldScanner:
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    decoder = json.JSONDecoder()
+
+    def __init__(self, field):
+        self.field = field
+        self.buffer = ''
+        self.state = 'start'
+        self.key = None
+        self.found = False
+        self.value = None
+        # Set when the end of the object was reached
+        self.done = False
+
+    # :param final: whether this is the last piece of the body
+    # :returns: True once the field was found
+    def feed(self, text, final=False):
+        self.buffer += text
+        while not self.found and not self.done and self.step(final):
+            pass
+        return self.found
+
+    # Consumes one element from the buffer
+    # :returns: False when more text is needed
+    def step(self, final):
+        pos = self.WHITESPACE.match(self.buffer).end()
+        self.buffer = self.buffer[pos:]
+        if not self.buffer:
+            if final:
+                raise ValueError("Truncated JSON object")
+            return False
+        char = self.buffer[0]
+
+        if self.state == 'start':
+            if char != '{':
+                raise ValueError("Expected a JSON object")
+            self.buffer = self.buffer[1:]
+            self.state = 'key'
+        elif self.state == 'key':
+            if char == '}':
+                self.done = True
+                return True
+            if char != '"':
+                raise ValueError("Expected an object key")
+            decoded = self.decode(final)
+            if decoded is None:
+                return False
+            self.key = decoded
+            self.state = 'colon'
+        elif self.state == 'colon':
+            if char != ':':
+                raise ValueError("Expected ':' after an object key")
+            self.buffer = self.buffer[1:]
+            self.state = 'value'
+        elif self.state == 'value':
+            decoded = self.decode(final, value=True)
+            if decoded is None:
+                return False
+            if self.key == self.field:
+                self.found = True
+                self.value = decoded[0]
+            self.state = 'separator'
+        else:
+            if char == '}':
+                self.done = True
+            elif char == ',':
+                self.buffer = self.buffer[1:]
+                self.state = 'key'
+            else:
+                raise ValueError("Expected ',' or '}' after an object member")
+        return True
+
+    # Decodes the JSON element at the start of the buffer and removes it
+    # :returns: the element (wrapped in a tuple for values, which may be None), or None if more text is needed
+    def decode(self, final, value=False):
+        try:
+            decoded, end = self.decoder.raw_decode(self.buffer)
+        except json.JSONDecodeError:
+            if final:
+                raise ValueError("Malformed JSON object")
+            return None
+        # A number ending the buffer may continue in the next piece
+        if end == len(self.buffer) and not final:
+            return None
+        self.buffer = self.buffer[end:]
+        return (decoded,) if value else decoded
@@ -0,0 +1,142 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import cProfile
+import functools
+import gzip
+import json
+import os
+import pstats
+import time
+import tracemalloc
+import uuid
+import boto3
+
+# On-demand profiling of the Lambda handlers, decorated with @profiling.profiled. PROFILING selects when invocations
+# are profiled:
+# - off (default): the handler is returned undecorated, so there is no overhead at all
+# - payload: only invocations whose event contains "profile": true, or "profile": "memory" to also trace allocations
+# - always: every invocation
+# A profiled invocation runs under cProfile, and under tracemalloc when PROFILING_TRACEMALLOC is true or the payload
+# asks for it. Its report (the PROFILING_TOP_N hot functions, and the peak and top allocations) is written as gzipped
+# JSON to PROFILING_URI, either s3://bucket/prefix or a local directory, and summarized in one log line.
+PROFILING = os.environ.get('PROFILING', 'off')
+PROFILING_URI = os.environ.get('PROFILING_URI') or '/tmp/profiles'
+PROFILING_TOP_N = int(os.environ.get('PROFILING_TOP_N', '25'))
+PROFILING_TRACEMALLOC = os.environ.get('PROFILING_TRACEMALLOC', 'false').lower() == 'true'
+
+MODE_OFF = 'off'
+MODE_PAYLOAD = 'payload'
+MODE_ALWAYS = 'always'
+
+# Event key requesting the profiling of one invocation in payload mode
+PAYLOAD_FLAG = 'profile'
+PAYLOAD_MEMORY = 'memory'
+
+s3_client = None
+
+# Whether an invocation is being profiled, as handlers dispatched in process (e.g. by sns_lambda) must not start a
+# nested profiler
+profiling_active = False
+
+
+def profiled(handler):
+    if PROFILING not in (MODE_PAYLOAD, MODE_ALWAYS):
+        return handler
+
+    @functools.wraps(handler)
+    def profiled_handler(event, context):
+        flag = event.get(PAYLOAD_FLAG) if isinstance(event, dict) else None
+        if profiling_active or (PROFILING == MODE_PAYLOAD and not flag):
+            return handler(event, context)
+        return run_profiled(handler, event, context, PROFILING_TRACEMALLOC or flag == PAYLOAD_MEMORY)
+    return profiled_handler
+
+
+def run_profiled(handler, event, context, trace_memory):
+    global profiling_active
+    profiler = cProfile.Profile()
+    if trace_memory:
+        tracemalloc.start()
+    profiling_active = True
+    started = time.perf_counter()
+    try:
+        return profiler.runcall(handler, event, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        profiling_active = False
+        memory = None
+        if trace_memory:
+            memory = memory_report(tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        try:
+            write_report(handler, context, elapsed_ms, profiler, memory)
+        except Exception as err:
+            print(f"Error while writing the profile of {handler.__module__}, continuing: {err}")
+
+
+def function_name(function):
+    filename, line, name = function
+    return f"{os.path.basename(filename)}:{line}({name})" if line else name
+
+
+# The PROFILING_TOP_N functions with the most time spent in their own code, and in their calls
+def hot_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    functions = [{
+        'function': function_name(function),
+        'calls': calls,
+        'own-ms': round(own_time * 1000, 3),
+        'cumulative-ms': round(cumulative_time * 1000, 3),
+    } for function, (primitive_calls, calls, own_time, cumulative_time, callers) in stats.items()]
+    return {
+        'total-calls': sum(function['calls'] for function in functions),
+        'by-own-time': sorted(functions, key=lambda function: -function['own-ms'])[:PROFILING_TOP_N],
+        'by-cumulative-time': sorted(functions, key=lambda function: -function['cumulative-ms'])[:PROFILING_TOP_N],
+    }
+
+
+def memory_report(snapshot, peak_bytes):
+    return {
+        'peak-bytes': peak_bytes,
+        'top-allocations': [{
+            'location': f"{os.path.basename(statistic.traceback[0].filename)}:{statistic.traceback[0].lineno}",
+            'bytes': statistic.size,
+            'blocks': statistic.count,
+        } for statistic in snapshot.statistics('lineno')[:PROFILING_TOP_N]],
+    }
+
+
+def write_report(handler, context, elapsed_ms, profiler, memory):
+    global s3_client
+    now = time.time()
+    request_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+    functions = hot_functions(profiler)
+    report = {
+        'handler': f"{handler.__module__}.{handler.__name__}",
+        'request-id': request_id,
+        'started-at': now - elapsed_ms / 1000,
+        'elapsed-ms': round(elapsed_ms, 3),
+        'functions': functions,
+        'memory': memory,
+    }
+    body = gzip.compress(json.dumps(report).encode('utf-8'))
+    name = f"{int(now * 1000)}-{request_id}.json.gz"
+
+    if PROFILING_URI.startswith('s3://'):
+        bucket, _, prefix = PROFILING_URI[len('s3://'):].partition('/')
+        key = f"{prefix.rstrip('/')}/{handler.__module__}/{time.strftime('%Y/%m/%d', time.gmtime(now))}/{name}".lstrip('/')
+        if s3_client is None:
+            s3_client = boto3.client('s3')
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+        location = f"s3://{bucket}/{key}"
+    else:
+        directory = os.path.join(PROFILING_URI, handler.__module__)
+        os.makedirs(directory, exist_ok=True)
+        location = os.path.join(directory, name)
+        with open(location, 'wb') as profile:
+            profile.write(body)
+
+    hottest = functions['by-own-time'][0]['function'] if functions['by-own-time'] else 'none'
+    peak = f", peak {memory['peak-bytes'] / 1024:.0f} KiB" if memory else ''
+    print(f"Profile of {report['handler']}: {elapsed_ms:.1f} ms, {functions['total-calls']} calls{peak}, "
+          f"hottest {hottest}, written to {location}")
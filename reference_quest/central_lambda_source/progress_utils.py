@@ -0,0 +1,165 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import time
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+import state_codec
+
+# Event-wide progress aggregate, kept as reserved items of the quest team status table so that dashboards and
+# operator tooling read a few items instead of scanning every team. It is updated incrementally by dynamodb_utils after
+# each stage transition is saved. That update is not part of the save, so the counts are approximate: a transition is
+# missed when the update fails or the function stops between the save and the update, and the later transitions of the
+# team then move it out of a stage it was never counted in. recompute_progress rebuilds the aggregate from the team
+# items. Format:
+# PROGRESS_ITEM_ID: 'stage-counts': {stage: number of teams currently in the stage}
+# PROGRESS_ITEM_ID#<stage>: 'entered-at': {team_id: epoch seconds when the team entered the stage}
+# The entry times are sharded by stage, so that no item grows with every team of the event and a transition only
+# writes to the items of the two stages involved. The 'complete' stage timestamps double as completion times.
+PROGRESS_ITEM_ID = '#quest-progress'
+
+STAGE_TASK1 = 'task1'
+STAGE_TASK2 = 'task2'
+STAGE_TASK3 = 'task3'
+STAGE_TASK4 = 'task4'
+STAGE_COMPLETE = 'complete'
+STAGES = [STAGE_TASK1, STAGE_TASK2, STAGE_TASK3, STAGE_TASK4, STAGE_COMPLETE]
+
+# Team item attribute holding the stage last recorded in the aggregate
+STAGE_ATTRIBUTE = 'progress-stage'
+
+# Set once the aggregate item is known to exist in this container
+progress_item_ready = False
+
+
+# Stage a team is in, derived from its task completion flags (check init_lambda for the format)
+def team_stage(team_data):
+    if team_data.get('is-db-migrated'):
+        return STAGE_COMPLETE
+    if team_data.get('is-debug-mode'):
+        return STAGE_TASK4
+    if team_data.get('is-website-released'):
+        return STAGE_TASK3
+    if team_data.get('is-webapp-up'):
+        return STAGE_TASK2
+    return STAGE_TASK1
+
+
+# Key of the reserved item holding the entry times of the teams in a stage
+def stage_item_id(stage):
+    return f"{PROGRESS_ITEM_ID}#{stage}"
+
+
+# Creates the aggregate items with their empty maps if they do not exist yet. Nested attribute paths can only be
+# updated once their parent map exists, which this guarantees.
+def ensure_progress_item(quest_status_table):
+    global progress_item_ready
+    if progress_item_ready:
+        return
+    items = [{'team-id': PROGRESS_ITEM_ID, 'stage-counts': {stage: 0 for stage in STAGES}}]
+    items += [{'team-id': stage_item_id(stage), 'entered-at': {}} for stage in STAGES]
+    for item in items:
+        try:
+            quest_status_table.put_item(Item=item, ConditionExpression=Attr("team-id").not_exists())
+        except ClientError as err:
+            if err.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+                raise err
+    progress_item_ready = True
+
+
+# Moves a team from one stage to another in the aggregate: the counts are updated with a single atomic UpdateItem,
+# then the team's entry time is moved from the item of its previous stage to the item of its new one.
+# :param from_stage: previous stage of the team, None if the team was not counted yet
+def record_transition(quest_status_table, team_id, from_stage, to_stage):
+    if from_stage == to_stage:
+        return
+    ensure_progress_item(quest_status_table)
+
+    names = {'#counts': 'stage-counts', '#to': to_stage}
+    values = {':one': 1, ':zero': 0}
+    set_actions = ['#counts.#to = if_not_exists(#counts.#to, :zero) + :one']
+    if from_stage is not None:
+        names['#from'] = from_stage
+        set_actions.append('#counts.#from = if_not_exists(#counts.#from, :one) - :one')
+    quest_status_table.update_item(
+        Key={'team-id': PROGRESS_ITEM_ID},
+        UpdateExpression='SET ' + ', '.join(set_actions),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+    entered_names = {'#entered': 'entered-at', '#team': str(team_id)}
+    quest_status_table.update_item(
+        Key={'team-id': stage_item_id(to_stage)},
+        UpdateExpression='SET #entered.#team = :now',
+        ExpressionAttributeNames=entered_names,
+        ExpressionAttributeValues={':now': int(time.time())}
+    )
+    if from_stage is not None:
+        quest_status_table.update_item(
+            Key={'team-id': stage_item_id(from_stage)},
+            UpdateExpression='REMOVE #entered.#team',
+            ExpressionAttributeNames=entered_names
+        )
+    print(f"Recorded progress transition for team {team_id}: {from_stage} -> {to_stage}")
+
+
+# Reads the entry times of every stage from their items.
+# :returns: {stage: {team_id: entered_at}}
+def get_stage_entered_at(quest_status_table):
+    entered_at = {}
+    for stage in STAGES:
+        dynamodb_response = quest_status_table.get_item(Key={'team-id': stage_item_id(stage)})
+        entered_at[stage] = dynamodb_response.get('Item', {}).get('entered-at', {})
+    return entered_at
+
+
+# Reads the event progress from the aggregate items.
+# :returns: {'stage-counts': {stage: count}, 'recent-completions': [(team_id, completed_at)],
+#            'stuck-teams': {stage: [(team_id, entered_at)]}}, longest stuck first
+def get_progress(quest_status_table, recent_count=10, stuck_count=5):
+    dynamodb_response = quest_status_table.get_item(Key={'team-id': PROGRESS_ITEM_ID})
+    item = dynamodb_response.get('Item', {})
+    entered_at = get_stage_entered_at(quest_status_table)
+
+    completions = sorted(entered_at[STAGE_COMPLETE].items(), key=lambda team: team[1], reverse=True)
+    stuck_teams = {}
+    for stage in STAGES:
+        if stage != STAGE_COMPLETE:
+            stuck_teams[stage] = sorted(entered_at[stage].items(), key=lambda team: team[1])[:stuck_count]
+
+    return {
+        'stage-counts': {stage: int(count) for stage, count in item.get('stage-counts', {}).items()},
+        'recent-completions': completions[:recent_count],
+        'stuck-teams': stuck_teams,
+    }
+
+
+# Rebuilds the aggregate from the team items, correcting the drift of the incremental updates. Teams keep their entry
+# time when the aggregate already has them in the same stage, the others are recorded as entering their stage now.
+# Transitions recorded while the table is scanned can be overwritten, so run it again if teams progressed meanwhile.
+# :returns: {stage: number of teams}
+def recompute_progress(quest_status_table):
+    previous_entered_at = get_stage_entered_at(quest_status_table)
+    now = int(time.time())
+
+    stage_counts = {stage: 0 for stage in STAGES}
+    stage_entered_at = {stage: {} for stage in STAGES}
+    scan_params = {}
+    while True:
+        dynamodb_response = quest_status_table.scan(**scan_params)
+        for item in dynamodb_response['Items']:
+            team_id = item['team-id']
+            if team_id.startswith('#'):
+                continue
+            stage = team_stage(state_codec.decode(item))
+            stage_counts[stage] += 1
+            stage_entered_at[stage][team_id] = previous_entered_at[stage].get(team_id, now)
+        if 'LastEvaluatedKey' not in dynamodb_response:
+            break
+        scan_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
+
+    quest_status_table.put_item(Item={'team-id': PROGRESS_ITEM_ID, 'stage-counts': stage_counts})
+    for stage in STAGES:
+        quest_status_table.put_item(Item={'team-id': stage_item_id(stage), 'entered-at': stage_entered_at[stage]})
+    print(f"Recomputed progress of {quest_status_table.name}: {stage_counts}")
+    return stage_counts
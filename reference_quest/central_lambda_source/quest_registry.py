@@ -0,0 +1,124 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import importlib
+import json
+import os
+from typing import NamedTuple
+import boto3
+from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+
+# Registry of the quests served by one set of central Lambdas. sns_lambda routes each Quests API message by its
+# quest-id and cron_lambda sweeps the teams of every registered quest, so that several quests of an event share one
+# SNS subscription, one cron and the same warm clients instead of deploying parallel copies.
+#
+# The quest deployed with this stack is always registered, from the usual environment variables. Other quests are
+# registered either:
+# - in QUEST_REGISTRY, a JSON list of quest definitions using the QuestDefinition field names with dashes, e.g.
+#   [{"quest-id": "...", "init-lambda": "...", "update-lambda": "...", "check-team-lambda": "...",
+#     "team-status-table": "...", "needs-evaluation-index": "NeedsEvaluationIndex",
+#     "check-team-shards": ["...", "..."]}]
+# - or as plugins: QUEST_PLUGINS lists modules (comma-separated) which call register_quest when imported.
+# Each quest keeps its own Lambdas and team status table, so their state and failures stay isolated.
+
+QUEST_ID = os.environ['QUEST_ID']
+QUEST_API_BASE = os.environ['QUEST_API_BASE']
+QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
+
+
+class QuestDefinition(NamedTuple):
+    quest_id: str
+    init_lambda: str
+    update_lambda: str
+    check_team_lambda: str
+    team_status_table: str
+    needs_evaluation_index: str = 'NeedsEvaluationIndex'
+    # Worker functions of the check shards, see sharding.py. Empty when all checks go to check_team_lambda.
+    check_team_shards: tuple = ()
+
+
+# quest_id -> QuestDefinition
+quests = {}
+
+# Clients shared by all the quests of this container
+lambda_client = boto3.client('lambda')
+dynamodb = boto3.resource('dynamodb')
+quests_api_clients = {}
+tables = {}
+
+registry_loaded = False
+
+
+def register_quest(quest):
+    if quest.quest_id in quests and quests[quest.quest_id] != quest:
+        print(f"Quest {quest.quest_id} registered again, replacing its previous definition")
+    quests[quest.quest_id] = quest
+
+
+def quest_from_config(config):
+    quest = QuestDefinition(**{field.replace('-', '_'): value for field, value in config.items()})
+    return quest._replace(check_team_shards=tuple(quest.check_team_shards))
+
+
+# The quest deployed with this stack. The Lambdas only set the variables they need, so missing ones are left empty.
+def local_quest():
+    return QuestDefinition(
+        quest_id=QUEST_ID,
+        init_lambda=os.environ.get('INIT_LAMBDA', ''),
+        update_lambda=os.environ.get('UPDATE_LAMBDA', ''),
+        check_team_lambda=os.environ.get('CHECK_TEAM_LAMBDA', ''),
+        team_status_table=os.environ.get('QUEST_TEAM_STATUS_TABLE', ''),
+        needs_evaluation_index=os.environ.get('NEEDS_EVALUATION_INDEX', 'NeedsEvaluationIndex'),
+        check_team_shards=tuple(shard.strip() for shard in os.environ.get('CHECK_TEAM_SHARDS', '').split(',') if shard.strip()),
+    )
+
+
+# Loads the registry once per container. A quest definition or plugin that fails to load is logged and skipped, so
+# that it cannot take the other quests down.
+def load_registry():
+    global registry_loaded
+    if registry_loaded:
+        return quests
+    register_quest(local_quest())
+
+    try:
+        for config in json.loads(os.environ.get('QUEST_REGISTRY') or '[]'):
+            try:
+                register_quest(quest_from_config(config))
+            except (TypeError, AttributeError) as err:
+                print(f"Invalid quest definition {config}, skipping it: {err}")
+    except ValueError as err:
+        print(f"Invalid QUEST_REGISTRY, only the registered quests are served: {err}")
+
+    for plugin in os.environ.get('QUEST_PLUGINS', '').split(','):
+        if plugin.strip():
+            try:
+                importlib.import_module(plugin.strip())
+            except Exception as err:
+                print(f"Could not load quest plugin {plugin.strip()}, skipping it: {err}")
+
+    registry_loaded = True
+    print(f"Serving quests: {list(quests)}")
+    return quests
+
+
+# :returns: the QuestDefinition of a quest, or None if the quest is not served here
+def get_quest(quest_id):
+    return load_registry().get(quest_id)
+
+
+def is_local_quest(quest):
+    return quest.quest_id == QUEST_ID
+
+
+# Quests API client shared by all the quests of the event
+def get_quests_api_client():
+    key = (QUEST_API_BASE, QUEST_API_TOKEN)
+    if key not in quests_api_clients:
+        quests_api_clients[key] = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    return quests_api_clients[key]
+
+
+def get_team_status_table(quest):
+    if quest.team_status_table not in tables:
+        tables[quest.team_status_table] = dynamodb.Table(quest.team_status_table)
+    return tables[quest.team_status_table]
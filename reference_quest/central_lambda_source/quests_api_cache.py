@@ -0,0 +1,78 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import copy
+import json
+import threading
+
+# Read-through cache over the Quests API client, scoped to one invocation: handlers wrap the client they create at
+# the top of each invocation, so cached lookups never outlive it. Repeated get_event_status, get_team and
+# get_quest_for_team calls are served from memory, and the team template stack outputs are parsed once and indexed by
+# OutputKey.
+#
+# Writes that can change the cached lookups invalidate the entries of their team. Dashboard writes (outputs, inputs and
+# hints) do not change them, and any other write conservatively drops every entry of its team.
+DASHBOARD_WRITES = {
+    'post_output', 'delete_output', 'post_input', 'delete_input', 'post_hint', 'delete_hint', 'assume_team_ops_role'
+}
+
+
+class CachingQuestsApiClient:
+
+    def __init__(self, quests_api_client):
+        self.quests_api_client = quests_api_client
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    # Returns the cached result of a read, calling the client on a miss. Results are copied, so callers may modify them.
+    def read(self, key, fetch):
+        with self.lock:
+            if key in self.cache:
+                return copy.deepcopy(self.cache[key])
+        result = fetch()
+        with self.lock:
+            self.cache[key] = result
+        return copy.deepcopy(result)
+
+    def get_event_status(self):
+        return self.read(('get_event_status',), self.quests_api_client.get_event_status)
+
+    def get_team(self, team_id):
+        return self.read(('get_team', team_id), lambda: self.quests_api_client.get_team(team_id=team_id))
+
+    def get_quest_for_team(self, team_id, quest_id):
+        return self.read(('get_quest_for_team', team_id, quest_id),
+                         lambda: self.quests_api_client.get_quest_for_team(team_id=team_id, quest_id=quest_id))
+
+    # Outputs of the team enable stack, indexed by OutputKey
+    def get_stack_outputs(self, team_id, quest_id):
+        def parse_stack_outputs():
+            quest_status = self.get_quest_for_team(team_id, quest_id)
+            return index_stack_outputs(quest_status)
+        return self.read(('get_stack_outputs', team_id, quest_id), parse_stack_outputs)
+
+    def invalidate(self, team_id=None):
+        with self.lock:
+            if team_id is None:
+                self.cache.clear()
+            else:
+                for key in [key for key in self.cache if len(key) > 1 and key[1] == team_id]:
+                    del self.cache[key]
+
+    # Every other method goes to the client, invalidating the entries of the team it writes to
+    def __getattr__(self, name):
+        method = getattr(self.quests_api_client, name)
+        if name in DASHBOARD_WRITES or name.startswith('get_') or not callable(method):
+            return method
+
+        def write(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.invalidate(kwargs.get('team_id', args[0] if args else None))
+        return write
+
+
+# :returns: dict of OutputKey to OutputValue of the team enable stack
+def index_stack_outputs(quest_status):
+    stack_outputs = json.loads(quest_status.get('quest-team-enable-stack-outputs') or '[]')
+    return {output['OutputKey']: output['OutputValue'] for output in stack_outputs}
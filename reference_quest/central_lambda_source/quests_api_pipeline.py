@@ -0,0 +1,84 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, NamedTuple
+
+# Pipelined Quests API calls: a handler enqueues the calls of a state transition with the calls they depend on, e.g.
+# "post the score after the state is saved", then flushes them. Each call is dispatched as soon as the calls it
+# depends on have succeeded, so independent dashboard updates go out concurrently over the same client instead of
+# waiting for each other's round trip. A call whose dependency failed is not made, and fails too.
+#
+# Calls are either Quests API client methods (call) or local callables such as a state save (run). Results and errors
+# are only collected at flush, so a failing call does not prevent the independent ones.
+
+# Number of calls in flight at once
+PIPELINE_MAX_WORKERS = 8
+
+
+class CallResult(NamedTuple):
+    result: Any = None
+    error: Exception = None
+
+
+class DependencyFailed(Exception):
+    pass
+
+
+class QuestsApiPipeline:
+
+    def __init__(self, quests_api_client, max_workers=PIPELINE_MAX_WORKERS):
+        self.quests_api_client = quests_api_client
+        self.max_workers = max_workers
+        # name -> (callable, args, kwargs, names of the calls it depends on), in enqueue order
+        self.calls = {}
+
+    # Enqueues a Quests API client method call, made once the calls named in after have succeeded
+    # :returns: the name of the call, to be used in the after list of later calls
+    def call(self, name, method_name, after=(), **kwargs):
+        return self.run(name, getattr(self.quests_api_client, method_name), after=after, **kwargs)
+
+    # Enqueues a local callable, e.g. saving the team state, in the same dependency graph as the Quests API calls
+    def run(self, name, fn, *args, after=(), **kwargs):
+        if name in self.calls:
+            raise ValueError(f"Call {name} already enqueued")
+        for dependency in after:
+            if dependency not in self.calls:
+                raise ValueError(f"Call {name} depends on {dependency}, which is not enqueued")
+        self.calls[name] = (fn, args, kwargs, tuple(after))
+        return name
+
+    # Makes the enqueued calls, each one as soon as its dependencies have succeeded, and empties the pipeline
+    # :returns: dict of call name to CallResult
+    def flush(self):
+        calls, self.calls = self.calls, {}
+        results = {}
+        if not calls:
+            return results
+
+        running = {}
+        waiting = dict(calls)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(calls)))) as executor:
+            while waiting or running:
+                for name, (fn, args, kwargs, after) in list(waiting.items()):
+                    failed = [dependency for dependency in after
+                              if dependency in results and results[dependency].error is not None]
+                    if failed:
+                        print(f"Skipping pipelined call {name}, {failed[0]} failed")
+                        results[name] = CallResult(error=DependencyFailed(f"{name} skipped, {failed[0]} failed"))
+                        del waiting[name]
+                    elif all(dependency in results for dependency in after):
+                        running[executor.submit(fn, *args, **kwargs)] = name
+                        del waiting[name]
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = CallResult(result=future.result())
+                    except Exception as err:
+                        print(f"Error in pipelined call {name}: {err}")
+                        results[name] = CallResult(error=err)
+
+        return {name: results[name] for name in calls}
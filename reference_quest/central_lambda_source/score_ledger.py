@@ -0,0 +1,113 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import time
+from concurrent.futures import ThreadPoolExecutor
+import dynamodb_utils
+
+# The score ledger lives in the team item, so awarding points is committed atomically with the state transition that
+# earned them (the next save_team_data call). Format:
+# 'score-ledger': {entry_id: {'description': str, 'points': int, 'awarded-at': int, 'status': PENDING|ACKNOWLEDGED}}
+# 'score-total': sum of the points of all entries
+LEDGER_ATTRIBUTE = 'score-ledger'
+TOTAL_ATTRIBUTE = 'score-total'
+
+STATUS_PENDING = "PENDING"
+STATUS_ACKNOWLEDGED = "ACKNOWLEDGED"
+
+# Number of score events posted to the Quests API concurrently by a flush
+FLUSH_MAX_WORKERS = 8
+
+
+# Records points for a team in its ledger. Entry IDs are unique per team, which makes awards idempotent:
+# awarding the same entry twice (e.g. QUEST_COMPLETE_POINTS) is a no-op.
+# :returns: True if the entry was added, False if it had already been awarded
+def award(team_data, entry_id, description, points):
+    ledger = team_data.setdefault(LEDGER_ATTRIBUTE, {})
+    if entry_id in ledger:
+        print(f"Score entry {entry_id} already awarded to team {team_data['team-id']}, skipping")
+        return False
+
+    ledger[entry_id] = {
+        'description': description,
+        'points': int(points),
+        'awarded-at': int(time.time() * 1000),
+        'status': STATUS_PENDING,
+    }
+    team_data[TOTAL_ATTRIBUTE] = team_score(team_data) + int(points)
+    print(f"Awarded {points} points to team {team_data['team-id']} for {entry_id}")
+    return True
+
+
+# Entry ID for scores that can legitimately be awarded several times, such as penalties for wrong answers
+def next_attempt_id(team_data, prefix):
+    ledger = team_data.get(LEDGER_ATTRIBUTE, {})
+    attempts = sum(1 for entry_id in ledger if entry_id.startswith(f"{prefix}-"))
+    return f"{prefix}-{attempts + 1}"
+
+
+# Total points awarded to a team, without calling the Quests API
+def team_score(team_data):
+    return int(team_data.get(TOTAL_ATTRIBUTE, 0))
+
+
+# Points awarded to a team for the entries whose ID starts with the given prefix, e.g. 'task2'
+def task_score(team_data, prefix):
+    ledger = team_data.get(LEDGER_ATTRIBUTE, {})
+    return sum(int(entry['points']) for entry_id, entry in ledger.items() if entry_id.startswith(prefix))
+
+
+# Ledger entries not yet acknowledged by the Quests API, in the order they were awarded
+def pending_entries(team_data):
+    ledger = team_data.get(LEDGER_ATTRIBUTE, {})
+    pending = [(entry_id, entry) for entry_id, entry in ledger.items() if entry['status'] == STATUS_PENDING]
+    return sorted(pending, key=lambda item: item[1]['awarded-at'])
+
+
+# Posts the pending ledger entries of a team to the Quests API in one concurrent batch, marks the delivered ones as
+# acknowledged and persists the ledger. Entries that fail to post stay pending and are retried by the next flush.
+# Must be called after the state carrying the entries has been saved.
+# :returns: number of entries acknowledged
+def flush(quests_api_client, quest_id, team_data, quest_status_table):
+    pending = pending_entries(team_data)
+    if not pending:
+        return 0
+
+    def post(item):
+        entry_id, entry = item
+        response = quests_api_client.post_score_event(
+            team_id=team_data['team-id'],
+            quest_id=quest_id,
+            description=entry['description'],
+            points=int(entry['points'])
+        )
+        # The client reports failures through the status code rather than by raising
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"post_score_event for entry {entry_id} returned status code {response['statusCode']}")
+        return entry_id
+
+    acknowledged = []
+    with ThreadPoolExecutor(max_workers=min(FLUSH_MAX_WORKERS, len(pending))) as executor:
+        futures = [executor.submit(post, item) for item in pending]
+        for future in futures:
+            try:
+                acknowledged.append(future.result())
+            except Exception as err:
+                print(f"Error while posting score event for team {team_data['team-id']}: {err}")
+
+    if not acknowledged:
+        return 0
+
+    for entry_id in acknowledged:
+        team_data[LEDGER_ATTRIBUTE][entry_id]['status'] = STATUS_ACKNOWLEDGED
+    try:
+        dynamodb_utils.save_team_data(team_data, quest_status_table)
+    except ValueError:
+        # The item changed since it was loaded: re-apply the acknowledgements on the latest version once
+        team_data.reload(dynamodb_utils.get_team_data(quest_status_table, team_data['team-id']))
+        for entry_id in acknowledged:
+            if entry_id in team_data.get(LEDGER_ATTRIBUTE, {}):
+                team_data[LEDGER_ATTRIBUTE][entry_id]['status'] = STATUS_ACKNOWLEDGED
+        dynamodb_utils.save_team_data(team_data, quest_status_table)
+
+    print(f"Acknowledged score entries {acknowledged} for team {team_data['team-id']}")
+    return len(acknowledged)
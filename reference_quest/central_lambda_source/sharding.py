@@ -0,0 +1,61 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import collections
+import hashlib
+
+# Stable team-to-worker routing for the cron fan-out. The per-container caches of CHECK_TEAM_LAMBDA (DNS and TLS
+# sessions of the team apps, among others) only pay off if the same team keeps landing on the same containers, which
+# a single function does not guarantee. Each team is therefore assigned to one of a fixed number of shards by
+# consistent hashing of its team ID, and each shard is checked by its own worker function (CHECK_TEAM_SHARDS).
+#
+# Jump consistent hashing is used: when a shard is appended to the list, only about 1/(n+1) of the teams move, all
+# of them to the new shard, and nothing moves between the existing shards. Shards should only be added or removed at
+# the end of the list.
+
+# Multiplier of the 64-bit linear congruential generator of jump consistent hashing
+JUMP_MULTIPLIER = 2862933555777941757
+UINT64_MASK = (1 << 64) - 1
+
+# Counters of this container, reported after each check: invocations, and teams already checked by this container
+cache_stats = collections.Counter()
+seen_teams = set()
+
+
+# Jump consistent hash (Lamping and Veach) of a team ID
+# :returns: shard number in [0, shard_count)
+def shard_for(team_id, shard_count):
+    key = int.from_bytes(hashlib.sha256(str(team_id).encode('utf-8')).digest()[:8], 'big')
+    shard, candidate = -1, 0
+    while candidate < shard_count:
+        shard = candidate
+        key = (key * JUMP_MULTIPLIER + 1) & UINT64_MASK
+        candidate = int((shard + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return shard
+
+
+# Worker checking a team of a quest
+# :returns: tuple of (shard, function name), shard being None when the quest is not sharded
+def worker_for(quest, team_id):
+    if not quest.check_team_shards:
+        return None, quest.check_team_lambda
+    shard = shard_for(team_id, len(quest.check_team_shards))
+    return shard, quest.check_team_shards[shard]
+
+
+# Records the check of a team by this container and logs the cache hit rates of the container, per shard
+# :param probe_stats: counters of the probe caches, see probe_utils.cache_stats
+def report(shard, team_id, probe_stats):
+    cache_stats['invocations'] += 1
+    cache_stats['team-hits' if team_id in seen_teams else 'team-misses'] += 1
+    seen_teams.add(team_id)
+
+    stats = cache_stats + probe_stats
+
+    def rate(hits, misses):
+        total = stats[hits] + stats[misses]
+        return f"{stats[hits] / total:.0%}" if total else 'n/a'
+
+    print(f"Cache stats for shard {'unsharded' if shard is None else shard}: "
+          f"{stats['invocations']} invocations, {len(seen_teams)} teams, "
+          f"team {rate('team-hits', 'team-misses')}, dns {rate('dns-hits', 'dns-misses')}, "
+          f"tls {rate('tls-resumed', 'tls-full')}")
@@ -4,7 +4,9 @@ import boto3
 import json
 import os
 import quest_const
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import quest_registry
+import profiling
+import traffic_capture
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -17,42 +19,68 @@ EVENT_RULE_CRON = os.environ['EVENT_RULE_CRON']
 INIT_LAMBDA = os.environ['INIT_LAMBDA']
 UPDATE_LAMBDA = os.environ['UPDATE_LAMBDA']
 
-lambda_client = boto3.client('lambda')
+# When enabled, INIT and UPDATE events of the quest deployed with this stack are handled in this process instead of
+# through an async invocation of INIT_LAMBDA/UPDATE_LAMBDA, saving the second Lambda hop (invocation, possible cold
+# start and async queue delay). Other registered quests are always dispatched to their own Lambdas.
+DIRECT_DISPATCH = os.environ.get('DIRECT_DISPATCH', 'false').lower() == 'true'
+
+lambda_client = quest_registry.lambda_client
 events_client = boto3.client('events')
 
 
+@profiling.profiled
 def lambda_handler(event, context):
     print(f"sns_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
-
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
-
+    traffic_capture.capture(traffic_capture.SOURCE_SNS, event)
+
+    # SNS delivers a single message per invocation (https://aws.amazon.com/sns/faqs/#Reliability),
+    # but every record is processed in case that ever changes. Errors are raised once all the records were handled,
+    # so that the invocation fails and Lambda retries it (then sends it to the DLQ), as it did for the async invokes
+    # before handlers were dispatched in process.
+    errors = []
+    for record in event['Records']:
+        try:
+            handle_record(record, context)
+        except Exception as err:
+            print(f"Error while handling SNS record {json.dumps(record, default=str)}: {err}")
+            errors.append(err)
+    if errors:
+        raise errors[0]
+
+
+def handle_record(record, context):
     # Pulling the message portion out of the SNS message.
-    # Always a single message: https://aws.amazon.com/sns/faqs/#Reliability
     # This is a json object pushed by the QDK SNS topic whenever something of note happens
-    message = event['Records'][0]['Sns']['Message']
+    message = record['Sns']['Message']
     sns_values = json.loads(message)
     team_id = sns_values['team-id']
     quest_id = sns_values['quest-id']
 
-    # IMPORTANT! Filter on Quest ID to ensure relevancy to this quest (there are others in the event)
-    if quest_id != QUEST_ID:
-        print(f"Message for Quest: {quest_id}, this Quest is {QUEST_ID}, disregarding")
+    # IMPORTANT! Filter on Quest ID to ensure relevancy to the quests served here (there are others in the event)
+    quest = quest_registry.get_quest(quest_id)
+    if quest is None:
+        print(f"Message for Quest: {quest_id}, not served by this stack, disregarding")
         return
 
-    sns_type = event['Records'][0]['Sns']['MessageAttributes']['event']['Value']
+    sns_type = record['Sns']['MessageAttributes']['event']['Value']
 
     print(f"SNS Message for team {team_id}: {message}")
 
     # Switch on SNS event type and delegate to the appropriate lambda
     # If quest was enabled, initialize quest outputs
     if sns_type == quest_const.QUEST_IN_PROGRESS:
-        print(f"Quest event: QUEST_IN_PROGRESS for team {team_id}... Invoking {INIT_LAMBDA}")
-
         # providing payload for init_lambda
         init_params = {'team_id': team_id}
+
+        if DIRECT_DISPATCH and quest_registry.is_local_quest(quest):
+            print(f"Quest event: QUEST_IN_PROGRESS for team {team_id}... Dispatching to init_lambda in process")
+            import init_lambda # imported on demand, it requires the INIT_LAMBDA environment variables
+            init_lambda.lambda_handler(init_params, context)
+            return
+
+        print(f"Quest event: QUEST_IN_PROGRESS for team {team_id}... Invoking {quest.init_lambda}")
         lambda_invoke_response = lambda_client.invoke(
-            FunctionName=INIT_LAMBDA,
+            FunctionName=quest.init_lambda,
             InvocationType='Event',
             Payload=json.dumps(init_params, default=str)
         )
@@ -61,8 +89,6 @@ def lambda_handler(event, context):
     elif sns_type == quest_const.QUEST_INPUT_UPDATED:
         key = sns_values['key']
         value = sns_values['value']
-        print(f"Quest event: INPUT_UPDATED for team {team_id}, ({key}={value}), " +
-              f"triggering {UPDATE_LAMBDA}...")
 
         # providing payload for update_lambda  
         update_params = {
@@ -70,8 +96,18 @@ def lambda_handler(event, context):
             'key': key,
             'value': value
         }
+
+        if DIRECT_DISPATCH and quest_registry.is_local_quest(quest):
+            print(f"Quest event: INPUT_UPDATED for team {team_id}, ({key}={value}), " +
+                  f"dispatching to update_lambda in process...")
+            import update_lambda # imported on demand, it requires the UPDATE_LAMBDA environment variables
+            update_lambda.lambda_handler(update_params, context)
+            return
+
+        print(f"Quest event: INPUT_UPDATED for team {team_id}, ({key}={value}), " +
+              f"triggering {quest.update_lambda}...")
         lambda_invoke_response = lambda_client.invoke(
-            FunctionName=UPDATE_LAMBDA,
+            FunctionName=quest.update_lambda,
             InvocationType='Event',
             Payload=json.dumps(update_params, default=str))
         print(lambda_invoke_response)
@@ -0,0 +1,96 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Tuple
+
+# Team credential parameters, as loaded by load_id_creds.py into each team account's SSM Parameter Store
+LD_SERVER_KEY_PARAM = 'LD-ServerKey'
+LD_CLIENT_KEY_PARAM = 'LD-ClientKey'
+LD_SIGNON_URL_PARAM = 'LD-SignOnUrl'
+TABLE_NUMBER_PARAM = 'TableNumber'
+TEAM_CREDENTIAL_PARAMS = [LD_SERVER_KEY_PARAM, LD_CLIENT_KEY_PARAM, LD_SIGNON_URL_PARAM, TABLE_NUMBER_PARAM]
+# Parameters read by INIT_LAMBDA, which gets the table number of the team from the Quests API
+LD_CREDENTIAL_PARAMS = [LD_SERVER_KEY_PARAM, LD_CLIENT_KEY_PARAM, LD_SIGNON_URL_PARAM]
+
+# Placeholder value set by the operator template until account vending has filled in the real credentials
+OPERATOR_FILL = "OPERATOR_FILL"
+
+# GetParameters accepts at most 10 names per call
+GET_PARAMETERS_MAX_NAMES = 10
+
+
+# Typed bundle of the LaunchDarkly credentials stored in a team account.
+# Values of missing parameters are None and their names are listed in `missing`.
+class TeamCredentials(NamedTuple):
+    ld_server_key: str
+    ld_client_key: str
+    ld_signon_url: str
+    table_number: str
+    missing: Tuple[str, ...]
+
+    # True when every credential parameter exists in the team account
+    def is_complete(self):
+        return not self.missing
+
+    # True when the operator placeholders have not been replaced by account vending yet
+    def is_operator_fill(self):
+        return self.ld_server_key == OPERATOR_FILL or self.ld_client_key == OPERATOR_FILL
+
+
+# Reads the given parameter names with as few GetParameters round trips as possible (one for up to 10 names).
+# :param ssm_client: SSM client, usually the team's client obtained through assume_team_ops_role
+# :param names: parameter names to read
+# :returns: tuple of ({name: value} for the parameters found, [names not found])
+def get_parameters(ssm_client, names, with_decryption=True):
+    values = {}
+    missing = []
+    for start in range(0, len(names), GET_PARAMETERS_MAX_NAMES):
+        response = ssm_client.get_parameters(Names=names[start:start + GET_PARAMETERS_MAX_NAMES],
+                                             WithDecryption=with_decryption)
+        for parameter in response['Parameters']:
+            values[parameter['Name']] = parameter['Value']
+        missing.extend(response.get('InvalidParameters', []))
+    return values, missing
+
+
+# Reads the team credential parameters in a single round trip. Only the given names are required: the other
+# credentials are None without being reported as missing.
+def get_team_credentials(ssm_client, names=TEAM_CREDENTIAL_PARAMS):
+    values, missing = get_parameters(ssm_client, names)
+    return TeamCredentials(
+        ld_server_key=values.get(LD_SERVER_KEY_PARAM),
+        ld_client_key=values.get(LD_CLIENT_KEY_PARAM),
+        ld_signon_url=values.get(LD_SIGNON_URL_PARAM),
+        table_number=values.get(TABLE_NUMBER_PARAM),
+        missing=tuple(missing),
+    )
+
+
+# Writes the given parameters concurrently. PutParameter has no batch form, so the writes are issued in parallel instead.
+# :param ssm_client: SSM client, usually the team's client obtained through assume_team_ops_role
+# :param parameters: list of dicts with the keys Name, Value and Description
+def put_parameters(ssm_client, parameters):
+    def put(parameter):
+        return ssm_client.put_parameter(Name=parameter['Name'],
+                                        Description=parameter['Description'],
+                                        Value=parameter['Value'],
+                                        Overwrite=True,
+                                        Tier="Standard",
+                                        Type="String",
+                                        DataType="text")
+
+    if not parameters:
+        return []
+    with ThreadPoolExecutor(max_workers=len(parameters)) as executor:
+        # list() re-raises the first failed write, if any
+        return list(executor.map(put, parameters))
+
+
+# Writes the team credentials returned by the account vending endpoint
+def put_team_credentials(ssm_client, launchdarkly_credentials):
+    return put_parameters(ssm_client, [
+        {'Name': LD_SERVER_KEY_PARAM, 'Description': "LaunchDarkly Server key", 'Value': launchdarkly_credentials['serverkey']},
+        {'Name': LD_CLIENT_KEY_PARAM, 'Description': "LaunchDarkly Client key", 'Value': launchdarkly_credentials['clientkey']},
+        {'Name': LD_SIGNON_URL_PARAM, 'Description': "LaunchDarkly SignOn URL", 'Value': launchdarkly_credentials['signonurl']},
+        {'Name': TABLE_NUMBER_PARAM, 'Description': "Table Number of the Team", 'Value': launchdarkly_credentials['table']},
+    ])
@@ -0,0 +1,113 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Compact layout of the team items in the quest team status table, read and rewritten on every check and update.
+# The handlers work on the expanded layout created by init_lambda (one attribute per flag, 'unknown' for values not
+# submitted yet), and the items are encoded on write and decoded on read:
+# - the boolean flags are packed into the 'flags' bitmask, bit i being FLAGS[i]
+# - the OPTIONAL_STRINGS attributes are left out while 'unknown'
+# - 'schema' holds the layout version
+# All other attributes (version, score ledger, outbox, GSI and progress attributes...) are stored as they are.
+#
+# Items without 'schema' use the expanded layout (version 1) and are decoded as they are, so existing teams are
+# migrated lazily by their next save.
+SCHEMA_ATTRIBUTE = 'schema'
+FLAGS_ATTRIBUTE = 'flags'
+
+SCHEMA_EXPANDED = 1
+SCHEMA_COMPACT = 2
+SCHEMA_VERSION = SCHEMA_COMPACT
+
+# Bit order of the flags. Only append to this list: reordering it would change the meaning of the stored bitmasks.
+FLAGS = [
+    'task1-attempted',
+    'task2-attempted',
+    'task3-attempted',
+    'task4-attempted',
+    'task1-score-locked',
+    'task2-score-locked',
+    'task3-score-locked',
+    'task4-score-locked',
+    'start-task-2',
+    'start-task-3',
+    'start-task-4',
+    'is-webapp-up',
+    'is-website-released',
+    'is-debug-mode',
+    'is-apprunner-done',
+    'is-db-migrated',
+    'is-answer-to-life-correct',
+    'task1-invalid-url-posted',
+]
+
+UNKNOWN = 'unknown'
+OPTIONAL_STRINGS = ['app-runner-url', 'debugcode', 'app-version', 'migration-location']
+
+
+def encode(team_data):
+    item = {key: value for key, value in team_data.items()
+            if key not in FLAGS and not (key in OPTIONAL_STRINGS and value == UNKNOWN)}
+    item[FLAGS_ATTRIBUTE] = sum(1 << bit for bit, flag in enumerate(FLAGS) if team_data.get(flag))
+    item[SCHEMA_ATTRIBUTE] = SCHEMA_VERSION
+    return item
+
+
+# Update of a compact item writing only the given attributes of the team data: changed flags rewrite the bitmask, and
+# removed attributes and 'unknown' optional strings are removed from the item
+# :returns: tuple of (UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+def encode_changes(team_data, attributes):
+    assignments, removals, names, values = [], [], {}, {}
+
+    def assign(attribute, value):
+        names[f"#f{len(names)}"] = attribute
+        values[f":f{len(values)}"] = value
+        assignments.append(f"#f{len(names) - 1} = :f{len(values) - 1}")
+
+    if any(attribute in FLAGS for attribute in attributes):
+        assign(FLAGS_ATTRIBUTE, sum(1 << bit for bit, flag in enumerate(FLAGS) if team_data.get(flag)))
+    for attribute in sorted(attributes):
+        if attribute in FLAGS:
+            continue
+        value = team_data.get(attribute)
+        if attribute not in team_data or (attribute in OPTIONAL_STRINGS and value == UNKNOWN):
+            names[f"#f{len(names)}"] = attribute
+            removals.append(f"#f{len(names) - 1}")
+        else:
+            assign(attribute, value)
+
+    update_expression = ' '.join(clause for clause in (
+        'SET ' + ', '.join(assignments) if assignments else '',
+        'REMOVE ' + ', '.join(removals) if removals else '',
+    ) if clause)
+    return update_expression, names, values
+
+
+def decode_expanded(item):
+    return dict(item)
+
+
+def decode_compact(item):
+    team_data = {key: value for key, value in item.items() if key not in (FLAGS_ATTRIBUTE, SCHEMA_ATTRIBUTE)}
+    flags = int(item.get(FLAGS_ATTRIBUTE, 0))
+    for bit, flag in enumerate(FLAGS):
+        team_data[flag] = bool(flags >> bit & 1)
+    for attribute in OPTIONAL_STRINGS:
+        team_data.setdefault(attribute, UNKNOWN)
+    return team_data
+
+
+DECODERS = {
+    SCHEMA_EXPANDED: decode_expanded,
+    SCHEMA_COMPACT: decode_compact,
+}
+
+
+# :returns: the team data in the expanded layout, None for a missing item
+def decode(item):
+    if item is None:
+        return None
+    schema = int(item.get(SCHEMA_ATTRIBUTE, SCHEMA_EXPANDED))
+    if schema not in DECODERS:
+        # Written by a newer version of the Lambdas: rewriting it in an older layout would lose data
+        raise ValueError(f"Unsupported schema {schema} for team {item.get('team-id')}")
+    return DECODERS[schema](item)
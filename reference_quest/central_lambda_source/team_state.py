@@ -0,0 +1,170 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import copy
+from decimal import Decimal
+import state_codec
+
+# In-memory team state of the handlers. It keeps the dict interface the handlers already use (team_data['is-webapp-up'],
+# get, setdefault, pop...), but:
+# - only the attributes declared in FIELDS exist, so a typo in an attribute name raises a KeyError instead of silently
+#   creating a new attribute, and values are checked against the declared type when decoded and assigned
+# - attributes are held in slots rather than in a per-instance dict
+# - assignments are tracked as they happen, and the containers (ledger, outbox...) are compared with a copy taken when
+#   first accessed, so that changed() returns the changed attributes without comparing the whole item
+# save_team_data then writes only the changed attributes. A container kept across a save must be accessed again through
+# the state before being modified, as the copies are reset by the save.
+
+# Item attribute -> type of its value. Numbers read from DynamoDB are Decimal and are accepted as int.
+FIELDS = {
+    'team-id': str,
+    'quest-start-time': int,
+    'version': int,
+    **{flag: bool for flag in state_codec.FLAGS},
+    **{attribute: str for attribute in state_codec.OPTIONAL_STRINGS},
+    'monitoring-chaos-timer': int,
+    # progress_utils and dynamodb_utils
+    'progress-stage': str,
+    'needs-evaluation': str,
+    # score_ledger
+    'score-ledger': dict,
+    'score-total': int,
+    # outbox
+    'outbox': dict,
+    'outbox-sequence': int,
+    # circuit_breaker
+    'probe-circuits': dict,
+    # work_budget
+    'deferred-work': list,
+}
+CONTAINERS = {attribute for attribute, kind in FIELDS.items() if kind in (dict, list)}
+
+# Item attribute -> slot name
+SLOTS = {attribute: attribute.replace('-', '_') for attribute in FIELDS}
+
+MISSING = object()
+
+
+def check_type(attribute, value):
+    kind = FIELDS[attribute]
+    if kind is int:
+        valid = isinstance(value, (int, Decimal)) and not isinstance(value, bool)
+    else:
+        valid = isinstance(value, kind)
+    if not valid:
+        raise ValueError(f"Team attribute {attribute} must be {kind.__name__}, got {type(value).__name__}: {value!r}")
+
+
+def slot(attribute):
+    if attribute not in SLOTS:
+        raise KeyError(f"Unknown team attribute {attribute}, see team_state.FIELDS")
+    return SLOTS[attribute]
+
+
+class TeamState:
+    __slots__ = tuple(SLOTS.values()) + ('schema', 'extra', 'dirty', 'snapshots')
+
+    def __init__(self, schema=None):
+        # Layout of the stored item, None if it was never saved
+        self.schema = schema
+        # Attributes of the stored item unknown to this version, written back as they are
+        self.extra = {}
+        self.dirty = set()
+        # container attribute -> copy of its value when first accessed
+        self.snapshots = {}
+
+    # Decodes and validates a team item
+    # :returns: TeamState, None for a missing item
+    @classmethod
+    def from_item(cls, item):
+        team_data = state_codec.decode(item)
+        if team_data is None:
+            return None
+        state = cls(int(item.get(state_codec.SCHEMA_ATTRIBUTE, state_codec.SCHEMA_EXPANDED)))
+        for attribute, value in team_data.items():
+            if attribute in SLOTS:
+                check_type(attribute, value)
+                setattr(state, SLOTS[attribute], value)
+            else:
+                state.extra[attribute] = value
+        if state.extra:
+            print(f"Team {team_data.get('team-id')} has undeclared attributes {sorted(state.extra)}, keeping them as they are")
+        return state
+
+    def __getitem__(self, attribute):
+        value = getattr(self, slot(attribute), MISSING)
+        if value is MISSING:
+            raise KeyError(attribute)
+        if attribute in CONTAINERS and attribute not in self.snapshots and attribute not in self.dirty:
+            self.snapshots[attribute] = copy.deepcopy(value)
+        return value
+
+    def __setitem__(self, attribute, value):
+        current = getattr(self, slot(attribute), MISSING)
+        check_type(attribute, value)
+        if current is MISSING or current != value or attribute in CONTAINERS:
+            self.dirty.add(attribute)
+        setattr(self, SLOTS[attribute], value)
+
+    def __delitem__(self, attribute):
+        if attribute not in self:
+            raise KeyError(attribute)
+        delattr(self, SLOTS[attribute])
+        self.dirty.add(attribute)
+
+    def __contains__(self, attribute):
+        return hasattr(self, slot(attribute))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, attribute, default=None):
+        return self[attribute] if attribute in self else default
+
+    def setdefault(self, attribute, default=None):
+        if attribute not in self:
+            self[attribute] = default
+        return self[attribute]
+
+    def pop(self, attribute, *default):
+        if attribute not in self:
+            if default:
+                return default[0]
+            raise KeyError(attribute)
+        value = self[attribute]
+        del self[attribute]
+        return value
+
+    def keys(self):
+        return [attribute for attribute, name in SLOTS.items() if hasattr(self, name)] + list(self.extra)
+
+    def items(self):
+        return [(attribute, self.get(attribute)) for attribute in SLOTS if attribute in self] + list(self.extra.items())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # Attributes assigned, removed or modified in place since the state was decoded or last saved
+    # :returns: set of attributes, the removed ones being no longer in the state
+    def changed(self):
+        changed = set(self.dirty)
+        for attribute, snapshot in self.snapshots.items():
+            if getattr(self, SLOTS[attribute], MISSING) != snapshot:
+                changed.add(attribute)
+        return changed
+
+    # Called once the state was written in the given layout
+    def mark_saved(self, schema):
+        self.schema = schema
+        self.dirty.clear()
+        self.snapshots.clear()
+
+    # Replaces the state with the latest stored one, e.g. after a version conflict
+    def reload(self, latest):
+        for name in SLOTS.values():
+            if hasattr(latest, name):
+                setattr(self, name, getattr(latest, name))
+            elif hasattr(self, name):
+                delattr(self, name)
+        self.schema = latest.schema
+        self.extra = dict(latest.extra)
+        self.mark_saved(latest.schema)
@@ -0,0 +1,94 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import copy
+import gzip
+import hashlib
+import json
+import os
+import time
+import uuid
+import boto3
+
+# Captures the events received by sns_lambda and cron_lambda, so that the traffic of an event can be replayed
+# afterwards with replay_traffic.py. Disabled unless TRAFFIC_CAPTURE_URI is set to:
+# - s3://bucket/prefix: one gzipped JSONL object per invocation under prefix/<source>/<yyyy/mm/dd/hh>/
+# - a local directory: appended to <directory>/<source>.jsonl.gz
+# Each line is {"ts": epoch seconds, "source": "sns"|"cron", "event": sanitized event}. Team IDs are replaced with
+# stable pseudonyms, SNS signatures, account IDs and credential-like values are removed.
+TRAFFIC_CAPTURE_URI = os.environ.get('TRAFFIC_CAPTURE_URI', '')
+
+SOURCE_SNS = 'sns'
+SOURCE_CRON = 'cron'
+
+# SNS record fields which identify the account or only matter for signature verification
+DROPPED_SNS_FIELDS = ['Signature', 'SignatureVersion', 'SigningCertUrl', 'SigningCertURL', 'UnsubscribeUrl',
+                      'UnsubscribeURL', 'TopicArn']
+DROPPED_RECORD_FIELDS = ['EventSubscriptionArn']
+# EventBridge event fields which identify the account
+DROPPED_CRON_FIELDS = ['account', 'resources']
+# Message values whose key contains one of these are redacted
+SECRET_MARKERS = ['token', 'secret', 'password', 'credential']
+REDACTED = '***'
+
+s3_client = None
+
+
+def pseudonym(team_id):
+    return 'team-' + hashlib.sha256(str(team_id).encode('utf-8')).hexdigest()[:12]
+
+
+def sanitize_message(message):
+    for key, value in message.items():
+        if key == 'team-id':
+            message[key] = pseudonym(value)
+        elif any(marker in key.lower() for marker in SECRET_MARKERS):
+            message[key] = REDACTED
+    return message
+
+
+def sanitize_sns_event(event):
+    event = copy.deepcopy(event)
+    for record in event.get('Records', []):
+        for field in DROPPED_RECORD_FIELDS:
+            record.pop(field, None)
+        sns = record.get('Sns', {})
+        for field in DROPPED_SNS_FIELDS:
+            sns.pop(field, None)
+        try:
+            sns['Message'] = json.dumps(sanitize_message(json.loads(sns['Message'])))
+        except (KeyError, ValueError, AttributeError):
+            sns['Message'] = REDACTED
+    return event
+
+
+def sanitize_cron_event(event):
+    event = copy.deepcopy(event)
+    for field in DROPPED_CRON_FIELDS:
+        event.pop(field, None)
+    return event
+
+
+SANITIZERS = {SOURCE_SNS: sanitize_sns_event, SOURCE_CRON: sanitize_cron_event}
+
+
+# Records an inbound event. Capture errors are logged and never fail the invocation.
+def capture(source, event):
+    global s3_client
+    if not TRAFFIC_CAPTURE_URI:
+        return
+    try:
+        now = time.time()
+        line = json.dumps({'ts': now, 'source': source, 'event': SANITIZERS[source](event)}, default=str) + '\n'
+        if TRAFFIC_CAPTURE_URI.startswith('s3://'):
+            bucket, _, prefix = TRAFFIC_CAPTURE_URI[len('s3://'):].partition('/')
+            key = (f"{prefix.rstrip('/')}/{source}/{time.strftime('%Y/%m/%d/%H', time.gmtime(now))}/"
+                   f"{int(now * 1000)}-{uuid.uuid4().hex}.jsonl.gz").lstrip('/')
+            if s3_client is None:
+                s3_client = boto3.client('s3')
+            s3_client.put_object(Bucket=bucket, Key=key, Body=gzip.compress(line.encode('utf-8')))
+        else:
+            os.makedirs(TRAFFIC_CAPTURE_URI, exist_ok=True)
+            with gzip.open(os.path.join(TRAFFIC_CAPTURE_URI, f"{source}.jsonl.gz"), 'at', encoding='utf-8') as log:
+                log.write(line)
+    except Exception as err:
+        print(f"Error while capturing {source} event, continuing: {err}")
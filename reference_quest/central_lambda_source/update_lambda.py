@@ -6,13 +6,20 @@ from platform import release
 from tabnanny import check
 import boto3
 from datetime import datetime
+import content_catalog
 import dynamodb_utils
+import quests_api_cache
+import circuit_breaker
 import quest_const
 import input_const
 import output_const
 import scoring_const
+import score_ledger
 import hint_const
-import http.client
+import probe_utils
+import profiling
+import outbox
+import url_utils
 import ui_utils
 from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
 
@@ -26,17 +33,18 @@ GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 
 # Quest Environment Variables
 QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
+QUEST_SUBMISSION_TABLE = os.environ['QUEST_SUBMISSION_TABLE']
+SUBMISSION_WINDOW_SECONDS = int(os.environ.get('SUBMISSION_WINDOW_SECONDS', '10'))
 
 # Dynamo DB resource
 dynamodb = boto3.resource('dynamodb')
 quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
+quest_submission_table = dynamodb.Table(QUEST_SUBMISSION_TABLE)
 
 def check_webapp(apprunnerurl):
     try:
         print(f"Testing web app status using URL {apprunnerurl}")
-        conn = http.client.HTTPSConnection(apprunnerurl.strip('https://'), timeout=5)
-        conn.request("GET", "/")
-        res = conn.getresponse()
+        res = probe_utils.get(url_utils.app_host(apprunnerurl), "/")
         status = res.status
         print(f"The status code returned it {status}")
         if status != 200:
@@ -49,13 +57,9 @@ def check_webapp(apprunnerurl):
 def getAppRelease(team_data):
     try:
         print(f"Getting current version via API")
-        conn = http.client.HTTPSConnection(team_data['app-runner-url'].strip('https://'), timeout=5)
-        conn.request("GET", "/status")
-        res = conn.getresponse()
-        string = res.read().decode('utf-8')
-        dataResp = json.loads(string)
-        print(dataResp['app-version'])
-        if dataResp['app-version'] == team_data['app-version']:
+        app_version = probe_utils.get_json_field(url_utils.app_host(team_data['app-runner-url']), "/status", 'app-version')
+        print(app_version)
+        if app_version == team_data['app-version']:
             return True
         else:
             raise Exception(f"The version does not match")
@@ -66,13 +70,9 @@ def getAppRelease(team_data):
 def getDebugValue(team_data):
     try:
         print(f"Getting debug value via the /teamdebug API")
-        conn = http.client.HTTPSConnection(team_data['app-runner-url'].strip('https://'), timeout=5)
-        conn.request("GET", "/teamdebug")
-        res = conn.getresponse()
-        string = res.read().decode('utf-8')
-        dataResp = json.loads(string)
-        print(dataResp['debugcode'])
-        if dataResp['debugcode'] == team_data['debugcode']:
+        debugcode = probe_utils.get_json_field(url_utils.app_host(team_data['app-runner-url']), "/teamdebug", 'debugcode')
+        print(debugcode)
+        if debugcode == team_data['debugcode']:
             return True
         else:
             raise Exception(f"The debug code is invalid")
@@ -83,13 +83,9 @@ def getDebugValue(team_data):
 def getMigrationValue(team_data):
     try:
         print(f"Getting debug value via the /teamdebug API")
-        conn = http.client.HTTPSConnection(team_data['app-runner-url'].strip('https://'), timeout=5)
-        conn.request("GET", "/health")
-        res = conn.getresponse()
-        string = res.read().decode('utf-8')
-        dataResp = json.loads(string)
-        print(dataResp['location'])
-        if dataResp['location'] == team_data['migration-location']:
+        location = probe_utils.get_json_field(url_utils.app_host(team_data['app-runner-url']), "/health", 'location')
+        print(location)
+        if location == team_data['migration-location']:
             return True
         else:
             raise Exception(f"The migration location is invalid")
@@ -119,11 +115,59 @@ def calculate_bonus_points(quests_api_client, quest_id, team_data):
 # This function is triggered by sns_lambda.py whenever the team has provided input via the event UI. It validates
 # the input and performs related operations, such as updating the team's DynamoDB table record or posting a feedback message.
 # Expected event parameters: {'team_id': team_id,'key': key, 'value': value}
+@profiling.profiled
 def lambda_handler(event, context):
     print(f"update_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # Pick up quest content changes published since the previous invocation
+    content_catalog.refresh()
+
+    # Malformed App Runner URLs are validated first: they skip the admission step and are only rejected, without
+    # penalty or probe, so that the input stays for another try
+    invalid_url = event['key'] == input_const.TASK1_ENDPOINT_KEY and url_utils.normalize_app_host(event['value']) is None
+
+    # Drop duplicate submissions (e.g. rapid button clicks) before any Quests API call or probe
+    if not invalid_url and not dynamodb_utils.admit_submission(quest_submission_table, event['team_id'], event['key'], event['value'], SUBMISSION_WINDOW_SECONDS):
+        print(f"Duplicate submission for team {event['team_id']} ({event['key']}), aborting UPDATE_LAMBDA")
+        return
+
+    try:
+        evaluate_submission(event, invalid_url)
+    except Exception:
+        # The invocation fails and is retried by Lambda: the retry must not be dropped as a duplicate
+        if not invalid_url:
+            dynamodb_utils.release_submission(quest_submission_table, event['team_id'], event['key'], event['value'])
+        raise
+
+
+# Tells the team that the submitted App Runner URL is malformed. The output is recorded in the team outbox, and the
+# team data tracks it so that a later valid submission only deletes it when it was posted.
+def reject_invalid_url(quests_api_client, event):
+    print(f"Invalid App Runner URL submitted by team {event['team_id']}: {event['value']}")
+    team_data = dynamodb_utils.get_team_data(quest_team_status_table, event['team_id'])
+    if team_data is None or team_data['is-webapp-up']:
+        print(f"Team {event['team_id']} has no Task 1 in progress, ignoring the invalid URL")
+        return
+
+    outbox_client = outbox.OutboxQuestsApiClient(quests_api_client, team_data)
+    outbox_client.post_output(
+        team_id=team_data['team-id'],
+        quest_id=QUEST_ID,
+        key=output_const.TASK1_APPRUNNER_INVALID_KEY,
+        label=output_const.TASK1_APPRUNNER_INVALID_LABEL,
+        value=output_const.TASK1_APPRUNNER_INVALID_VALUE,
+        dashboard_index=output_const.TASK1_APPRUNNER_INVALID_INDEX,
+        markdown=output_const.TASK1_APPRUNNER_INVALID_MARKDOWN,
+    )
+    team_data['task1-invalid-url-posted'] = True
+    outbox_client.commit(quest_team_status_table)
+    outbox.dispatch(quests_api_client, QUEST_ID, team_data, quest_team_status_table)
+
+
+# Evaluates an admitted submission, or rejects an invalid App Runner URL, see lambda_handler
+def evaluate_submission(event, invalid_url=False):
+    # Instantiate the Quest API Client, caching its lookups for this invocation
+    quests_api_client = quests_api_cache.CachingQuestsApiClient(GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN))
 
     # Check if event is running
     event_status = quests_api_client.get_event_status()
@@ -135,14 +179,34 @@ def lambda_handler(event, context):
     quest_status = quests_api_client.get_quest_for_team(team_id=event['team_id'], quest_id=QUEST_ID)
     if quest_status['quest-state'] != quest_const.TEAM_QUEST_IN_PROGRESS:
         print(f"Quest Status: {quest_status['quest-state']}, aborting UPDATE_LAMBDA")
+        return
+
+    if invalid_url:
+        reject_invalid_url(quests_api_client, event)
+        return
 
-    dynamodb_response = quest_team_status_table.get_item(Key={'team-id': event['team_id']})
-    print(f"Retrieved team state for team {event['team_id']}: {json.dumps(dynamodb_response, default=str)}")
-    team_data = dynamodb_response['Item']
+    team_data = dynamodb_utils.get_team_data(quest_team_status_table, event['team_id'])
+    print(f"Retrieved team state for team {event['team_id']}: {json.dumps(team_data.to_dict(), default=str)}")
+
+    # Dashboard writes for the team are recorded in its outbox, and committed with its state by save_team_data
+    quests_api_client = outbox.OutboxQuestsApiClient(quests_api_client, team_data)
 
     # Task 1 evaluation
     if (event['key'] == input_const.TASK1_ENDPOINT_KEY
         and not team_data['is-webapp-up']): # This second check is needed to avoid multiple submissions since points are being given here
+
+        # Validated by lambda_handler
+        app_host = url_utils.normalize_app_host(event['value'])
+
+        # Remove the invalid URL message of a previous submission
+        if team_data.get('task1-invalid-url-posted'):
+            quests_api_client.delete_output(
+                team_id=team_data['team-id'],
+                quest_id=QUEST_ID,
+                key=output_const.TASK1_APPRUNNER_INVALID_KEY
+            )
+            team_data['task1-invalid-url-posted'] = False
+
         try:
             print("prior apprunner url value is "+team_data['app-runner-url'])
             input_value = event['value'] 
@@ -152,10 +216,7 @@ def lambda_handler(event, context):
             print("setting task1-attempted to True")
             team_data['task1-attempted'] = True
             print("Setting App Runner URL value")
-            team_data['app-runner-url'] = str(event['value'])
-
-            # Update DynamoDB to avoid race conditions, then do the rest on success
-            dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+            team_data['app-runner-url'] = f"https://{app_host}"
 
             # Delete input since cannot be updated as task can be started only once
             quests_api_client.delete_input(
@@ -164,21 +225,22 @@ def lambda_handler(event, context):
                 key=input_const.TASK1_ENDPOINT_KEY
             )
 
-            apphealth = check_webapp(team_data['app-runner-url'])
+            # Update DynamoDB to avoid race conditions, then do the rest on success
+            dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+
+            # A new submission lets the probe through even if the circuit for the team app is open
+            circuit_breaker.force_half_open(team_data, team_data['app-runner-url'])
+            apphealth = circuit_breaker.guarded_probe(team_data, team_data['app-runner-url'],
+                                                      lambda: check_webapp(team_data['app-runner-url']))
 
             if apphealth == True:
                 team_data['is-webapp-up'] = True
                 print(f"Setting team_data is-webapp-up to True and updating Dynamo")
                 # team_data['is-apprunner-done'] = True
                 # print(f"Updating the apprunner-done task to true")
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
-                
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.CORRECT_APPRUNNER_DESC,
-                    points=scoring_const.CORRECT_APPRUNNER_POINTS
-                )              
+                score_ledger.award(team_data, 'task1-apprunner-correct',
+                                   scoring_const.CORRECT_APPRUNNER_DESC, scoring_const.CORRECT_APPRUNNER_POINTS)
+
                 # Delete app down message if present
                 quests_api_client.delete_output(
                     team_id=team_data["team-id"],
@@ -241,12 +303,15 @@ def lambda_handler(event, context):
                     hint_key=hint_const.TASK2_HINT1_KEY,
                     label=hint_const.TASK2_HINT1_LABEL,
                     description=hint_const.TASK2_HINT1_DESCRIPTION,
-                    value=hint_const.TASK1_HINT2_VALUE,
+                    value=hint_const.TASK2_HINT1_VALUE,
                     dashboard_index=hint_const.TASK2_HINT1_INDEX,
-                    cost=hint_const.TASK1_HINT2_COST,
+                    cost=hint_const.TASK2_HINT1_COST,
                     status=hint_const.STATUS_OFFERED
                 )
 
+                # The dashboard writes are recorded first, so that the transition and its writes are one save
+                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+
             else: 
                 if team_data['task1-attempted']:
                     print(f"The web application for team {team_data['team-id']} is DOWN")
@@ -254,7 +319,8 @@ def lambda_handler(event, context):
                     team_data['app-runner-url'] = 'unknown'
                     # team_data['is-apprunner-done']: False
                     print(f"Setting app-runner-url to unknown Dynamo")
-                    dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+                    score_ledger.award(team_data, score_ledger.next_attempt_id(team_data, 'task1-apprunner-wrong'),
+                                       scoring_const.WRONG_APPRUNNER_DESC, scoring_const.WRONG_APPRUNNER_POINTS)
 
                     quests_api_client.post_input(
                         team_id=team_data['team-id'],
@@ -288,19 +354,14 @@ def lambda_handler(event, context):
                         status=hint_const.STATUS_OFFERED
                     )
 
-                    quests_api_client.post_score_event(
-                        team_id=team_data["team-id"],
-                        quest_id=QUEST_ID,
-                        description=scoring_const.WRONG_APPRUNNER_DESC,
-                        points=scoring_const.WRONG_APPRUNNER_POINTS
-                    ) 
-
                     quests_api_client.delete_output(
                         team_id=team_data["team-id"],
                         quest_id=QUEST_ID,
                         key="TASK1_APPRUNNER_DOWN_KEY"
                     ) 
 
+                    dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+
                 # Assuming they havent yet 
                 else: 
                     print("Not attempted yet; doing nothing")
@@ -330,29 +391,24 @@ def lambda_handler(event, context):
                 team_data['is-website-released'] = True
                 team_data['start-task-3'] = True
                 print("writing updated task2 value")
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
-                
-                print("Task 2 - Checking for errors and deleting if there is")
-                
+                score_ledger.award(team_data, 'task2-released', scoring_const.COMPLETE_DESC, scoring_const.COMPLETE_POINTS)
+
                 print("unlocking task2 score lock")
                 team_data['task2-score-locked'] = False
-                
-                print("Trying to delete unlreased error")
+
+                # The dashboard updates are recorded in the outbox and committed with the release below
+                print("Task 2 - Deleting unreleased error and hint, posting complete output and task 3")
                 quests_api_client.delete_output(
                     team_id=team_data['team-id'],
                     quest_id=QUEST_ID,
                     key=output_const.TASK2_UNRELEASED_KEY,
                 )
-                
-                print("Deleting hint")
                 quests_api_client.delete_hint(
                     team_id=team_data["team-id"],
                     quest_id=QUEST_ID, 
                     hint_key=hint_const.TASK2_HINT1_KEY,
                     detail=True
                 )
-
-                print("Posting complete output")
                 quests_api_client.post_output(
                     team_id=team_data['team-id'],
                     quest_id=QUEST_ID,
@@ -362,16 +418,6 @@ def lambda_handler(event, context):
                     dashboard_index=output_const.TASK2_COMPLETE_INDEX,
                     markdown=output_const.TASK2_COMPLETE_MARKDOWN,
                 )
-
-
-                print("Scoring task 2")
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.COMPLETE_DESC,
-                    points=scoring_const.COMPLETE_POINTS
-                )
-
                 quests_api_client.post_input(
                     team_id=team_data['team-id'],
                     quest_id=QUEST_ID,
@@ -380,7 +426,6 @@ def lambda_handler(event, context):
                     description=input_const.TASK3_DEBUG_DESCRIPTION,
                     dashboard_index=input_const.TASK3_DEBUG_INDEX
                 )
-
                 quests_api_client.post_output(
                     team_id=team_data['team-id'],
                     quest_id=QUEST_ID,
@@ -390,18 +435,19 @@ def lambda_handler(event, context):
                     dashboard_index=output_const.TASK3_INDEX,
                     markdown=output_const.TASK3_COMPLETE_MARKDOWN,
                 )
-
                 quests_api_client.delete_output(
                     team_id=team_data['team-id'],
                     quest_id=QUEST_ID,
                     key="task2_score_lock",
                 )
+                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
             else: 
                 print("resetting app-version")
                 team_data['app-version'] = 'unknown'
                 print("writing values to Dynamo")
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+                score_ledger.award(team_data, score_ledger.next_attempt_id(team_data, 'task2-unreleased'),
+                                   scoring_const.UNRELEASED_DESC, scoring_const.UNRELEASED_POINTS)
                 
                 quests_api_client.post_output(
                     team_id=team_data['team-id'],
@@ -413,12 +459,6 @@ def lambda_handler(event, context):
                     markdown=True,
                 )
 
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.UNRELEASED_DESC,
-                    points=scoring_const.UNRELEASED_POINTS
-                )
                 team_data['task2-score-locked'] = False
                 
                 print("Deleting task lock message")
@@ -481,12 +521,7 @@ def lambda_handler(event, context):
                         markdown=output_const.TASK3_COMPLETE_MARKDOWN,
                     )
 
-                quests_api_client.post_score_event(
-                        team_id=team_data["team-id"],
-                        quest_id=QUEST_ID,
-                        description=scoring_const.DEBUG_RIGHT_DESC,
-                        points=scoring_const.DEBUG_RIGHT_POINTS
-                    )
+                score_ledger.award(team_data, 'task3-debug-right', scoring_const.DEBUG_RIGHT_DESC, scoring_const.DEBUG_RIGHT_POINTS)
                 team_data['is-debug-mode'] = True
 
                 # Post Task 4 info
@@ -516,7 +551,7 @@ def lambda_handler(event, context):
                 print("Value was wrong - setting reset sequence") 
                 print("Removing score lock for Task 3")
                 team_data['task3-score-locked'] = False
-                team_data['debugCode'] = 'unknown'
+                team_data['debugcode'] = 'unknown'
                 
                 quests_api_client.post_output(
                         team_id=team_data['team-id'],
@@ -537,12 +572,8 @@ def lambda_handler(event, context):
                         dashboard_index=input_const.TASK3_DEBUG_INDEX
                     )  
 
-                quests_api_client.post_score_event(
-                        team_id=team_data["team-id"],
-                        quest_id=QUEST_ID,
-                        description=scoring_const.DEBUG_WRONG_DESC,
-                        points=scoring_const.DEBUG_WRONG_POINTS
-                    )
+                score_ledger.award(team_data, score_ledger.next_attempt_id(team_data, 'task3-debug-wrong'),
+                                   scoring_const.DEBUG_WRONG_DESC, scoring_const.DEBUG_WRONG_POINTS)
 
                 dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
@@ -574,13 +605,6 @@ def lambda_handler(event, context):
                             key=output_const.TASK4_WRONG_KEY,
                         )
 
-                quests_api_client.post_score_event(
-                            team_id=team_data["team-id"],
-                            quest_id=QUEST_ID,
-                            description=scoring_const.MIGRATION_SUCCESS_DESC,
-                            points=scoring_const.MIGRATION_SUCCESS_POINTS
-                        )
-
                 quests_api_client.post_output(
                             team_id=team_data['team-id'],
                             quest_id=QUEST_ID,
@@ -592,23 +616,14 @@ def lambda_handler(event, context):
                         )
 
                 team_data['task4-score-locked'] = False
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
-
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.QUEST_COMPLETE_DESC,
-                    points=scoring_const.QUEST_COMPLETE_POINTS
-                )
+                score_ledger.award(team_data, 'task4-migration-success',
+                                   scoring_const.MIGRATION_SUCCESS_DESC, scoring_const.MIGRATION_SUCCESS_POINTS)
+                score_ledger.award(team_data, 'quest-complete', scoring_const.QUEST_COMPLETE_DESC, scoring_const.QUEST_COMPLETE_POINTS)
 
                 # Award quest complete bonus points
-                bonus_points = calculate_bonus_points(quests_api_client, QUEST_ID, team_data)
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.QUEST_COMPLETE_BONUS_DESC,
-                    points=bonus_points
-                )
+                if 'quest-complete-bonus' not in team_data.get(score_ledger.LEDGER_ATTRIBUTE, {}):
+                    bonus_points = calculate_bonus_points(quests_api_client, QUEST_ID, team_data)
+                    score_ledger.award(team_data, 'quest-complete-bonus', scoring_const.QUEST_COMPLETE_BONUS_DESC, bonus_points)
 
                 # Post quest complete message
                 quests_api_client.post_output(
@@ -621,17 +636,16 @@ def lambda_handler(event, context):
                     markdown=output_const.QUEST_COMPLETE_MARKDOWN,
                 )
 
-                # Complete quest
+                # Complete quest. The outbox delivers it after the other dashboard writes and the score events.
                 quests_api_client.post_quest_complete(team_id=team_data['team-id'], quest_id=QUEST_ID)
 
+                # The dashboard writes are recorded first, so that the transition and its writes are one save
+                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
+
             else:
 
-                quests_api_client.post_score_event(
-                            team_id=team_data["team-id"],
-                            quest_id=QUEST_ID,
-                            description=scoring_const.MIGRATION_FAILED_DESC,
-                            points=scoring_const.MIGRATION_FAILED_POINTS
-                        )
+                score_ledger.award(team_data, score_ledger.next_attempt_id(team_data, 'task4-migration-failed'),
+                                   scoring_const.MIGRATION_FAILED_DESC, scoring_const.MIGRATION_FAILED_POINTS)
 
                 quests_api_client.post_output(
                             team_id=team_data['team-id'],
@@ -662,3 +676,14 @@ def lambda_handler(event, context):
 
     else:
         print(f"Unknown input key {event['key']} encountered, ignoring.")
+
+    # Transitions save their dashboard writes with their state. Commit the writes recorded without a transition, such as
+    # the score lock message: a failed commit fails the invocation, which is then retried.
+    quests_api_client.commit(quest_team_status_table)
+
+    # Hand the committed writes and the points awarded by this update to the outbox drainer. Whatever is not delivered
+    # is retried by CHECK_TEAM_LAMBDA.
+    try:
+        outbox.dispatch(quests_api_client.quests_api_client, QUEST_ID, team_data, quest_team_status_table)
+    except Exception as err:
+        print(f"Error while dispatching the outbox, pending entries will be retried: {err}")
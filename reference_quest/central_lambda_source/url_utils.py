@@ -0,0 +1,59 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import re
+from fnmatch import fnmatch
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+# Comma-separated host patterns team app URLs must match, e.g. "*.awsapprunner.com,*.example.com"
+ALLOWED_APP_DOMAINS = [
+    domain.strip().lower()
+    for domain in os.environ.get('ALLOWED_APP_DOMAINS', '*.awsapprunner.com').split(',')
+    if domain.strip()
+]
+
+HOST_LABEL = re.compile(r'^(?!-)[a-z0-9-]{1,63}(?<!-)$')
+
+
+# Normalizes a team app URL submission to the host it points to, e.g. " HTTPS://abc.awsapprunner.com/ " gives
+# "abc.awsapprunner.com". Only an http(s) scheme and a bare host are accepted: ports, credentials, paths other than "/",
+# queries and fragments are rejected, as is any host outside ALLOWED_APP_DOMAINS.
+# Results are cached, as the same URLs are probed again on every check.
+# :returns: the normalized host, or None if the URL is not valid
+@lru_cache(maxsize=1024)
+def normalize_app_host(url):
+    url = str(url).strip()
+    if not url or len(url) > 2048:
+        return None
+    if '://' not in url:
+        url = f"https://{url}"
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    if (parts.scheme.lower() not in ('http', 'https') or port is not None or parts.username is not None
+            or parts.password is not None or parts.path not in ('', '/') or parts.query or parts.fragment):
+        return None
+
+    host = (parts.hostname or '').rstrip('.')
+    if not host or len(host) > 253 or not all(HOST_LABEL.match(label) for label in host.split('.')):
+        return None
+    if not any(fnmatch(host, domain) for domain in ALLOWED_APP_DOMAINS):
+        return None
+    return host
+
+
+def is_valid_app_url(url):
+    return normalize_app_host(url) is not None
+
+
+# Host to probe for a team app URL
+# :raises ValueError: if the URL is not valid
+def app_host(url):
+    host = normalize_app_host(url)
+    if host is None:
+        raise ValueError(f"Invalid team app URL: {url}")
+    return host
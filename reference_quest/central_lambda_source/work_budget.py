@@ -0,0 +1,63 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+
+# Time always kept aside to persist the team state at the end of an invocation
+PERSIST_RESERVE_MS = int(os.environ.get('PERSIST_RESERVE_MS', '3000'))
+
+# Team item attribute listing the optional work deferred to the next invocation, in the order it was deferred
+DEFERRED_WORK_ATTRIBUTE = 'deferred-work'
+
+
+# Tracks the time left in a Lambda invocation, so that each stage only starts when its allowance fits
+# before the reserve needed to persist state
+class WorkBudget:
+
+    def __init__(self, context, reserve_ms=PERSIST_RESERVE_MS):
+        self.context = context
+        self.reserve_ms = reserve_ms
+
+    # Milliseconds left in the invocation. Without a Lambda context (e.g. local runs) the budget is unlimited.
+    def remaining_ms(self):
+        if self.context is None or not hasattr(self.context, 'get_remaining_time_in_millis'):
+            return float('inf')
+        return self.context.get_remaining_time_in_millis()
+
+    # Whether a stage needing allowance_ms can still run without eating into the persist reserve
+    def allows(self, allowance_ms):
+        return self.remaining_ms() - self.reserve_ms >= allowance_ms
+
+    # Runs a stage if its allowance fits, logs and skips it otherwise
+    # :returns: tuple of (ran, result)
+    def run_stage(self, name, allowance_ms, stage, *args):
+        if not self.allows(allowance_ms):
+            print(f"Skipping stage {name}: {self.remaining_ms()} ms left, {allowance_ms} ms needed plus {self.reserve_ms} ms reserved")
+            return False, None
+        return True, stage(*args)
+
+
+# Runs an optional piece of work if the budget allows it, otherwise records it in the team item for the next run.
+# :param work: dict of work name to callable, called as work[name](*args)
+def run_or_defer(budget, team_data, name, allowance_ms, work, *args):
+    if budget.allows(allowance_ms):
+        work[name](*args)
+        return True
+    deferred = team_data.setdefault(DEFERRED_WORK_ATTRIBUTE, [])
+    if name not in deferred:
+        deferred.append(name)
+    print(f"Deferred {name} for team {team_data['team-id']} to the next run")
+    return False
+
+
+# Runs the work deferred by previous invocations first, as long as the budget allows it
+def run_deferred(budget, team_data, allowance_ms, work, *args):
+    deferred = team_data.get(DEFERRED_WORK_ATTRIBUTE, [])
+    while deferred and budget.allows(allowance_ms):
+        name = deferred.pop(0)
+        print(f"Running deferred {name} for team {team_data['team-id']}")
+        try:
+            work[name](*args)
+        except Exception as err:
+            print(f"Error while running deferred {name}, dropping it: {err}")
+    if not deferred:
+        team_data.pop(DEFERRED_WORK_ATTRIBUTE, None)
@@ -0,0 +1,456 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Replays the SNS and cron traffic captured by traffic_capture.py into the central Lambda handlers, running in this
+# process against local stand-ins for the Quests API, DynamoDB, the other AWS services and the team apps.
+# Reports the throughput, the handler latencies and the number of calls made to each external dependency.
+#
+# Download the captures first when they were stored in S3:
+#   aws s3 sync s3://<bucket>/<prefix> captures/
+#   python3 replay_traffic.py captures/ --speed 10 --seed-teams
+#
+# Requires boto3 (for its DynamoDB condition classes), no AWS credentials are used.
+import argparse
+import collections
+import contextlib
+import copy
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import time
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, AttributeBase
+from botocore.exceptions import ClientError
+
+CENTRAL_LAMBDA_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'central_lambda_source')
+
+# Environment of the replayed Lambdas. Function and table names only need to be consistent with the stand-ins.
+REPLAY_ENVIRONMENT = {
+    'QUEST_API_BASE': 'https://quests-api.replay',
+    'QUEST_API_TOKEN': 'replay',
+    'GAMEDAY_REGION': 'us-east-1',
+    'ASSETS_BUCKET': 'replay-assets',
+    'ASSETS_BUCKET_PREFIX': 'replay/',
+    'QUEST_TEAM_STATUS_TABLE': 'QuestTeamStatusTable',
+    'QUEST_SUBMISSION_TABLE': 'QuestSubmissionTable',
+    'NEEDS_EVALUATION_INDEX': 'NeedsEvaluationIndex',
+    'EVENT_RULE_CRON': 'EventRuleLambdaCron',
+    'INIT_LAMBDA': 'InitLambda',
+    'UPDATE_LAMBDA': 'UpdateLambda',
+    'CHECK_TEAM_LAMBDA': 'CheckTeamLambda',
+    'OUTBOX_LAMBDA': 'OutboxLambda',
+    'TRAFFIC_CAPTURE_URI': '',
+}
+
+# Lambda function name -> handler module
+HANDLER_MODULES = {
+    'InitLambda': 'init_lambda',
+    'UpdateLambda': 'update_lambda',
+    'CheckTeamLambda': 'check_team_lambda',
+    'OutboxLambda': 'outbox_lambda',
+}
+
+# Primary key attribute of the tables known to the stand-in
+TABLE_KEYS = {
+    'QuestTeamStatusTable': 'team-id',
+    'QuestSubmissionTable': 'submission-id',
+}
+
+# dependency -> operation -> number of calls
+calls = collections.defaultdict(collections.Counter)
+errors = collections.Counter()
+
+
+def count(dependency, operation):
+    calls[dependency][operation] += 1
+
+
+# Evaluates a boto3 condition (Attr/Key expressions) against an item, None standing for a missing item
+def evaluate(condition, item):
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return evaluate(values[0], item) and evaluate(values[1], item)
+    if operator == 'OR':
+        return evaluate(values[0], item) or evaluate(values[1], item)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+
+    item = item or {}
+    name = values[0].name
+    if operator == 'attribute_not_exists':
+        return name not in item
+    if operator == 'attribute_exists':
+        return name in item
+    if name not in item:
+        return False
+    operand = values[1].name if isinstance(values[1], AttributeBase) else values[1]
+    value = item[name]
+    comparisons = {
+        '=': lambda: value == operand,
+        '<>': lambda: value != operand,
+        '<': lambda: value < operand,
+        '<=': lambda: value <= operand,
+        '>': lambda: value > operand,
+        '>=': lambda: value >= operand,
+        'begins_with': lambda: str(value).startswith(operand),
+        'BETWEEN': lambda: operand <= value <= values[2],
+    }
+    if operator not in comparisons:
+        raise NotImplementedError(f"Condition operator {operator} is not supported by the replay stand-in")
+    return comparisons[operator]()
+
+
+def conditional_check_failed(operation):
+    return ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+                       operation)
+
+
+# In-memory DynamoDB table. update_item only applies the top-level SET and REMOVE of the team item saves, the other
+# updates are only counted: the replay measures the traffic, not the aggregates.
+class StandInTable:
+
+    def __init__(self, name):
+        self.name = name
+        self.key = TABLE_KEYS.get(name, 'team-id')
+        self.items = {}
+
+    def get_item(self, Key, **kwargs):
+        count('dynamodb', 'GetItem')
+        item = self.items.get(Key[self.key])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ReturnValues=None, **kwargs):
+        count('dynamodb', 'PutItem')
+        previous = self.items.get(Item[self.key])
+        if isinstance(ConditionExpression, ConditionBase) and not evaluate(ConditionExpression, previous):
+            raise conditional_check_failed('PutItem')
+        self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {'Attributes': copy.deepcopy(previous)} if ReturnValues == 'ALL_OLD' and previous else {}
+
+    def update_item(self, Key, UpdateExpression='', ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, **kwargs):
+        count('dynamodb', 'UpdateItem')
+        clauses = re.fullmatch(r'(?:SET (?P<set>#\w+ = :\w+(?:, #\w+ = :\w+)*))? ?(?:REMOVE (?P<remove>#\w+(?:, #\w+)*))?',
+                               UpdateExpression)
+        if not clauses or Key[self.key] not in self.items:
+            return {}
+        item = self.items[Key[self.key]]
+        if isinstance(ConditionExpression, ConditionBase) and not evaluate(ConditionExpression, item):
+            raise conditional_check_failed('UpdateItem')
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        for assignment in clauses['set'].split(', ') if clauses['set'] else []:
+            name, value = assignment.split(' = ')
+            item[names[name]] = copy.deepcopy(values[value])
+        for name in clauses['remove'].split(', ') if clauses['remove'] else []:
+            item.pop(names[name], None)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        count('dynamodb', 'DeleteItem')
+        self.items.pop(Key[self.key], None)
+        return {}
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey=None, **kwargs):
+        count('dynamodb', 'Query')
+        items = [copy.deepcopy(item) for item in self.items.values() if evaluate(KeyConditionExpression, item)]
+        return {'Items': items, 'Count': len(items)}
+
+    def scan(self, FilterExpression=None, **kwargs):
+        count('dynamodb', 'Scan')
+        return {'Items': [copy.deepcopy(item) for item in self.items.values()
+                          if FilterExpression is None or evaluate(FilterExpression, item)]}
+
+
+class StandInDynamoDB:
+
+    def __init__(self):
+        self.tables = {}
+
+    def Table(self, name):
+        return self.tables.setdefault(name, StandInTable(name))
+
+    def batch_get_item(self, RequestItems):
+        count('dynamodb', 'BatchGetItem')
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [copy.deepcopy(table.items[key[table.key]])
+                               for key in request['Keys'] if key[table.key] in table.items]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+# Lambda stand-in: invocations run the target handler in this process, synchronously
+class StandInLambda:
+
+    def invoke(self, FunctionName, Payload='{}', InvocationType='RequestResponse', **kwargs):
+        count('lambda', f"Invoke {FunctionName}")
+        # Qualified names (e.g. check shards) run the handler of the function
+        module = HANDLER_MODULES.get(FunctionName.split(':')[0])
+        if module is None:
+            return {'StatusCode': 404}
+        handler = __import__(module).lambda_handler
+        try:
+            handler(json.loads(Payload), ReplayContext())
+        except Exception as err:
+            # Async invocations never report errors to the caller
+            errors[FunctionName] += 1
+            if InvocationType != 'Event':
+                raise err
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200}
+
+
+class StandInSSM:
+
+    def get_parameters(self, Names, **kwargs):
+        count('ssm', 'GetParameters')
+        return {'Parameters': [{'Name': name, 'Value': f"replay-{name}"} for name in Names], 'InvalidParameters': []}
+
+    def get_parameter(self, Name, **kwargs):
+        count('ssm', 'GetParameter')
+        return {'Parameter': {'Name': Name, 'Value': f"replay-{Name}"}}
+
+    def put_parameter(self, **kwargs):
+        count('ssm', 'PutParameter')
+        return {'Version': 1}
+
+
+class StandInS3:
+
+    def generate_presigned_url(self, operation, Params, **kwargs):
+        count('s3', 'GeneratePresignedUrl')
+        return f"https://{Params['Bucket']}.s3.replay/{Params['Key']}"
+
+    def get_object(self, **kwargs):
+        count('s3', 'GetObject')
+        raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not available in replays'}}, 'GetObject')
+
+    def put_object(self, **kwargs):
+        count('s3', 'PutObject')
+        return {}
+
+
+# Client of any other service: every call is counted and returns an empty response
+class StandInClient:
+
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, operation):
+        def call(*args, **kwargs):
+            count(self.service, operation)
+            return {}
+        return call
+
+
+# Quests API stand-in: the event and every team quest are in progress, and every update succeeds
+# In-memory DynamoDB of the replay, set by install_stand_ins
+stand_in_dynamodb = None
+
+
+class StandInQuestsApiClient:
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_event_status(self):
+        count('quests_api', 'get_event_status')
+        return {'status': 'IN_PROGRESS'}
+
+    def get_quest_for_team(self, team_id, quest_id):
+        count('quests_api', 'get_quest_for_team')
+        return {'quest-state': 'IN_PROGRESS', 'quest-start-time': int(time.time()) - 600}
+
+    # Every team of the replayed quest is in progress
+    def get_teams_for_quest(self, quest_id):
+        count('quests_api', 'get_teams_for_quest')
+        table = stand_in_dynamodb.Table(os.environ['QUEST_TEAM_STATUS_TABLE'])
+        return [{'team-id': team_id, 'quest-state': 'IN_PROGRESS'} for team_id in table.items if not team_id.startswith('#')]
+
+    def get_team(self, team_id):
+        count('quests_api', 'get_team')
+        return {'team-id': team_id, 'table-number': 1}
+
+    # Sessions in the team accounts use the same stand-in clients
+    def assume_team_ops_role(self, team_id):
+        count('quests_api', 'assume_team_ops_role')
+        return boto3
+
+    def __getattr__(self, operation):
+        def call(*args, **kwargs):
+            count('quests_api', operation)
+            return {'statusCode': 200}
+        return call
+
+
+# Lambda context with the default 60 s timeout of the quest Lambdas
+class ReplayContext:
+
+    def __init__(self, timeout_ms=60000):
+        self.deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def install_stand_ins(quest_id, team_apps_up):
+    os.environ.update(REPLAY_ENVIRONMENT)
+    os.environ['QUEST_ID'] = quest_id
+
+    global stand_in_dynamodb
+    dynamodb = stand_in_dynamodb = StandInDynamoDB()
+    clients = {'lambda': StandInLambda(), 'ssm': StandInSSM(), 's3': StandInS3()}
+    boto3.resource = lambda service, *args, **kwargs: dynamodb
+    boto3.client = lambda service, *args, **kwargs: clients.get(service) or StandInClient(service)
+
+    quests_api = type(sys)('aws_gameday_quests.gdQuestsApi')
+    quests_api.GameDayQuestsApiClient = StandInQuestsApiClient
+    sys.modules['aws_gameday_quests'] = type(sys)('aws_gameday_quests')
+    sys.modules['aws_gameday_quests.gdQuestsApi'] = quests_api
+
+    sys.path.insert(0, CENTRAL_LAMBDA_SOURCE)
+    import probe_utils
+
+    # Team app stand-in, answering every probe when up and refusing connections otherwise
+    def get(host, path, *args, **kwargs):
+        count('team_app', f"GET {path}")
+        if not team_apps_up:
+            raise ConnectionRefusedError(f"Team app {host} is down")
+        return probe_utils.ProbeResponse(200, b'{}', {}, True)
+
+    def get_json_field(host, path, field, *args, **kwargs):
+        count('team_app', f"GET {path}")
+        if not team_apps_up:
+            raise ConnectionRefusedError(f"Team app {host} is down")
+        return 'replay'
+
+    probe_utils.get = get
+    probe_utils.get_json_field = get_json_field
+    return dynamodb
+
+
+def read_captures(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files.extend(os.path.join(directory, name) for name in names
+                             if name.endswith('.jsonl') or name.endswith('.jsonl.gz'))
+        else:
+            files.append(path)
+
+    captures = []
+    for file in files:
+        opener = gzip.open if file.endswith('.gz') else open
+        with opener(file, 'rt', encoding='utf-8') as log:
+            captures.extend(json.loads(line) for line in log if line.strip())
+    return sorted(captures, key=lambda capture: capture['ts'])
+
+
+def sns_messages(capture):
+    if capture['source'] != 'sns':
+        return []
+    messages = []
+    for record in capture['event'].get('Records', []):
+        try:
+            messages.append(json.loads(record['Sns']['Message']))
+        except (KeyError, ValueError):
+            pass
+    return messages
+
+
+# The quest most messages were sent for, when it was not given
+def guess_quest_id(captures):
+    quest_ids = collections.Counter(message.get('quest-id') for capture in captures for message in sns_messages(capture))
+    quest_ids.pop(None, None)
+    return quest_ids.most_common(1)[0][0] if quest_ids else 'replay-quest'
+
+
+# Creates the initial item of every team seen in the captures, for captures started after the teams were initialized
+def seed_teams(captures):
+    import dynamodb_utils
+    import init_lambda
+    table = init_lambda.quest_team_status_table
+    team_ids = {message['team-id'] for capture in captures for message in sns_messages(capture) if 'team-id' in message}
+    for team_id in team_ids:
+        dynamodb_utils.create_team_data(init_lambda.initial_team_item(team_id), table)
+    calls.clear()
+    return len(team_ids)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def replay(captures, speed, verbose):
+    import sns_lambda
+    import cron_lambda
+    handlers = {'sns': sns_lambda.lambda_handler, 'cron': cron_lambda.lambda_handler}
+
+    latencies = collections.defaultdict(list)
+    started = time.monotonic()
+    first_ts = captures[0]['ts'] if captures else 0
+    for capture in captures:
+        if speed > 0:
+            delay = (capture['ts'] - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        invoked = time.perf_counter()
+        try:
+            with output:
+                handlers[capture['source']](capture['event'], ReplayContext())
+        except Exception as err:
+            errors[f"{capture['source']}_lambda"] += 1
+            print(f"Error while replaying {capture['source']} event at {capture['ts']}: {err}")
+        latencies[capture['source']].append((time.perf_counter() - invoked) * 1000)
+    return time.monotonic() - started, latencies
+
+
+def report(elapsed, latencies):
+    events = sum(len(values) for values in latencies.values())
+    print(f"\nReplayed {events} events in {elapsed:.2f} s ({events / elapsed if elapsed else 0:.1f} events/s)")
+    for source, values in sorted(latencies.items()):
+        print(f"  {source}: {len(values)} events, latency p50 {percentile(values, 0.5):.1f} ms, "
+              f"p95 {percentile(values, 0.95):.1f} ms, max {max(values):.1f} ms")
+    print("\nCalls per dependency:")
+    for dependency, operations in sorted(calls.items()):
+        print(f"  {dependency}: {sum(operations.values())}")
+        for operation, total in operations.most_common():
+            print(f"    {operation}: {total}")
+    if errors:
+        print("\nErrors:")
+        for source, total in errors.most_common():
+            print(f"  {source}: {total}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured SNS and cron traffic against local stand-ins")
+    parser.add_argument('captures', nargs='+', help="capture files (.jsonl or .jsonl.gz) or directories")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed relative to the capture (1 = real time, 0 = as fast as possible)")
+    parser.add_argument('--quest-id', help="quest ID of the replayed stack (default: the most frequent in the captures)")
+    parser.add_argument('--seed-teams', action='store_true', help="initialize every team seen in the captures first")
+    parser.add_argument('--team-apps-down', action='store_true', help="make every team app probe fail")
+    parser.add_argument('--verbose', action='store_true', help="show the handler logs")
+    args = parser.parse_args()
+
+    captures = read_captures(args.captures)
+    install_stand_ins(args.quest_id or guess_quest_id(captures), not args.team_apps_down)
+    if args.seed_teams:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            seeded = seed_teams(captures)
+        print(f"Seeded {seeded} teams")
+    elapsed, latencies = replay(captures, args.speed, args.verbose)
+    report(elapsed, latencies)
+
+
+if __name__ == '__main__':
+    main()
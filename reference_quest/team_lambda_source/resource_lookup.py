@@ -1,11 +1,30 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import urllib3
 import cfn_response
 import json
 
+# The default network facts of the account are cached in this SSM parameter (per account and region, as parameters
+# are regional), so that repeated stack updates only describe the default VPC again. The cached facts are used while
+# they are younger than NETWORK_CACHE_MAX_AGE_SECONDS and their fingerprint matches; delete the parameter to force a
+# new lookup.
+NETWORK_CACHE_PARAMETER = os.environ.get('NETWORK_CACHE_PARAMETER', '/gameday/resource-lookup/default-network')
+NETWORK_CACHE_MAX_AGE_SECONDS = int(os.environ.get('NETWORK_CACHE_MAX_AGE_SECONDS', '86400'))
+
+# Increase when the lookups or the cached facts change, so that the entries cached by the previous version are ignored
+NETWORK_CACHE_VERSION = 2
+
+#remove problematic AZ
+EXCLUDED_AZ_IDS = ['use1-az3']
+
 http = urllib3.PoolManager()
+ec2_client = boto3.client('ec2')
+ssm_client = boto3.client('ssm')
 
 # This function is triggered by a CloudFormation custom resource. It looks up default resources in an AWS account, such as
 # default VPC, subnets, CIDR, and return them to the CFN template to be referenced in other blocks. The main purpose is
@@ -17,8 +36,6 @@ def lambda_handler(event, context):
 
         response_data = {}
 
-        ec2_client = boto3.client('ec2')
-
         if event['RequestType'] == 'Delete':
             try:
                 cfn_response.send(event, context, cfn_response.SUCCESS, response_data)
@@ -29,48 +46,13 @@ def lambda_handler(event, context):
                 return
         else:  # request type is create or update
             try:
-                vpcs = ec2_client.describe_vpcs(Filters=[{
-                    'Name': 'is-default',
-                    'Values': ['true']
-                }])
-                print(f"Custom resource lambda execution for vpcs: {vpcs}")
-                vpc = vpcs["Vpcs"][0]["VpcId"]
-                cidr = vpcs["Vpcs"][0]["CidrBlock"]
-
-                response_data["VpcId"] = vpc
-                response_data["CidrBlock"] = cidr
-
-
-                print(f"Custom resource lambda execution for vpc: {vpc}")
-                subnets = ec2_client.describe_subnets(Filters=[{
-                    'Name': 'vpc-id',
-                    'Values': [vpc]
-                }, {
-                    'Name': 'default-for-az',
-                    'Values': ["true"]
-                },
-                ])
-
-                print(f"Custom resource lambda execution for subnets: {subnets}")
-
-                subnets = get_three_subnets(subnets)
-
-                response_data["SubnetId1"] = subnets[0]
-                response_data["SubnetId2"] = subnets[1]
-                response_data["SubnetId3"] = subnets[2]
-
-                default_security_group = ec2_client.describe_security_groups(GroupNames=['default'])
-                response_data["SecurityGroupIds"] = default_security_group["SecurityGroups"][0]["GroupId"]
-
-                route_tables = ec2_client.describe_route_tables(Filters=[{
-                    'Name': 'vpc-id',
-                    'Values': [vpc]
-                }, {
-                    'Name': 'association.main',
-                    'Values': ["true"]
-                },
-                ])
-                response_data["RouteTableId"] = route_tables["RouteTables"][0]["RouteTableId"]
+                vpc = lookup_default_vpc()
+                fingerprint = network_fingerprint(context, vpc["VpcId"])
+                network = read_cached_network(fingerprint)
+                if network is None:
+                    network = lookup_network(vpc)
+                    write_cached_network(fingerprint, network)
+                response_data.update(network)
 
                 print(f"Custom resource lambda execution for response_data: {response_data}")
 
@@ -91,22 +73,98 @@ def get_three_subnets(subnets):
 
     res = []
 
-    for subnet in subnets["Subnets"]:
+    for subnet in subnets:
         if len(res) == 3:
             break
-        availability_zone_id = subnet["AvailabilityZoneId"]
-        #remove problematic AZ
-        if availability_zone_id == "use1-az3":
+        if subnet["AvailabilityZoneId"] in EXCLUDED_AZ_IDS:
             continue
 
         subnetId = subnet["SubnetId"]
         res.append(subnetId)
 
     # Fill out with blanks if less than 3 subnets
-    for x in range(3):
-        if x+1 > len(res):
-            res.append("")
+    res += [""] * (3 - len(res))
 
     return res
 
 
+# All the resources of a paginated EC2 describe call
+def describe_all(operation, result_key, **kwargs):
+    return [resource for page in ec2_client.get_paginator(operation).paginate(**kwargs) for resource in page[result_key]]
+
+
+# The default VPC of the account, looked up on every invocation as its ID is part of the cache fingerprint
+def lookup_default_vpc():
+    vpcs = describe_all('describe_vpcs', 'Vpcs', Filters=[{'Name': 'is-default', 'Values': ['true']}])
+    print(f"Custom resource lambda execution for vpcs: {vpcs}")
+    return vpcs[0]
+
+
+# Looks up the default subnets, security group and main route table of the default VPC. The three describe calls do
+# not depend on each other, so they are issued concurrently.
+def lookup_network(vpc):
+    vpc_id = vpc["VpcId"]
+    print(f"Custom resource lambda execution for vpc: {vpc_id}")
+    vpc_filter = {'Name': 'vpc-id', 'Values': [vpc_id]}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        subnets = executor.submit(describe_all, 'describe_subnets', 'Subnets',
+                                  Filters=[vpc_filter, {'Name': 'default-for-az', 'Values': ['true']}])
+        security_groups = executor.submit(describe_all, 'describe_security_groups', 'SecurityGroups',
+                                          Filters=[vpc_filter, {'Name': 'group-name', 'Values': ['default']}])
+        route_tables = executor.submit(describe_all, 'describe_route_tables', 'RouteTables',
+                                       Filters=[vpc_filter, {'Name': 'association.main', 'Values': ['true']}])
+
+    vpc_subnets = [subnet for subnet in subnets.result() if subnet["VpcId"] == vpc_id]
+    print(f"Custom resource lambda execution for subnets: {vpc_subnets}")
+    subnet_ids = get_three_subnets(vpc_subnets)
+
+    return {
+        "VpcId": vpc_id,
+        "CidrBlock": vpc["CidrBlock"],
+        "SubnetId1": subnet_ids[0],
+        "SubnetId2": subnet_ids[1],
+        "SubnetId3": subnet_ids[2],
+        "SecurityGroupIds": next(group["GroupId"] for group in security_groups.result() if group["VpcId"] == vpc_id),
+        "RouteTableId": next(table["RouteTableId"] for table in route_tables.result() if table["VpcId"] == vpc_id),
+    }
+
+
+# Identifies what the cached facts were looked up for: the account, the region, the default VPC and the lookup rules.
+# A default VPC that was deleted and created again has a new ID, so its facts are looked up again.
+def network_fingerprint(context, vpc_id):
+    account_id = context.invoked_function_arn.split(':')[4]
+    lookup = [NETWORK_CACHE_VERSION, account_id, os.environ.get('AWS_REGION'), vpc_id, EXCLUDED_AZ_IDS]
+    return hashlib.sha256(json.dumps(lookup).encode('utf-8')).hexdigest()
+
+
+# :returns: the cached network facts, None if they are missing, stale or were looked up for something else
+def read_cached_network(fingerprint):
+    try:
+        cached = json.loads(ssm_client.get_parameter(Name=NETWORK_CACHE_PARAMETER)['Parameter']['Value'])
+    except ssm_client.exceptions.ParameterNotFound:
+        print(f"No cached network facts in {NETWORK_CACHE_PARAMETER}, looking them up")
+        return None
+    except Exception as e:
+        print(f"Error while reading the cached network facts, looking them up: {e}")
+        return None
+    if cached.get('fingerprint') != fingerprint:
+        print(f"Cached network facts in {NETWORK_CACHE_PARAMETER} do not match this lookup, looking them up")
+        return None
+    if time.time() - cached.get('cached-at', 0) > NETWORK_CACHE_MAX_AGE_SECONDS:
+        print(f"Cached network facts in {NETWORK_CACHE_PARAMETER} are older than {NETWORK_CACHE_MAX_AGE_SECONDS}s, looking them up")
+        return None
+    print(f"Using the network facts cached in {NETWORK_CACHE_PARAMETER}")
+    return cached['network']
+
+
+# Caching is best effort: the stack deploy goes on when the parameter cannot be written
+def write_cached_network(fingerprint, network):
+    try:
+        ssm_client.put_parameter(
+            Name=NETWORK_CACHE_PARAMETER,
+            Value=json.dumps({'fingerprint': fingerprint, 'cached-at': int(time.time()), 'network': network}),
+            Type='String',
+            Overwrite=True
+        )
+    except Exception as e:
+        print(f"Error while caching the network facts in {NETWORK_CACHE_PARAMETER}, continuing: {e}")
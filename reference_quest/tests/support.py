@@ -0,0 +1,57 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import sys
+import types
+
+# Shared setup of the tests: the central Lambda modules read their configuration from environment variables and
+# create their AWS clients when imported, so the variables are set before any of them is imported. No AWS call is made:
+# the tests replace the clients they exercise.
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'central_lambda_source')
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'QUEST_ID': 'quest-a',
+    'QUEST_API_BASE': 'https://quests.example.com/',
+    'QUEST_API_TOKEN': 'token',
+    'GAMEDAY_REGION': 'us-east-1',
+    'EVENT_RULE_CRON': 'cron-rule',
+    'INIT_LAMBDA': 'quest-a-init',
+    'UPDATE_LAMBDA': 'quest-a-update',
+    'CHECK_TEAM_LAMBDA': 'quest-a-check-team',
+    'QUEST_TEAM_STATUS_TABLE': 'quest-a-team-status',
+    'QUEST_SUBMISSION_TABLE': 'quest-a-submissions',
+    'NEEDS_EVALUATION_INDEX': 'NeedsEvaluationIndex',
+    'ASSETS_BUCKET': 'assets',
+    'ASSETS_BUCKET_PREFIX': '',
+}
+for name, value in ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+# The Quests API client package is distributed with the GameDay Quests Development Kit rather than on PyPI. The tests
+# never call it, so an empty placeholder is registered when it is not installed.
+try:
+    import aws_gameday_quests.gdQuestsApi  # noqa: F401
+except ImportError:
+    quests_api = types.ModuleType('aws_gameday_quests.gdQuestsApi')
+    quests_api.GameDayQuestsApiClient = type('GameDayQuestsApiClient', (), {'__init__': lambda self, *args: None})
+    sys.modules['aws_gameday_quests'] = types.ModuleType('aws_gameday_quests')
+    sys.modules['aws_gameday_quests.gdQuestsApi'] = quests_api
+
+
+# Stand-in of GameDayQuestsApiClient: every method returns the given response and records its call
+class StubQuestsApiClient:
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = []
+
+    def __getattr__(self, method_name):
+        def method(**kwargs):
+            self.calls.append((method_name, kwargs))
+            return {'statusCode': self.status_code}
+        return method
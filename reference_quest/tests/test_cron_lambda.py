@@ -0,0 +1,62 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import unittest
+from unittest import mock
+import support
+import cron_lambda
+import dynamodb_utils
+import quest_registry
+
+
+# Team status table answering the NeedsEvaluationIndex query with the given teams
+class IndexTable:
+    name = 'quest-a-team-status'
+
+    def __init__(self, team_ids):
+        self.team_ids = team_ids
+
+    def query(self, **kwargs):
+        return {'Items': [{'team-id': team_id} for team_id in self.team_ids]}
+
+
+class SweepQuestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.quest = quest_registry.local_quest()
+        self.table = IndexTable(['team-1', 'team-2', 'team-3'])
+        for patcher in (mock.patch.object(quest_registry, 'get_team_status_table', return_value=self.table),
+                        mock.patch.object(dynamodb_utils, 'backfilled_tables', {IndexTable.name})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(cron_lambda.lambda_client, 'invoke', return_value={'StatusCode': 202})
+        self.invoke = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_teams_with_quest_in_progress_are_checked(self):
+        quests_api_client = support.StubQuestsApiClient()
+        quests_api_client.get_teams_for_quest = lambda quest_id: [
+            {'team-id': 'team-1', 'quest-state': 'IN_PROGRESS'},
+            {'team-id': 'team-2', 'quest-state': 'NOT_STARTED'},
+            {'team-id': 'team-3', 'quest-state': 'STOPPED'},
+        ]
+
+        cron_lambda.sweep_quest(self.quest, quests_api_client)
+
+        checked = [json.loads(call.kwargs['Payload'])['team-id'] for call in self.invoke.call_args_list]
+        self.assertEqual(checked, ['team-1'])
+
+    def test_only_the_local_quest_table_is_backfilled(self):
+        quests_api_client = support.StubQuestsApiClient()
+        quests_api_client.get_teams_for_quest = lambda quest_id: []
+        other_quest = self.quest._replace(quest_id='quest-b', team_status_table='quest-b-team-status')
+
+        with mock.patch.object(dynamodb_utils, 'backfill_needs_evaluation') as backfill:
+            cron_lambda.sweep_quest(other_quest, quests_api_client)
+            backfill.assert_not_called()
+            cron_lambda.sweep_quest(self.quest, quests_api_client)
+            backfill.assert_called_once_with(self.table)
+
+
+if __name__ == '__main__':
+    unittest.main()
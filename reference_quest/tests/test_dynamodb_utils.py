@@ -0,0 +1,60 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import dynamodb_utils
+
+TABLE = 'quest-a-team-status'
+
+
+def batch_response(team_ids, unprocessed=None):
+    response = {'Responses': {TABLE: [{'team-id': team_id} for team_id in team_ids]}}
+    if unprocessed:
+        response['UnprocessedKeys'] = {TABLE: {'Keys': [{'team-id': team_id} for team_id in unprocessed]}}
+    return response
+
+
+class GetExistingTeamIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(dynamodb_utils.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_duplicate_team_ids_are_requested_once(self):
+        dynamodb = mock.Mock()
+        dynamodb.batch_get_item.return_value = batch_response(['1'])
+
+        existing = dynamodb_utils.get_existing_team_ids(dynamodb, TABLE, [1, '1', 2, 1])
+
+        self.assertEqual(existing, {'1'})
+        request = dynamodb.batch_get_item.call_args.kwargs['RequestItems'][TABLE]
+        self.assertEqual(request['Keys'], [{'team-id': '1'}, {'team-id': '2'}])
+
+    def test_unprocessed_keys_are_retried_with_backoff(self):
+        dynamodb = mock.Mock()
+        dynamodb.batch_get_item.side_effect = [
+            batch_response([], unprocessed=['1', '2']),
+            batch_response(['1'], unprocessed=['2']),
+            batch_response(['2']),
+        ]
+
+        existing = dynamodb_utils.get_existing_team_ids(dynamodb, TABLE, ['1', '2'])
+
+        self.assertEqual(existing, {'1', '2'})
+        self.assertEqual([call.args[0] for call in self.sleep.call_args_list],
+                         [dynamodb_utils.BATCH_GET_BACKOFF_SECONDS, dynamodb_utils.BATCH_GET_BACKOFF_SECONDS * 2])
+
+    def test_unprocessed_keys_give_up_after_max_retries(self):
+        dynamodb = mock.Mock()
+        dynamodb.batch_get_item.return_value = batch_response([], unprocessed=['1'])
+
+        with self.assertRaises(RuntimeError):
+            dynamodb_utils.get_existing_team_ids(dynamodb, TABLE, ['1'])
+
+        self.assertEqual(dynamodb.batch_get_item.call_count, dynamodb_utils.BATCH_GET_MAX_RETRIES + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
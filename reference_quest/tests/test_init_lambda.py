@@ -0,0 +1,34 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import init_lambda
+
+
+class LambdaHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        for target, name in ((init_lambda.content_catalog, 'refresh'), (init_lambda, 'GameDayQuestsApiClient')):
+            patcher = mock.patch.object(target, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_outcomes_are_returned_when_every_team_is_handled(self):
+        outcomes = {'team-1': {'status': init_lambda.INIT_STATUS_INITIALIZED},
+                    'team-2': {'status': init_lambda.INIT_STATUS_MISSING_CREDENTIALS}}
+        with mock.patch.object(init_lambda, 'initialize_teams', return_value=outcomes):
+            self.assertEqual(init_lambda.lambda_handler({'team_ids': ['team-1', 'team-2']}, None), outcomes)
+
+    def test_failed_team_fails_the_invocation_after_the_batch(self):
+        outcomes = {'team-1': {'status': init_lambda.INIT_STATUS_INITIALIZED},
+                    'team-2': {'status': init_lambda.INIT_STATUS_FAILED, 'error': 'SSM unavailable'}}
+        with mock.patch.object(init_lambda, 'initialize_teams', return_value=outcomes) as initialize_teams:
+            with self.assertRaisesRegex(RuntimeError, 'SSM unavailable'):
+                init_lambda.lambda_handler({'team_ids': ['team-1', 'team-2']}, None)
+
+        self.assertEqual(initialize_teams.call_args.args[1], ['team-1', 'team-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support
+import outbox
+import score_ledger
+
+
+def team_with_outbox(attempts=0):
+    team_data = {'team-id': 'team-1', 'version': 1}
+    outbox.record(team_data, 'post_output', {'team_id': 'team-1', 'quest_id': 'quest-a', 'key': 'task1'})
+    outbox.record(team_data, 'delete_output', {'team_id': 'team-1', 'quest_id': 'quest-a', 'key': 'task1'})
+    for entry in team_data[outbox.OUTBOX_ATTRIBUTE].values():
+        entry['attempts'] = attempts
+    return team_data
+
+
+def status_table():
+    table = mock.Mock()
+    table.put_item.return_value = {}
+    table.update_item.return_value = {}
+    return table
+
+
+class DrainTest(unittest.TestCase):
+
+    def test_delivered_entries_are_removed(self):
+        team_data = team_with_outbox()
+
+        delivered = outbox.drain(support.StubQuestsApiClient(200), team_data, status_table())
+
+        self.assertEqual(delivered, 2)
+        self.assertNotIn(outbox.OUTBOX_ATTRIBUTE, team_data)
+
+    def test_rejected_entries_stay_and_count_attempts(self):
+        team_data = team_with_outbox()
+        quests_api_client = support.StubQuestsApiClient(500)
+
+        delivered = outbox.drain(quests_api_client, team_data, status_table())
+
+        self.assertEqual(delivered, 0)
+        entries = team_data[outbox.OUTBOX_ATTRIBUTE]
+        self.assertEqual(sorted(entries), ['0000000001', '0000000002'])
+        self.assertEqual(entries['0000000001']['attempts'], 1)
+        # The later entry on the same output waits for the rejected one
+        self.assertEqual(entries['0000000002']['attempts'], 0)
+        self.assertEqual([method for method, _ in quests_api_client.calls], ['post_output'])
+
+    def test_rejected_entries_are_dropped_after_max_attempts(self):
+        team_data = team_with_outbox(attempts=outbox.MAX_ATTEMPTS - 1)
+
+        outbox.drain(support.StubQuestsApiClient(500), team_data, status_table())
+
+        self.assertEqual(sorted(team_data[outbox.OUTBOX_ATTRIBUTE]), ['0000000002'])
+
+
+
+# Rejects the score events and accepts the other calls
+class ScoreRejectingClient(support.StubQuestsApiClient):
+
+    def post_score_event(self, **kwargs):
+        self.calls.append(('post_score_event', kwargs))
+        return {'statusCode': 500}
+
+
+def completed_team():
+    team_data = {'team-id': 'team-1', 'version': 1}
+    score_ledger.award(team_data, 'quest-complete', 'Quest complete', 100)
+    outbox.record(team_data, 'post_output', {'team_id': 'team-1', 'quest_id': 'quest-a', 'key': 'quest_complete'})
+    outbox.record(team_data, 'post_quest_complete', {'team_id': 'team-1', 'quest_id': 'quest-a'})
+    return team_data
+
+
+class DeliverTest(unittest.TestCase):
+
+    def test_quest_is_completed_after_the_outputs_and_score_events(self):
+        team_data = completed_team()
+        quests_api_client = support.StubQuestsApiClient(200)
+
+        outbox.deliver(quests_api_client, 'quest-a', team_data, status_table())
+
+        self.assertEqual([method for method, _ in quests_api_client.calls],
+                         ['post_output', 'post_score_event', 'post_quest_complete'])
+        self.assertNotIn(outbox.OUTBOX_ATTRIBUTE, team_data)
+
+    def test_quest_completion_waits_for_rejected_score_events(self):
+        team_data = completed_team()
+        quests_api_client = ScoreRejectingClient()
+
+        outbox.deliver(quests_api_client, 'quest-a', team_data, status_table())
+
+        self.assertEqual([method for method, _ in quests_api_client.calls], ['post_output', 'post_score_event'])
+        [(_, entry)] = outbox.pending_entries(team_data)
+        self.assertEqual(entry['method'], 'post_quest_complete')
+        self.assertEqual(entry['attempts'], 0)
+
+    def test_quest_completion_waits_for_the_earlier_entries(self):
+        team_data = completed_team()
+        team_data[score_ledger.LEDGER_ATTRIBUTE]['quest-complete']['status'] = score_ledger.STATUS_ACKNOWLEDGED
+        quests_api_client = support.StubQuestsApiClient(500)
+
+        outbox.drain(quests_api_client, team_data, status_table())
+
+        self.assertEqual([method for method, _ in quests_api_client.calls], ['post_output'])
+        self.assertEqual(len(outbox.pending_entries(team_data)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import socket
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import probe_utils
+
+ADDRESSES = [
+    (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('2001:db8::1', 443, 0, 0)),
+    (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 443)),
+]
+
+
+class ProbeConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(probe_utils, 'resolve', return_value=ADDRESSES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_socket_creation_failure_raises_the_socket_error(self):
+        error = OSError('Address family not supported by protocol')
+        with mock.patch.object(probe_utils.socket, 'socket', side_effect=error) as create_socket:
+            with self.assertRaises(OSError) as raised:
+                probe_utils.ProbeConnection('app.example.com').connect()
+
+        self.assertIs(raised.exception, error)
+        self.assertEqual(create_socket.call_count, len(ADDRESSES))
+
+    def test_socket_creation_failure_falls_back_to_the_next_address(self):
+        sock = mock.Mock()
+        connection = probe_utils.ProbeConnection('app.example.com')
+        connection._context = mock.Mock()
+        with mock.patch.object(probe_utils.socket, 'socket', side_effect=[OSError('IPv6 unavailable'), sock]):
+            connection.connect()
+
+        sock.connect.assert_called_once_with(('192.0.2.1', 443))
+        self.assertIs(connection.sock, connection._context.wrap_socket.return_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
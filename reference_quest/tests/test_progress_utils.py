@@ -0,0 +1,58 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import progress_utils
+import state_codec
+
+
+def team_item(team_id, **flags):
+    return state_codec.encode({'team-id': team_id, 'version': 1, **flags})
+
+
+class RecomputeProgressTest(unittest.TestCase):
+
+    def test_aggregate_is_rebuilt_from_the_team_items(self):
+        table = mock.Mock()
+        table.name = 'quest-a-team-status'
+        stored_items = {
+            # Drifted counts, and team-2 is recorded in the stage it left
+            progress_utils.PROGRESS_ITEM_ID: {'stage-counts': {'task1': 5, 'task2': -1}},
+            progress_utils.stage_item_id('task1'): {'entered-at': {'team-1': 100, 'team-2': 200}},
+        }
+        table.get_item.side_effect = lambda Key: (
+            {'Item': stored_items[Key['team-id']]} if Key['team-id'] in stored_items else {})
+        table.scan.side_effect = [
+            {'Items': [team_item('team-1'), {'team-id': progress_utils.PROGRESS_ITEM_ID}], 'LastEvaluatedKey': {'team-id': 'team-1'}},
+            {'Items': [team_item('team-2', **{'is-webapp-up': True})]},
+        ]
+
+        with mock.patch.object(progress_utils.time, 'time', return_value=300):
+            stage_counts = progress_utils.recompute_progress(table)
+
+        self.assertEqual(stage_counts, {'task1': 1, 'task2': 1, 'task3': 0, 'task4': 0, 'complete': 0})
+        self.assertEqual(table.scan.call_args_list[1].kwargs, {'ExclusiveStartKey': {'team-id': 'team-1'}})
+        items = {call.kwargs['Item']['team-id']: call.kwargs['Item'] for call in table.put_item.call_args_list}
+        self.assertEqual(items[progress_utils.PROGRESS_ITEM_ID], {
+            'team-id': progress_utils.PROGRESS_ITEM_ID, 'stage-counts': stage_counts})
+        self.assertEqual(items[progress_utils.stage_item_id('task1')]['entered-at'], {'team-1': 100})
+        self.assertEqual(items[progress_utils.stage_item_id('task2')]['entered-at'], {'team-2': 300})
+        self.assertEqual(items[progress_utils.stage_item_id('complete')]['entered-at'], {})
+
+
+class RecordTransitionTest(unittest.TestCase):
+
+    def test_entry_time_moves_between_the_stage_items(self):
+        table = mock.Mock()
+        with mock.patch.object(progress_utils, 'progress_item_ready', True), \
+                mock.patch.object(progress_utils.time, 'time', return_value=300):
+            progress_utils.record_transition(table, 'team-1', 'task1', 'task2')
+
+        updated = [call.kwargs['Key']['team-id'] for call in table.update_item.call_args_list]
+        self.assertEqual(updated, [progress_utils.PROGRESS_ITEM_ID, progress_utils.stage_item_id('task2'),
+                                   progress_utils.stage_item_id('task1')])
+        self.assertNotIn('entered-at', str(table.update_item.call_args_list[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support
+import score_ledger
+
+
+def team_with_award():
+    team_data = {'team-id': 'team-1', 'version': 1}
+    score_ledger.award(team_data, 'task1-correct', 'Task 1 complete', 500)
+    return team_data
+
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = mock.Mock()
+        self.table.put_item.return_value = {}
+        self.table.update_item.return_value = {}
+
+    def test_accepted_events_are_acknowledged(self):
+        team_data = team_with_award()
+
+        acknowledged = score_ledger.flush(support.StubQuestsApiClient(200), 'quest-a', team_data, self.table)
+
+        self.assertEqual(acknowledged, 1)
+        self.assertEqual(score_ledger.pending_entries(team_data), [])
+
+    def test_rejected_events_stay_pending(self):
+        team_data = team_with_award()
+
+        acknowledged = score_ledger.flush(support.StubQuestsApiClient(500), 'quest-a', team_data, self.table)
+
+        self.assertEqual(acknowledged, 0)
+        self.assertEqual([entry_id for entry_id, _ in score_ledger.pending_entries(team_data)], ['task1-correct'])
+        self.table.put_item.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
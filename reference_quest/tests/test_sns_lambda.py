@@ -0,0 +1,68 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import os
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import quest_const
+import quest_registry
+import sns_lambda
+
+
+def sns_event(quest_id, sns_type, **values):
+    message = {'team-id': 'team-1', 'quest-id': quest_id, **values}
+    return {'Records': [{'Sns': {
+        'Message': json.dumps(message),
+        'MessageAttributes': {'event': {'Value': sns_type}},
+    }}]}
+
+
+class RegistryRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        second_quest = {'quest-id': 'quest-b', 'init-lambda': 'quest-b-init', 'update-lambda': 'quest-b-update',
+                        'check-team-lambda': 'quest-b-check-team', 'team-status-table': 'quest-b-team-status'}
+        patcher = mock.patch.dict(os.environ, {'QUEST_REGISTRY': json.dumps([second_quest])})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        quest_registry.quests.clear()
+        quest_registry.registry_loaded = False
+        self.addCleanup(quest_registry.quests.clear)
+
+        patcher = mock.patch.object(sns_lambda.lambda_client, 'invoke', return_value={'StatusCode': 202})
+        self.invoke = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_second_quest_input_is_routed_to_its_update_lambda(self):
+        sns_lambda.lambda_handler(sns_event('quest-b', quest_const.QUEST_INPUT_UPDATED, key='k', value='v'), None)
+
+        self.invoke.assert_called_once()
+        self.assertEqual(self.invoke.call_args.kwargs['FunctionName'], 'quest-b-update')
+        self.assertEqual(json.loads(self.invoke.call_args.kwargs['Payload']),
+                         {'team_id': 'team-1', 'key': 'k', 'value': 'v'})
+
+    def test_unknown_quest_is_disregarded(self):
+        sns_lambda.lambda_handler(sns_event('quest-z', quest_const.QUEST_INPUT_UPDATED, key='k', value='v'), None)
+
+        self.invoke.assert_not_called()
+
+    def test_dispatch_failure_fails_the_invocation(self):
+        self.invoke.side_effect = RuntimeError('Lambda unavailable')
+
+        with self.assertRaises(RuntimeError):
+            sns_lambda.lambda_handler(sns_event('quest-b', quest_const.QUEST_INPUT_UPDATED, key='k', value='v'), None)
+
+    def test_in_process_failure_fails_the_invocation(self):
+        update_lambda = mock.Mock()
+        update_lambda.lambda_handler.side_effect = RuntimeError('DynamoDB unavailable')
+        with mock.patch.object(sns_lambda, 'DIRECT_DISPATCH', True), \
+                mock.patch.dict('sys.modules', {'update_lambda': update_lambda}):
+            with self.assertRaises(RuntimeError):
+                sns_lambda.lambda_handler(sns_event('quest-a', quest_const.QUEST_INPUT_UPDATED, key='k', value='v'), None)
+
+        self.invoke.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support  # noqa: F401
+import ssm_utils
+
+
+def ssm_client(values):
+    client = mock.Mock()
+
+    def get_parameters(Names, WithDecryption):
+        return {
+            'Parameters': [{'Name': name, 'Value': values[name]} for name in Names if name in values],
+            'InvalidParameters': [name for name in Names if name not in values],
+        }
+    client.get_parameters.side_effect = get_parameters
+    return client
+
+
+class GetTeamCredentialsTest(unittest.TestCase):
+
+    LD_VALUES = {
+        ssm_utils.LD_SERVER_KEY_PARAM: 'server-key',
+        ssm_utils.LD_CLIENT_KEY_PARAM: 'client-key',
+        ssm_utils.LD_SIGNON_URL_PARAM: 'https://signon.example.com',
+    }
+
+    def test_missing_table_number_is_reported_by_default(self):
+        credentials = ssm_utils.get_team_credentials(ssm_client(self.LD_VALUES))
+
+        self.assertEqual(credentials.missing, (ssm_utils.TABLE_NUMBER_PARAM,))
+
+    def test_only_the_requested_parameters_are_required(self):
+        client = ssm_client(self.LD_VALUES)
+
+        credentials = ssm_utils.get_team_credentials(client, ssm_utils.LD_CREDENTIAL_PARAMS)
+
+        self.assertTrue(credentials.is_complete())
+        self.assertEqual(credentials.ld_server_key, 'server-key')
+        self.assertIsNone(credentials.table_number)
+        self.assertEqual(client.get_parameters.call_args.kwargs['Names'], ssm_utils.LD_CREDENTIAL_PARAMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved.
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import unittest
+from unittest import mock
+import support
+import input_const
+import outbox
+import output_const
+import quest_const
+import state_codec
+import team_state
+import update_lambda
+
+
+# Quests API stand-in for a running event, the quest of the team being in the given state
+class QuestsApiClient(support.StubQuestsApiClient):
+
+    def __init__(self, quest_state=quest_const.TEAM_QUEST_IN_PROGRESS):
+        super().__init__()
+        self.quest_state = quest_state
+
+    def get_event_status(self):
+        return {'status': quest_const.EVENT_IN_PROGRESS}
+
+    def get_quest_for_team(self, team_id, quest_id):
+        return {'quest-state': self.quest_state}
+
+
+def team(**flags):
+    return team_state.TeamState.from_item(state_codec.encode({'team-id': 'team-1', 'version': 1, **flags}))
+
+
+class InvalidUrlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.admit_submission = self.patch(update_lambda.dynamodb_utils, 'admit_submission')
+        self.save_team_data = self.patch(update_lambda.dynamodb_utils, 'save_team_data')
+        self.dispatch = self.patch(update_lambda.outbox, 'dispatch')
+        self.patch(update_lambda.content_catalog, 'refresh')
+        self.quests_api_client = QuestsApiClient()
+        self.patch(update_lambda, 'GameDayQuestsApiClient').side_effect = lambda *args: self.quests_api_client
+
+    def patch(self, target, attribute):
+        patcher = mock.patch.object(target, attribute)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def submit(self, team_data, value):
+        with mock.patch.object(update_lambda.dynamodb_utils, 'get_team_data', return_value=team_data):
+            update_lambda.lambda_handler({'team_id': 'team-1', 'key': input_const.TASK1_ENDPOINT_KEY, 'value': value}, None)
+
+    def test_invalid_url_is_rejected_before_admission(self):
+        team_data = team()
+
+        self.submit(team_data, 'not a url')
+
+        self.admit_submission.assert_not_called()
+        self.assertTrue(team_data['task1-invalid-url-posted'])
+        [entry] = outbox.pending_entries(team_data)
+        self.assertEqual(entry[1]['method'], 'post_output')
+        self.assertEqual(entry[1]['params']['key'], output_const.TASK1_APPRUNNER_INVALID_KEY)
+        self.save_team_data.assert_called_once()
+        self.dispatch.assert_called_once()
+
+    def test_invalid_url_is_ignored_once_the_web_app_is_up(self):
+        team_data = team(**{'is-webapp-up': True})
+
+        self.submit(team_data, 'not a url')
+
+        self.assertFalse(team_data['task1-invalid-url-posted'])
+        self.save_team_data.assert_not_called()
+
+    def test_invalid_url_is_ignored_when_the_quest_is_not_in_progress(self):
+        team_data = team()
+        self.quests_api_client = QuestsApiClient(quest_state='STOPPED')
+
+        self.submit(team_data, 'not a url')
+
+        self.assertFalse(team_data['task1-invalid-url-posted'])
+        self.assertEqual(outbox.pending_entries(team_data), [])
+        self.save_team_data.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()